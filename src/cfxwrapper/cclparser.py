@@ -1,8 +1,170 @@
 from openmdao.util.filewrap import FileParser
 
+from array import array
+from bisect import bisect_left
+import cPickle
+import hashlib
+import mmap
+import multiprocessing
+import os
 import pprint
+import re
+import tempfile
+
+from cfxunitsinfo import SlottedObject, intern_string
 
 pp = pprint.PrettyPrinter(indent=4)
+_field_splitter = re.compile('[= \t]+')
+
+class BlockIndex(object):
+    """Block matching index for the data of a StringArrayParser.
+
+       Built with one pass over the data: maps each block-opening row to
+       the row of its matching *end_string*.  The rows containing a given
+       anchor string are collected (in one pass) the first time that anchor
+       is looked up, and kept as a sorted list so later lookups are a bisect."""
+    def __init__(self, data, start_string, end_string, exclude_string):
+        self.data = data
+        self.size = len(data)
+        self.start_string = start_string
+        self.end_string = end_string
+        self.exclude_string = exclude_string
+        self.ends = {} # block-opening row -> matching end row
+        self.anchors = {} # anchor -> sorted list of rows containing it
+        stack = []
+        for i, line in enumerate(data):
+            if line.find(exclude_string) == -1:
+                if line.find(start_string) >= 0:
+                    stack.append(i)
+                elif line.find(end_string) >= 0 and stack:
+                    self.ends[stack.pop()] = i
+
+    def is_current(self, parser):
+        """True if this index still describes the data of *parser*."""
+        return self.data is parser.data and self.size == len(parser.data) \
+            and self.start_string == parser.start_string \
+            and self.end_string == parser.end_string \
+            and self.exclude_string == parser.exclude_string
+
+    def is_start(self, row):
+        line = self.data[row]
+        return line.find(self.exclude_string) == -1 and \
+            line.find(self.start_string) >= 0
+
+    def rows(self, anchor):
+        """Sorted list of the rows that contain *anchor*."""
+        rows = self.anchors.get(anchor)
+        if rows is None:
+            rows = [i for i, line in enumerate(self.data)
+                    if line.find(anchor) > -1]
+            self.anchors[anchor] = rows
+        return rows
+
+    def find(self, anchor, row):
+        """First row at or after *row* containing *anchor*, or -1."""
+        rows = self.rows(anchor)
+        i = bisect_left(rows, row)
+        if i < len(rows):
+            return rows[i]
+        return -1
+
+def strip_comments(line, start=0):
+    """Strip CCL comments (starting with #) from a line."""
+    index = line.find('#', start)
+    if index < 0: #no comment
+        return line
+    elif index == 0: #whole line is a comment
+        return ''
+    else:
+        if line[index-1] != '\\': # the # is not escaped
+            return line[:index]
+        else:
+            return strip_comments(line, index + 1)
+
+class MappedCCLFile(object):
+    """Read-only sequence of the preprocessed lines of a CCL file.
+
+       The file is memory mapped and scanned once.  Comments are stripped,
+       blank lines dropped and continuation lines joined in the same way as
+       StringArrayParser.preprocess, but instead of a list of strings only
+       the byte offsets of each line are kept, in array('l')s.  A line is
+       copied out of the map when it is indexed.
+
+       Line i is made of the byte ranges seg_starts[k]:seg_ends[k] for k
+       from first_seg[i] up to first_seg[i + 1]; only continued lines
+       have more than one range."""
+    def __init__(self, filename):
+        self.filename = filename
+        self.seg_starts = array('l')
+        self.seg_ends = array('l')
+        self.first_seg = array('l')
+        self.map = None
+        f = open(filename, 'rb')
+        try:
+            if os.fstat(f.fileno()).st_size > 0:
+                self.map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        finally:
+            f.close()
+        if self.map is not None:
+            self._scan()
+        self.first_seg.append(len(self.seg_starts))
+
+    def _scan(self):
+        mm = self.map
+        size = mm.size()
+        pos = 0
+        pending = False # the last segment added ends with a continuation
+        while pos < size:
+            nl = mm.find('\n', pos)
+            if nl < 0:
+                nl = size
+            line = strip_comments(mm[pos:nl].rstrip())
+            if len(line.strip()) > 0:
+                start = pos
+                end = pos + len(line)
+                if pending:
+                    start += len(line) - len(line.lstrip())
+                    self.seg_ends[-1] -= 1 # drop the continuation character
+                else:
+                    self.first_seg.append(len(self.seg_starts))
+                pending = line[-1] == '\\'
+                if not pending:
+                    end = pos + len(line.rstrip())
+                self.seg_starts.append(start)
+                self.seg_ends.append(end)
+            pos = nl + 1
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def __len__(self):
+        return len(self.first_seg) - 1
+
+    def line(self, i):
+        """Get line *i*, which must be in range."""
+        k = self.first_seg[i]
+        last = self.first_seg[i + 1]
+        mm = self.map
+        if last == k + 1:
+            return mm[self.seg_starts[k]:self.seg_ends[k]]
+        return ''.join([mm[self.seg_starts[j]:self.seg_ends[j]]
+                        for j in xrange(k, last)])
+
+    def __getitem__(self, i):
+        n = len(self)
+        if isinstance(i, slice):
+            return [self.line(j) for j in xrange(*i.indices(n))]
+        if i < 0:
+            i += n
+        if i < 0 or i >= n:
+            raise IndexError('line index out of range')
+        return self.line(i)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self.line(i)
 
 class StringArrayParser(FileParser):
     """Like FileParser for an array of data strings.
@@ -11,11 +173,15 @@ class StringArrayParser(FileParser):
     start_string = ':'
     exclude_string = '=' # when matching start and end,
                          # ignore lines containing exclude_string
-    def __init__(self, data_array, filename=''):
+    def __init__(self, data_array, filename='', mapped = False):
         super(StringArrayParser, self).__init__()
+        self._block_index = None
         #import pdb; pdb.set_trace()
         if filename == '':
             self.data = data_array
+        elif mapped:
+            self.filename = filename
+            self.data = MappedCCLFile(filename)
         else:
             self.set_file(filename)
             self.preprocess()
@@ -23,50 +189,53 @@ class StringArrayParser(FileParser):
 
     def strip_comments(self, line, start=0):
         """Strip CCL comments (starting with #) from a line."""
-        index = line.find('#', start)
-        if index < 0: #no comment
-            return line
-        elif index == 0: #whole line is a comment
-            return ''
-        else:
-            if line[index-1] != '\\': # the # is not escaped
-                return line[:index]
-            else:
-                return strip_comments(line, index + 1)
+        return strip_comments(line, start)
 
     def preprocess(self):
-        """Handles continuation lines ending with \
+        """Handles continuation lines ending with \\
            and comments starting with non-escaped #.
            Removes blank lines and trailing white space.
         """
-        n = len(self.data) - 1
-        i = n
-        while i >= 0:
-            line = self.data[i].rstrip()
-            line = self.strip_comments(line)
+        lines = [] #empty list
+        pending = None # continued line waiting for the next line
+        for line in self.data:
+            line = self.strip_comments(line.rstrip())
             if len(line.strip()) == 0:
-                del self.data[i]
+                continue
+            continued = line[-1] == '\\'
+            if pending is not None:
+                line = pending[:-1] + line.lstrip()
+            if continued:
+                pending = line
             else:
-                if i < n and line[len(line)-1] == '\\':
-                    #don't process a continuation on the last line
-                    #import pdb; pdb.set_trace()
-                    line = line[:-1] + self.data[i + 1].lstrip()
-                    del self.data[i + 1]
-                self.data[i] = line.rstrip()
-            i -= 1
-        #import pdb; pdb.set_trace()
+                lines.append(line.rstrip())
+                pending = None
+        if pending is not None:
+            #don't process a continuation on the last line
+            lines.append(pending.rstrip())
+        self.data[:] = lines
+        self._block_index = None
 
-            
-    def set_end_string(e):
+    def set_end_string(self, e):
         """Sets the end string to use for matching."""
         self.end_string = e
 
-    def set_start_string(e):
+    def set_start_string(self, e):
         """Sets the start string to use for matching."""
         self.start_string = e
-    def set_exclude_string(e):
+    def set_exclude_string(self, e):
         """Sets the exclude string to use for matching."""
         self.exclude_string = e
+
+    def block_index(self):
+        """Get the BlockIndex for the data, building it if the data or the
+           matching strings have changed since it was last built."""
+        index = self._block_index
+        if index is None or not index.is_current(self):
+            index = BlockIndex(self.data, self.start_string,
+                               self.end_string, self.exclude_string)
+            self._block_index = index
+        return index
    
     def find_end(self):
         """Finds end row in data that matches *current_row*.
@@ -74,7 +243,14 @@ class StringArrayParser(FileParser):
         Does not change the anchor.
         
         Returns -1 if not found."""
-        
+        index = self.block_index()
+        if self.current_row < len(self.data) and \
+           index.is_start(self.current_row):
+            return index.ends.get(self.current_row, -1)
+        return self._scan_end()
+
+    def _scan_end(self):
+        """Find the end row by walking forward from *current_row*."""
         endrow = -1
         depth = 1
         i = self.current_row + 1
@@ -96,15 +272,18 @@ class StringArrayParser(FileParser):
         return endrow
 
     def mark_anchor_withs(self, anchor, sr = 0):
-        if sr == 0:
-            self.mark_anchor(anchor)
-        else:
-            done = False
-            #import pdb; pdb.set_trace()
-            while not done:
-                self.mark_anchor(anchor)
-                if self.current_row >= sr:
-                    done = True
+        """Like mark_anchor, but moves to the first row at or after *sr*
+           that contains *anchor*.
+
+        Raises RuntimeError if there is no such row."""
+        row = self.current_row
+        if self.anchored:
+            row += 1 # mark_anchor moves past the current anchor
+        row = self.block_index().find(anchor, max(row, sr))
+        if row == -1:
+            raise RuntimeError('Could not find pattern ' + anchor)
+        self.current_row = row
+        self.anchored = True
             
     def find_range(self, anchor, sr = 0):
         """Finds the start and end rows in data for the entity that starts with *anchor*.
@@ -144,53 +323,34 @@ class CCLEntityParser(StringArrayParser):
 
     def parse(self, depth = 0):
         "Fill the dictionary."
-        #print 'Parse depth ' + str(depth) + ' data: '
-        #for s in self.data: print s
-        #import pdb; pdb.set_trace()
-        n = len(self.data)
-        i = 1
-        while i < n:
-            self.current_row = i
-            line = self.data[i]
-            words = line.split('=')
-            if len(words) > 1: #put into dictionary
-                key = words[0].strip()
-                value = words[1].strip()
-                self.dictionary[key] = value
-                #print 'Parse depth ' + str(depth) + ' key ' + key + ' value ' + value
-                i = i + 1
+        # open blocks as (anchor, dictionary); lines are classified by
+        # iter_ccl_events and filled in place, without sub-parsers
+        stack = [('', self.dictionary)]
+        for event, row, line in iter_ccl_events(self.data, 1):
+            self.current_row = row
+            if event == KEY_VALUE:
+                words = line.split('=')
+                stack[-1][1][words[0].strip()] = words[1].strip()
+            elif event == BEGIN_BLOCK:
+                stack.append((line.strip(), {}))
+            elif event == END_BLOCK and len(stack) > 1:
+                anchor, d = stack.pop()
+                stack[-1][1][anchor] = d
             else:
-                index = line.find(':')
-                if index > 0:
-                    anchor = line.strip()
-                    #import pdb; pdb.set_trace()
-                    endrow = self.find_end()
-                    if endrow == -1:
-                        do_logging(self.logger, 'Could not find end matching ' + anchor, both = True)
-                        break
-                    #print 'Parse depth ' +str(depth) + ' anchor ' + anchor
-                    #import pdb; pdb.set_trace()
-                    subparser = CCLEntityParser(self.data[i:endrow])
-                    subparser.parse(depth+1)
-                    
-                    self.dictionary[anchor] = subparser.dictionary
-                    i = endrow + 1
-                else:
-                    do_logging(self.logger, 'Unexpected line ' + line + ' depth ' + depth, both = True)
-                    import pdb; pdb.set_trace()
-                    i = i + 1
+                do_logging(self.logger, 'Unexpected line ' + line + ' depth ' +
+                           str(depth + len(stack) - 1), both = True)
+        if len(stack) > 1:
+            do_logging(self.logger, 'Could not find end matching ' +
+                       stack[1][0], both = True)
 
-class Boundary: 
+class Boundary(SlottedObject): 
     """Holds info about a CFX Boundary."""
-    attributes = {} # empty dictionary
-    name = ''
-    type = ''
+    __slots__ = ('name', 'type', 'attributes')
     def __init__(self, n, d):
         #import pdb; pdb.set_trace()
-        self.name = n
+        self.name = intern_string(n)
         self.attributes = d
-        if 'Boundary Type' in d:
-            self.type = d['Boundary Type']
+        self.type = intern_string(d.get('Boundary Type', ''))
     def output(self):
         s = 'Boundary: ' + self.type + ': ' + self.name + ' attributes: '
         s += pp.pformat(self.attributes)
@@ -203,19 +363,14 @@ class Boundary:
             loc_dict[self.name] = ''
         
 
-class Domain:
+class Domain(SlottedObject):
     """Holds info about a CFX Domain."""
-    name = ''
-    domaintype = ''
-    location = ''
-    inlets = [] #empty list
-    outlets = [] #empty list
-    openings = [] #empty list
-    interfaces = [] #empty list
-    walls = [] #empty list
-    symmetries = [] #empty list
+    __slots__ = ('name', 'domaintype', 'location', 'inlets', 'outlets',
+                 'openings', 'interfaces', 'walls', 'symmetries')
     def __init__(self, n):
-        self.name = n
+        self.name = intern_string(n)
+        self.domaintype = ''
+        self.location = ''
         self.inlets = [] #empty list
         self.outlets = [] #empty list
         self.openings = [] #empty list
@@ -259,17 +414,48 @@ class Domain:
         for x in self.symmetries:
             isinstance(x, Boundary)
             x.get_location_names(b_loc_dict)   
-class Flow:
-    """Holds info about a CFX Flow entity."""
-    name = ''
-    units = [] #empty list
-    domains = [] #empty list
-    monitorpoints = {} #empty dictionary
-    def __init__(self, n):
-        self.name = n
+class Flow(SlottedObject):
+    """Holds info about a CFX Flow entity.
+
+       A Flow made by a lazy CCLParser.parse has a loader, and its domains
+       and monitorpoints are only parsed the first time they are used."""
+    __slots__ = ('name', 'units', '_domains', '_monitorpoints', '_loader')
+    def __init__(self, n, loader = None):
+        self.name = intern_string(n)
         self.units = []
-        self.domains = []
-        self.monitorpoints = {} #empty dictionary
+        self._loader = loader
+        if loader is None:
+            self._domains = []
+            self._monitorpoints = {} #empty dictionary
+        else:
+            self._domains = None
+            self._monitorpoints = None
+
+    def _get_domains(self):
+        if self._domains is None:
+            self._domains = []
+            self._loader.load_domains(self)
+        return self._domains
+    def _set_domains(self, domains):
+        self._domains = domains
+    domains = property(_get_domains, _set_domains)
+
+    def _get_monitorpoints(self):
+        if self._monitorpoints is None:
+            self._monitorpoints = {}
+            self._loader.load_monitorpoints(self)
+        return self._monitorpoints
+    def _set_monitorpoints(self, monitorpoints):
+        self._monitorpoints = monitorpoints
+    monitorpoints = property(_get_monitorpoints, _set_monitorpoints)
+
+    def __getstate__(self):
+        # parse any sections not loaded yet; the loader is not pickled
+        self.domains
+        self.monitorpoints
+        state = SlottedObject.__getstate__(self)
+        state['_loader'] = None
+        return state
     def output(self):
         s = 'Flow: ' + self.name
         s += '\nUnits:'
@@ -294,7 +480,380 @@ class Flow:
                 s = u['Length Units']
                 units.add(s.lstrip('[').rstrip(']'))
 
-class CCLParser():
+# Line classes produced by iter_ccl_events.  They follow the same rules as
+# StringArrayParser.find_end: a line containing '=' is a key/value pair, a
+# line containing ':' opens a block and a line containing 'END' closes one.
+BEGIN_BLOCK = 'begin'
+KEY_VALUE = 'value'
+END_BLOCK = 'end'
+OTHER_LINE = 'other'
+
+# One precompiled pattern classifies a line: the alternatives are tried in
+# the order above and the name of the group that matched is the line class.
+_line_classes = re.compile('(?P<%s>[^=]*=)|(?P<%s>[^:]*:)|(?P<%s>.*END)' %
+                           (KEY_VALUE, BEGIN_BLOCK, END_BLOCK))
+
+def classify_line(line):
+    """Return KEY_VALUE, BEGIN_BLOCK, END_BLOCK or OTHER_LINE for *line*."""
+    m = _line_classes.match(line)
+    if m is None:
+        return OTHER_LINE
+    return m.lastgroup
+
+def iter_ccl_events(data, start = 0, end = None):
+    """Yield (event, row, line) for the preprocessed CCL lines in *data*.
+
+       Only rows *start* up to (but not including) *end* are visited, so a
+       section of a file can be streamed without slicing *data*."""
+    if end is None:
+        end = len(data)
+    match = _line_classes.match
+    for row in xrange(start, end):
+        line = data[row]
+        m = match(line)
+        if m is None:
+            yield OTHER_LINE, row, line
+        else:
+            yield m.lastgroup, row, line
+
+def _first_field(line, key):
+    """Return the first field after *key* on *line*, splitting on '= \\t'.
+
+       Gives the same answer as FileParser.transfer_keyvar(key, 1)."""
+    fields = [x for x in _field_splitter.split(line.replace(key, 'KeyField'))
+              if x]
+    if len(fields) > 1:
+        return fields[1]
+    return ''
+
+class _Frame(object):
+    """An open block on the CCLTreeBuilder stack."""
+    __slots__ = ('keyword', 'name', 'anchor', 'row', 'dictionary')
+    def __init__(self, keyword, name, anchor, row, dictionary):
+        self.keyword = keyword
+        self.name = name
+        self.anchor = anchor
+        self.row = row
+        self.dictionary = dictionary
+
+class CCLTreeBuilder(object):
+    """Builds the Flow/Domain/Boundary tree from a stream of CCL events.
+
+       The whole file is handled in a single pass over the lines: an explicit
+       stack holds the open blocks, and the dictionaries for boundaries,
+       solution units, expressions and monitor points are filled in place
+       as their lines go by."""
+    boundary_lists = {'INLET': 'inlets', 'OUTLET': 'outlets',
+        'OPENING': 'openings', 'WALL': 'walls', 'INTERFACE': 'interfaces',
+        'SYMMETRY': 'symmetries'}
+    monitor_keys = ('Expression Value', 'Option')
+
+    def __init__(self, logger = None):
+        self.logger = logger
+        self.expressions = {} # empty dictionary
+        self.flows = [] #empty list
+        self.stack = [] #empty list of _Frame
+        self.flow = None
+        self.domain = None
+        self.monitor = None
+        self.monitor_dict = None
+        self.library_row = -1 # row of the first LIBRARY: block
+        self.have_expressions = False
+
+    def feed(self, data, start = 0, end = None):
+        """Process rows *start* to *end* of the preprocessed lines in *data*."""
+        for event, row, line in iter_ccl_events(data, start, end):
+            if event == KEY_VALUE:
+                self.key_value(line)
+            elif event == BEGIN_BLOCK:
+                self.begin_block(row, line)
+            elif event == END_BLOCK:
+                self.end_block(line)
+            else:
+                self.other_line(line)
+
+    def enter_flow(self, flow, row):
+        """Start adding to *flow*, whose FLOW: line is at *row*, so that
+           sections of it can be fed on their own."""
+        self.flow = flow
+        self.stack.append(_Frame('FLOW', flow.name, 'FLOW: ' + flow.name,
+                                 row, None))
+
+    def leave_flow(self):
+        """Stop adding to the flow started by enter_flow."""
+        while self.stack:
+            frame = self.stack.pop()
+            if frame.keyword == 'FLOW':
+                break
+        self.close()
+
+    def close(self):
+        """Report any blocks still open at the end of the data."""
+        while self.stack:
+            frame = self.stack.pop()
+            do_logging(self.logger, 'Could not find end matching ' +
+                       frame.anchor, both = True)
+        self.flow = None
+        self.domain = None
+        self.monitor = None
+        self.monitor_dict = None
+
+    def _inside(self, keyword):
+        for frame in self.stack:
+            if frame.keyword == keyword:
+                return True
+        return False
+
+    def _domain_keys(self, line):
+        dmn = self.domain
+        if dmn.domaintype == '' and line.find('Domain Type') >= 0:
+            dmn.domaintype = _first_field(line, 'Domain Type')
+        if dmn.location == '' and line.find('Location') >= 0:
+            dmn.location = _first_field(line, 'Location')
+
+    def _monitor_keys(self, line):
+        d = self.monitor_dict
+        for k in self.monitor_keys:
+            if k in line:
+                s = line.replace(k, '')
+                s = s.replace('=', '')
+                d[k] = s.strip()
+
+    def key_value(self, line):
+        if self.domain is not None:
+            self._domain_keys(line)
+        if self.monitor is not None:
+            self._monitor_keys(line)
+        if self.stack:
+            d = self.stack[-1].dictionary
+            if d is not None:
+                words = line.split('=')
+                d[words[0].strip()] = words[1].strip()
+
+    def other_line(self, line):
+        if self.domain is not None:
+            self._domain_keys(line)
+        if self.monitor is not None:
+            self._monitor_keys(line)
+        if self.stack and self.stack[-1].dictionary is not None:
+            do_logging(self.logger, 'Unexpected line ' + line + ' depth ' +
+                       str(len(self.stack)), both = True)
+
+    def begin_block(self, row, line):
+        anchor = line.strip()
+        index = anchor.find(':')
+        keyword = anchor[:index].strip()
+        name = anchor[index + 1:].strip()
+        if self.domain is not None:
+            self._domain_keys(line)
+        if self.monitor is not None:
+            self._monitor_keys(line)
+
+        d = None
+        if self.stack and self.stack[-1].dictionary is not None:
+            d = {} #empty dictionary
+            self.stack[-1].dictionary[anchor] = d
+        frame = _Frame(keyword, name, anchor, row, d)
+
+        if keyword == 'LIBRARY':
+            if self.library_row == -1:
+                self.library_row = row
+        elif keyword == 'FLOW':
+            if self.flow is None:
+                self.flow = Flow(name)
+        elif self.flow is not None:
+            if keyword == 'DOMAIN':
+                if self.domain is None:
+                    self.domain = Domain(name)
+            elif keyword == 'BOUNDARY':
+                if self.domain is not None and frame.dictionary is None:
+                    frame.dictionary = {}
+            elif keyword == 'SOLUTION UNITS':
+                if len(self.flow.units) == 0 and frame.dictionary is None:
+                    frame.dictionary = {}
+            elif keyword == 'MONITOR POINT':
+                if self.monitor is None and \
+                   self._inside('MONITOR OBJECTS') and \
+                   self._inside('OUTPUT CONTROL'):
+                    self.monitor = frame
+                    self.monitor_dict = {} #empty dictionary
+        elif keyword == 'EXPRESSIONS':
+            if not self.have_expressions and self._inside('CEL') and \
+               len(self.stack) > 0 and self.stack[0].row == self.library_row:
+                frame.dictionary = {}
+        self.stack.append(frame)
+
+    def end_block(self, line):
+        if not self.stack:
+            return
+        frame = self.stack.pop()
+        if self.monitor is frame:
+            self.flow.monitorpoints[frame.name] = self.monitor_dict
+            self.monitor = None
+            self.monitor_dict = None
+        elif self.monitor is not None:
+            self._monitor_keys(line)
+        keyword = frame.keyword
+        if keyword == 'FLOW':
+            if self.flow is not None and not self._inside('FLOW'):
+                self.flows.append(self.flow)
+                self.flow = None
+        elif self.flow is None:
+            if keyword == 'EXPRESSIONS' and frame.dictionary is not None and \
+               not self.have_expressions:
+                self.expressions = frame.dictionary
+                self.have_expressions = True
+        elif keyword == 'DOMAIN':
+            if self.domain is not None and not self._inside('DOMAIN'):
+                self.flow.domains.append(self.domain)
+                self.domain = None
+        elif keyword == 'BOUNDARY':
+            if self.domain is not None:
+                self.add_boundary(Boundary(frame.name, frame.dictionary))
+        elif keyword == 'SOLUTION UNITS':
+            if len(self.flow.units) == 0 and frame.dictionary is not None:
+                self.flow.units.append(frame.dictionary)
+        if self.domain is not None:
+            self._domain_keys(line)
+
+    def add_boundary(self, b):
+        """Put Boundary *b* in the list of the current Domain for its type."""
+        attr = self.boundary_lists.get(b.type)
+        if attr is None:
+            do_logging(self.logger, 'Domain ' + self.domain.name +
+                       ': Boundary ' + b.name + ': unknown type ' + b.type,
+                       both = True)
+        else:
+            getattr(self.domain, attr).append(b)
+
+def child_blocks(index, start, end):
+    """Yield (keyword, name, startrow, endrow) for the blocks directly
+       inside rows *start* to *end* of the data of BlockIndex *index*."""
+    data = index.data
+    row = start
+    while row < end:
+        if index.is_start(row):
+            endrow = index.ends.get(row, -1)
+            if endrow == -1 or endrow >= end:
+                break
+            anchor = data[row].strip()
+            i = anchor.find(':')
+            yield anchor[:i].strip(), anchor[i + 1:].strip(), row, endrow
+            row = endrow + 1
+        else:
+            row += 1
+
+class BlockInfo(object):
+    """Rows of a block found by scan_blocks, its SHA-1 *digest* (if asked
+       for) and the BlockInfo of the blocks of interest inside it."""
+    __slots__ = ('keyword', 'name', 'startrow', 'endrow', 'digest',
+                 'children')
+    def __init__(self, keyword, name, startrow, endrow):
+        self.keyword = keyword
+        self.name = name
+        self.startrow = startrow
+        self.endrow = endrow
+        self.digest = ''
+        self.children = [] #empty list
+
+    def anchor(self):
+        if self.name == '':
+            return self.keyword + ':'
+        return self.keyword + ': ' + self.name
+
+# blocks looked for by scan_blocks, by the keyword of the enclosing block
+_scanned_blocks = {'': ('LIBRARY', 'FLOW'),
+    'FLOW': ('DOMAIN', 'SOLUTION UNITS', 'OUTPUT CONTROL'),
+    'DOMAIN': ('BOUNDARY',)}
+
+def _block_digest(data, startrow, endrow):
+    h = hashlib.sha1()
+    for row in xrange(startrow, endrow + 1):
+        h.update(data[row])
+        h.update('\n')
+    return h.hexdigest()
+
+def scan_blocks(index, digests = False, keyword = '', start = 0, end = None):
+    """Find the LIBRARY: and FLOW: blocks in the data of BlockIndex *index*,
+       the DOMAIN:, SOLUTION UNITS: and OUTPUT CONTROL: blocks directly in
+       each flow and the BOUNDARY: blocks directly in each domain.
+
+       Returns a list of BlockInfo for the top-level blocks.  If *digests*
+       is True the digest of the text of each block is filled in."""
+    if end is None:
+        end = len(index.data)
+    wanted = _scanned_blocks.get(keyword, ())
+    blocks = [] #empty list
+    for k, n, startrow, endrow in child_blocks(index, start, end):
+        if k in wanted:
+            b = BlockInfo(k, n, startrow, endrow)
+            if digests:
+                b.digest = _block_digest(index.data, startrow, endrow)
+            b.children = scan_blocks(index, digests, k, startrow + 1, endrow)
+            blocks.append(b)
+    return blocks
+
+def block_digests(blocks, path = (), digests = None):
+    """Map the path of each BlockInfo in the tree *blocks* to its digest.
+
+       A path is a tuple of block anchors such as
+       ('FLOW: Flow Analysis 1', 'DOMAIN: R1', 'BOUNDARY: inlet')."""
+    if digests is None:
+        digests = {} #empty dictionary
+    for b in blocks:
+        p = path + (b.anchor(),)
+        k = 1
+        while p in digests: # repeated anchor
+            k += 1
+            p = path + (b.anchor() + ' #' + str(k),)
+        digests[p] = b.digest
+        block_digests(b.children, p, digests)
+    return digests
+
+class CCLChanges(object):
+    """Paths (see block_digests) of the blocks added, removed and changed
+       between two parses of a CCL file.  A change inside a block also
+       marks the blocks around it as changed."""
+    def __init__(self, old, new):
+        self.added = sorted([p for p in new if p not in old])
+        self.removed = sorted([p for p in old if p not in new])
+        self.changed = sorted([p for p in new
+                               if p in old and old[p] != new[p]])
+    def __nonzero__(self):
+        return bool(self.added or self.removed or self.changed)
+    def output(self):
+        s = ''
+        for title, paths in (('Added', self.added),
+                             ('Removed', self.removed),
+                             ('Changed', self.changed)):
+            for p in paths:
+                s += title + ': ' + ' / '.join(p) + '\n'
+        return s
+
+class _LazyFlowLoader(object):
+    """Parses the DOMAIN: and OUTPUT CONTROL: sections of one flow when a
+       lazy Flow first needs them."""
+    def __init__(self, cclparser, row, domain_ranges, output_ranges):
+        self.cclparser = cclparser
+        self.row = row
+        self.domain_ranges = domain_ranges
+        self.output_ranges = output_ranges
+
+    def feed(self, flow, ranges):
+        builder = CCLTreeBuilder(self.cclparser.logger)
+        builder.enter_flow(flow, self.row)
+        data = self.cclparser.parser.data
+        for startrow, endrow in ranges:
+            builder.feed(data, startrow, endrow + 1)
+        builder.leave_flow()
+
+    def load_domains(self, flow):
+        self.feed(flow, self.domain_ranges)
+
+    def load_monitorpoints(self, flow):
+        self.feed(flow, self.output_ranges)
+
+class CCLParser(object):
     """A Parser for an ANSYS CFX CCL file.
        
         The CCL file is generated by ANSYS CFX-Pre: File->Export->CCL.
@@ -303,209 +862,169 @@ class CCLParser():
         to the wrapper.
 
         See CFX Reference Guide Section 12.1 for CCL syntax
+
+        If *cachedir* is given, the parsed results are saved there in a file
+        named after the SHA-1 hash of the CCL file contents, and a later
+        parse of a file with the same contents loads them instead of
+        parsing.  A changed file has a different hash, so it never picks
+        up stale results; entries written by an older cache_version are
+        ignored and replaced.
+
+        With ``parse(lazy = True)`` only the block offsets are scanned, and
+        the expressions and each flow's domains and monitor points are parsed
+        the first time they are used.
+
+        If *mapped* is True the file is read through a MappedCCLFile, which
+        keeps only line offsets in memory; use it for very large exports.
+        Call close() to release the mapping.
+
+        If *incremental* is True a digest of the text of each FLOW:, DOMAIN:,
+        BOUNDARY: and OUTPUT CONTROL: block is kept, so that after the file
+        has been edited reparse() only parses the blocks that changed.
     """
-    expressions = {} # empty dictionary
     flows = [] #empty list
     location_dictionary = {} #empty dictionary
     units = set() #empty set
+    cache_version = 4 # change when the parsed structures change
+    cache_extension = '.cclcache'
     
-    def __init__(self, filename, logger = None):
-        self.parser = StringArrayParser([], filename)
+    def __init__(self, filename, logger = None, cachedir = '', mapped = False,
+                 incremental = False):
+        self.filename = filename
+        self.cachedir = cachedir
+        self.mapped = mapped
+        self.incremental = incremental
+        self.block_digests = None # block path -> digest, see reparse
+        self.parse_options = (False, False)
+        self._parser = None # read on first use
         self.flows = [] #empty list
         self.expressions = {} # empty dictionary
         self.domain_location_dictionary = {} #empty dictionary
         self.boundary_location_dictionary = {} #empty dictionary
         self.units = set() #empty set
         self.logger = logger
-        
-    def getlibrary_parser(self):
-        """Get a parser for just the LIBRARY section of the CCL file."""
-        self.parser.reset_anchor()
-        anchor = 'LIBRARY:'
-        startrow, endrow = self.parser.find_range(anchor)
-        if startrow == -1 or endrow == -1:
-            return False
-        else:
-            self.library_parser = StringArrayParser(self.parser.data[startrow:endrow])
-            return True
+        self.from_cache = False
+        self.library_range = None # (startrow, endrow) for a lazy parse
+
+    def _get_expressions(self):
+        if self._expressions is None:
+            self._expressions = {}
+            if self.library_range is not None:
+                builder = CCLTreeBuilder(self.logger)
+                startrow, endrow = self.library_range
+                builder.feed(self.parser.data, startrow, endrow + 1)
+                builder.close()
+                self._expressions = builder.expressions
+        return self._expressions
+    def _set_expressions(self, expressions):
+        self._expressions = expressions
+    expressions = property(_get_expressions, _set_expressions,
+        doc = "Expressions defined in LIBRARY:CEL:EXPRESSIONS:")
+
+    @property
+    def parser(self):
+        """StringArrayParser holding the preprocessed lines of the file."""
+        if self._parser is None:
+            self._parser = StringArrayParser([], self.filename, self.mapped)
+        return self._parser
+
+    def __getstate__(self):
+        # lazy sections are loaded before pickling; the file contents and
+        # the logger stay behind
+        self.expressions
+        state = self.__dict__.copy()
+        state['_parser'] = None
+        state['logger'] = None
+        return state
 
-    def getexpressions(self):
-        """Get expressions defined in LIBRARY:CEL:EXPRESSIONS:"""
-        self.library_parser.reset_anchor()
+    def close(self):
+        """Release the memory map of a *mapped* parser."""
+        if self._parser is not None and \
+           isinstance(self._parser.data, MappedCCLFile):
+            self._parser.data.close()
+
+    def file_digest(self):
+        """SHA-1 hex digest of the contents of the CCL file."""
+        h = hashlib.sha1()
+        f = open(self.filename, 'rb')
         try:
-            startrow, endrow = self.library_parser.find_range('CEL:')
-            if startrow == -1 or endrow == -1: 
-                return False
-            cel_parser = StringArrayParser(
-                self.library_parser.data[startrow:endrow])
+            while True:
+                block = f.read(1 << 20)
+                if not block:
+                    break
+                h.update(block)
+        finally:
+            f.close()
+        return h.hexdigest()
+
+    def cache_path(self, digest):
+        """Path of the cache entry for a CCL file with hash *digest*."""
+        return os.path.join(self.cachedir, digest + self.cache_extension)
+
+    def load_cache(self, digest):
+        """Load the parsed results for *digest* from *cachedir*.
+
+           Returns False if there is no usable entry."""
+        path = self.cache_path(digest)
+        if not os.path.exists(path):
+            return False
+        try:
+            f = open(path, 'rb')
             try:
-                startrow, endrow = cel_parser.find_range('EXPRESSIONS:')
-                if startrow == -1 or endrow == -1:
-                    return False
-                expr_parser = CCLEntityParser(cel_parser.data[startrow:endrow])
-                expr_parser.parse()
-                self.expressions = expr_parser.dictionary.copy()
-                return True
-            except RuntimeError: #anchor not found
-                return False
-        except RuntimeError: #anchor not found
+                entry = cPickle.load(f)
+            finally:
+                f.close()
+        except Exception:
+            do_logging(self.logger, 'Ignoring unreadable CCL cache ' + path)
             return False
+        if not isinstance(entry, dict) or \
+           entry.get('version') != self.cache_version or \
+           entry.get('digest') != digest:
+            do_logging(self.logger, 'Ignoring stale CCL cache ' + path)
+            return False
+        self.expressions = entry['expressions']
+        self.flows = entry['flows']
+        self.domain_location_dictionary = entry['domain_location_dictionary']
+        self.boundary_location_dictionary = \
+            entry['boundary_location_dictionary']
+        self.units = entry['units']
+        if self.incremental:
+            if entry['block_digests'] is None:
+                return False # saved without them
+            self.block_digests = entry['block_digests']
+        do_logging(self.logger, 'Loaded ' + self.filename + ' from ' + path)
+        return True
 
-    def getflow_parser(self, sr):
-        """Get a parser for just the FLOW section of the CCL file."""
-        anchor = 'FLOW:'
-        startrow, endrow = self.parser.find_range(anchor, sr)
-        if startrow == -1 or endrow == -1:
-            return '', -1
-        else:
-            self.flow_parser = StringArrayParser(self.parser.data[startrow:endrow])
-            name = self.getname('FLOW:', self.flow_parser.data[0])
-            return name, endrow
-       
-    def getunits(self, flow):
-        """Get SOLUTION UNITS defined in the flow."""
+    def save_cache(self, digest):
+        """Save the parsed results for *digest* in *cachedir*."""
+        entry = {'version': self.cache_version,
+                 'digest': digest,
+                 'expressions': self.expressions,
+                 'flows': self.flows,
+                 'domain_location_dictionary': self.domain_location_dictionary,
+                 'boundary_location_dictionary':
+                     self.boundary_location_dictionary,
+                 'units': self.units,
+                 'block_digests': self.block_digests}
+        path = self.cache_path(digest)
         try:
-            self.flow_parser.reset_anchor()
-            startrow, endrow = self.flow_parser.find_range(
-                'SOLUTION UNITS:')
-            if startrow == -1 or endrow == -1: 
-                return
-            #import pdb; pdb.set_trace()
-            units_parser = CCLEntityParser(
-                self.flow_parser.data[startrow:endrow])
-            units_parser.parse()
-            flow.units.append(units_parser.dictionary)
-        except RuntimeError: #anchor not found
-            return
-        #end of getunits
-
-    def getname(self, anchor, line):
-        """Get the name defined on the line after *anchor*."""
-        index = line.find(anchor)
-        if (index >= 0):
-            n = len(anchor) + index
-            name = line[n:].strip()
-        else:
-            name = line.strip()
-        return name
-
-    def getdomains(self, flow):
-        """Get information about the Domains defined in the flow.
-           In particular, get Boundary and Monitor Point information.
-        """
-        i = 1
-        sr = 0
-        while True:
+            if not os.path.isdir(self.cachedir):
+                os.makedirs(self.cachedir)
+            # write a temporary file and rename it, so a reader never sees
+            # a partly written entry
+            fd, tmpname = tempfile.mkstemp(suffix = '.tmp', dir = self.cachedir)
+            f = os.fdopen(fd, 'wb')
             try:
-                self.flow_parser.reset_anchor()
-                startrow, endrow = self.flow_parser.find_range('DOMAIN:', sr)
-                if startrow == -1 or endrow == -1: 
-                    break
-                #import pdb; pdb.set_trace()
-                sr = endrow
-                domain_parser = StringArrayParser(self.flow_parser.data[startrow:endrow])
-                
-                #get the domain name from the first line
-                name = self.getname('DOMAIN:', domain_parser.data[0])
-                dmn = Domain(name)
-                
-                #get the Domain Type
-                #import pdb; pdb.set_trace()
-                dmn.domaintype = domain_parser.transfer_keyvar('Domain Type', 1)
-                dmn.location = domain_parser.transfer_keyvar('Location', 1)
-            
-                #print 'Domain ' + dmn.name + ' ' + dmn.domaintype + ' startrow ' + str(domain_startrow) + \
-                    #' endrow ' + str(domain_endrow)
-                
-                # look for boundaries
-                anchor = "BOUNDARY:"
-                #n = len(anchor)
-                while True:
-                    #import pdb; pdb.set_trace()
-                    startrow, endrow = domain_parser.find_range(anchor)
-                    if startrow == -1 or endrow == -1: 
-                        break
-                    boundary_parser = CCLEntityParser(domain_parser.data[startrow:endrow])
-                    #get the boundary name from the first line
-                    #import pdb; pdb.set_trace()
-                    #line = boundary_parser.data[boundary_parser.current_row].strip()
-                    name = self.getname(anchor, boundary_parser.data[0])
-                    boundary_parser.parse()
-                    #import pdb; pdb.set_trace()
-                    b = Boundary(name, boundary_parser.dictionary)
-                    btype = b.type
-                    #print 'Boundary ' + name + ' ' + btype + ' startrow ' + str(boundary_startrow) + \
-                        #' endrow ' + str(boundary_endrow)
-                    if btype == 'INLET':
-                        dmn.inlets.append(b)
-                    elif btype == 'OUTLET':
-                        dmn.outlets.append(b)
-                    elif btype == 'OPENING':
-                        dmn.openings.append(b)
-                    elif btype == 'WALL':
-                        dmn.walls.append(b)
-                    elif btype == 'INTERFACE':
-                        dmn.interfaces.append(b)
-                    elif btype == 'SYMMETRY':
-                        dmn.symmetries.append(b)
-                    else:
-                        do_logging(self.logger, 'Domain ' + dmn.name + ': Boundary ' + name + ': unknown type ' + btype, both = True)
-                
-                flow.domains.append(dmn)
-                i = i + 1
-            except RuntimeError: #anchor not found
-                break
-               
-    def getmonitorpoints(self, flow):
-        """Get monitor points defined in FLOW: OUTPUT CONTROL: MONITOR OBJECTS:"""
-        self.flow_parser.reset_anchor()
-        startrow, endrow = self.flow_parser.find_range('OUTPUT CONTROL:')
-        if startrow == -1 or endrow == -1:
-            return
-        oc_parser = StringArrayParser(self.flow_parser.data[startrow:endrow])
-        startrow, endrow = oc_parser.find_range('MONITOR OBJECTS:')
-        if startrow == -1 or endrow == -1:
-            return
-        mo_parser = StringArrayParser(oc_parser.data[startrow:endrow])
-        for i, l in enumerate(mo_parser.data):
-            do_logging(self.logger, str(i) + ', ' + l)
-
-        anchor = "MONITOR POINT:"
-        n = len(anchor)
-        sr = 0
-        while True:
-            try:
-                mo_parser.reset_anchor()
-                startrow, endrow = mo_parser.find_range(anchor, sr)
-                if startrow == -1 or endrow == -1: 
-                    break
-                sr = endrow
-                monitorpoints_parser = StringArrayParser(mo_parser.data[startrow:endrow])
-                #import pdb; pdb.set_trace()
-                #get the monitor name from the marked line
-                line = monitorpoints_parser.data[0].strip()
-                name = line[n:].strip()
-                #if name == 'MonAmpere': import pdb; pdb.set_trace()
-                d = {} #empty dictionary
-                keys = ('Expression Value', 'Option')
-                for line in monitorpoints_parser.data[1:]:  # look at the remaining lines for keys
-                    for k in keys:
-                        if k in line:
-                            s = line.replace(k, '')
-                            s = s.replace('=', '')
-                            d[k] = s.strip()                        
-                #for i, k in enumerate(keys, 1):
-                    #monitorpoints_parser.reset_anchor()
-                    #line = monitorpoints_parser.transfer_line(i)
-                    #if k in line:
-                        #s = line.replace(k, '')
-                        #s = s.replace('=', '')
-                        #d[k] = s.strip()
-                flow.monitorpoints[name] = d
-            except RuntimeError: #anchor not found
-                break
-       #end of getmonitorpoints
-            
+                cPickle.dump(entry, f, cPickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmpname, path)
+        except (IOError, OSError):
+            do_logging(self.logger, 'Could not write CCL cache ' + path,
+                       both = True)
+        
     def output(self):
         s = 'EXPRESSIONS:\n'
         for k, v in self.expressions.iteritems():
@@ -515,31 +1034,195 @@ class CCLParser():
             s += f.output()
         return s
             
-    def parse(self, do_location_dictionary = False, do_length_units = False, debug = False):
-        ''"Parse the CCL File."""
-        #Parse LIBRARY: section (just expressions for now)
-        if self.getlibrary_parser():
-            self.getexpressions()
-        
-        #Parse FLOW: sections
-        self.parser.reset_anchor()
-        sr = 0
-        self.flows = [] #emptylist
-        while True:
-            #import pdb; pdb.set_trace()
-            flowname, endrow = self.getflow_parser(sr)
-            if flowname == '':
-                break
-            flow = Flow(flowname)
-            self.getunits(flow)
-            self.getdomains(flow)
-            self.getmonitorpoints(flow)
-            self.flows.append(flow)
-            sr = endrow
-        if do_location_dictionary:
+    def scan(self):
+        """Find the LIBRARY: and FLOW: blocks without parsing them.
+
+           Each Flow gets a loader for its DOMAIN: and OUTPUT CONTROL:
+           sections; only its SOLUTION UNITS are parsed now."""
+        index = self.parser.block_index()
+        data = self.parser.data
+        self.library_range = None
+        self._expressions = None
+        self.flows = [] #empty list
+        blocks = scan_blocks(index, self.incremental)
+        if self.incremental:
+            self.block_digests = block_digests(blocks)
+        for b in blocks:
+            if b.keyword == 'LIBRARY':
+                if self.library_range is None:
+                    self.library_range = (b.startrow, b.endrow)
+            elif b.keyword == 'FLOW':
+                domain_ranges = []
+                output_ranges = []
+                unit_ranges = []
+                for c in b.children:
+                    if c.keyword == 'DOMAIN':
+                        domain_ranges.append((c.startrow, c.endrow))
+                    elif c.keyword == 'OUTPUT CONTROL':
+                        output_ranges.append((c.startrow, c.endrow))
+                    elif c.keyword == 'SOLUTION UNITS':
+                        unit_ranges.append((c.startrow, c.endrow))
+                loader = _LazyFlowLoader(self, b.startrow, domain_ranges,
+                                         output_ranges)
+                flow = Flow(b.name, loader)
+                builder = CCLTreeBuilder(self.logger)
+                builder.enter_flow(flow, b.startrow)
+                for sr, er in unit_ranges:
+                    builder.feed(data, sr, er + 1)
+                builder.leave_flow()
+                self.flows.append(flow)
+
+    def _reparse_flow(self, b, old, path, old_digests, new_digests):
+        """Build the Flow for BlockInfo *b*, reusing the Domains, Boundaries
+           and monitor points of Flow *old* whose text has not changed."""
+        data = self.parser.data
+        flow = Flow(b.name)
+        builder = CCLTreeBuilder(self.logger)
+        builder.enter_flow(flow, b.startrow)
+        old_domains = {} #empty dictionary
+        if old is not None:
+            for d in old.domains:
+                old_domains[d.name] = d
+        # the monitor points of all OUTPUT CONTROL: blocks are in one dict
+        outputs_unchanged = old is not None
+        for c in b.children:
+            cpath = path + (c.anchor(),)
+            if c.keyword == 'OUTPUT CONTROL' and \
+               old_digests.get(cpath) != new_digests.get(cpath):
+                outputs_unchanged = False
+        for c in b.children:
+            cpath = path + (c.anchor(),)
+            unchanged = old_digests.get(cpath) == new_digests.get(cpath)
+            if c.keyword == 'DOMAIN' and c.name in old_domains:
+                if unchanged:
+                    flow.domains.append(old_domains[c.name])
+                    continue
+                # parse the domain around its unchanged boundaries
+                boundaries = {} #empty dictionary
+                for kind in CCLTreeBuilder.boundary_lists.itervalues():
+                    for x in getattr(old_domains[c.name], kind):
+                        boundaries[x.name] = x
+                row = c.startrow
+                for bc in c.children:
+                    bpath = cpath + (bc.anchor(),)
+                    if bc.name in boundaries and \
+                       old_digests.get(bpath) == new_digests.get(bpath):
+                        builder.feed(data, row, bc.startrow)
+                        builder.add_boundary(boundaries[bc.name])
+                        row = bc.endrow + 1
+                builder.feed(data, row, c.endrow + 1)
+            elif c.keyword == 'OUTPUT CONTROL' and outputs_unchanged:
+                flow.monitorpoints.update(old.monitorpoints)
+            else:
+                builder.feed(data, c.startrow, c.endrow + 1)
+        builder.leave_flow()
+        return flow
+
+    def reparse(self, filename = ''):
+        """Read the CCL file again (or *filename* instead) and parse only the
+           FLOW:, DOMAIN:, BOUNDARY: and OUTPUT CONTROL: blocks whose text has
+           changed since the last parse; the objects for the others are kept.
+
+           Needs a parser made with *incremental* True; otherwise the whole
+           file is parsed and reported as added.  Returns a CCLChanges."""
+        old_digests = self.block_digests
+        if old_digests is None:
+            old_digests = {} #empty dictionary
+        old_flows = {} #empty dictionary
+        old_expressions = None
+        if self.block_digests is not None:
+            # lazy sections are loaded while their rows still refer to the
+            # old text, since the objects kept are not parsed again
+            old_expressions = self.expressions
+            for f in self.flows:
+                f.domains
+                f.monitorpoints
+                f._loader = None
+                old_flows[f.name] = f
+        if filename != '':
+            self.filename = filename
+        self.close()
+        self._parser = None
+
+        index = self.parser.block_index()
+        blocks = scan_blocks(index, True)
+        new_digests = block_digests(blocks)
+        self.block_digests = new_digests
+        changes = CCLChanges(old_digests, new_digests)
+
+        self.library_range = None
+        expressions = None
+        flows = [] #empty list
+        for b in blocks:
+            path = (b.anchor(),)
+            unchanged = old_digests.get(path) == new_digests.get(path)
+            if b.keyword == 'LIBRARY':
+                if self.library_range is None:
+                    self.library_range = (b.startrow, b.endrow)
+                    if unchanged and old_expressions is not None:
+                        expressions = old_expressions
+            elif b.keyword == 'FLOW':
+                old = old_flows.get(b.name)
+                if unchanged and old is not None:
+                    flows.append(old)
+                else:
+                    flows.append(self._reparse_flow(b, old, path,
+                                 old_digests, new_digests))
+        self.flows = flows
+        self._expressions = expressions # None parses the LIBRARY on use
+        if self.library_range is None:
+            self._expressions = {}
+
+        self.domain_location_dictionary = {} #empty dictionary
+        self.boundary_location_dictionary = {} #empty dictionary
+        self.units = set() #empty set
+        do_location_dictionary, do_length_units = self.parse_options
+        if do_location_dictionary or self.cachedir != '':
+            self.get_location_dictionary()
+        if do_length_units or self.cachedir != '':
+            self.get_length_units()
+        if self.cachedir != '':
+            self.save_cache(self.file_digest())
+        return changes
+
+    def parse(self, do_location_dictionary = False, do_length_units = False, debug = False,
+              lazy = False):
+        """Parse the CCL File.
+
+           If *lazy* is True, only scan the file for its blocks; see scan.
+           A lazy parse loads from the cache but does not save to it, since
+           saving would parse everything."""
+        self.parse_options = (do_location_dictionary, do_length_units)
+        digest = ''
+        if self.cachedir != '':
+            digest = self.file_digest()
+            self.from_cache = self.load_cache(digest)
+            if self.from_cache:
+                return
+        if lazy:
+            self.scan()
+            if do_location_dictionary:
+                self.get_location_dictionary(debug)
+            if do_length_units:
+                self.get_length_units(debug)
+            return
+        #Build the LIBRARY expressions and the FLOW: sections in a single pass
+        builder = CCLTreeBuilder(self.logger)
+        builder.feed(self.parser.data)
+        builder.close()
+        self.expressions = builder.expressions
+        self.flows = builder.flows
+        if self.incremental:
+            self.block_digests = block_digests(
+                scan_blocks(self.parser.block_index(), True))
+        # the cache holds the location dictionaries and units, so they are
+        # always filled in when saving to it
+        if do_location_dictionary or digest != '':
             self.get_location_dictionary(debug)
-        if do_length_units:
+        if do_length_units or digest != '':
             self.get_length_units(debug)
+        if digest != '':
+            self.save_cache(digest)
             
     def get_location_dictionary(self, debug = False):
         for f in self.flows:
@@ -557,6 +1240,60 @@ class CCLParser():
         if debug:
             do_logging(self.logger, 'Units:' )
             do_logging(self.logger, pp.pformat(self.units))
+
+class _MessageLog(object):
+    """Stands in for a logger in a parse_many worker process.  Collects
+       the debug messages so they can be passed to the real logger."""
+    def __init__(self):
+        self.messages = [] #empty list
+    def debug(self, msg):
+        self.messages.append(msg)
+
+def _parse_one(args):
+    """parse_many worker: parse one file, return the parser and its log."""
+    filename, use_log, cachedir, mapped, kwargs = args
+    log = None
+    if use_log:
+        log = _MessageLog()
+    p = CCLParser(filename, log, cachedir = cachedir, mapped = mapped)
+    p.parse(**kwargs)
+    p.close()
+    messages = []
+    if log is not None:
+        messages = log.messages
+    return p, messages
+
+def parse_many(filenames, workers = None, logger = None, cachedir = '',
+               mapped = False, **kwargs):
+    """Parse several CCL files in a pool of *workers* processes.
+
+       Yields each parsed CCLParser as soon as it is done, so the order is
+       not that of *filenames*.  Other keyword arguments are passed to
+       CCLParser.parse.  Debug messages from the workers are given to
+       *logger* in the calling process.  *workers* defaults to the number
+       of CPUs; with one worker or one file no processes are started."""
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    jobs = [(f, logger is not None, cachedir, mapped, kwargs)
+            for f in filenames]
+    if workers <= 1 or len(jobs) <= 1:
+        results = (_parse_one(job) for job in jobs)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(min(workers, len(jobs)))
+        results = pool.imap_unordered(_parse_one, jobs)
+    try:
+        for p, messages in results:
+            p.logger = logger
+            for msg in messages:
+                logger.debug(msg)
+            yield p
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
        
 if __name__ == "__main__": # pragma: no cover
     
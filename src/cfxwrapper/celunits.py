@@ -0,0 +1,412 @@
+"""Dimensional analysis of CEL expressions.
+
+   DimensionAnalyser works out the dimensions of a CEL expression without
+   running CFX, from the units of its numbers, the common CEL functions
+   and solver variables, and the expressions of LIBRARY:CEL:EXPRESSIONS,
+   which are resolved recursively and remembered.  The result is written
+   the way CFX reports dimensions, such as 'm^-1 kg s^-2', so that
+   TestRunner.translate turns it into OpenMDAO units as it does for the
+   dimensions found by TestCFX.  An expression it does not know, or that
+   CFX would reject, raises Unresolved, and the caller can ask CFX."""
+
+import re
+import sys
+
+import cfxunitsinfo
+
+#the base units CFX reports dimensions in, as in TestRunner.base_units
+BASE_UNITS = ('m', 'kg', 's', 'amp', 'K', 'mol', 'rad', 'sr')
+
+class Unresolved(ValueError):
+    """The dimensions of an expression could not be found."""
+
+def dims(**exponents):
+    """Dimensions as a tuple of the exponents of BASE_UNITS."""
+    return tuple([float(exponents.get(b, 0)) for b in BASE_UNITS])
+
+def multiply(a, b):
+    return tuple([x + y for x, y in zip(a, b)])
+
+def divide(a, b):
+    return tuple([x - y for x, y in zip(a, b)])
+
+def power(a, n):
+    return tuple([x * n for x in a])
+
+DIMENSIONLESS = dims()
+LENGTH = dims(m=1)
+AREA = dims(m=2)
+VOLUME = dims(m=3)
+MASS = dims(kg=1)
+TIME = dims(s=1)
+TEMPERATURE = dims(K=1)
+VELOCITY = dims(m=1, s=-1)
+MASS_FLOW = dims(kg=1, s=-1)
+DENSITY = dims(kg=1, m=-3)
+FORCE = dims(kg=1, m=1, s=-2)
+PRESSURE = dims(kg=1, m=-1, s=-2)
+ENERGY = dims(kg=1, m=2, s=-2)
+POWER = dims(kg=1, m=2, s=-3)
+SPECIFIC_ENERGY = dims(m=2, s=-2)
+VISCOSITY = dims(kg=1, m=-1, s=-1)
+
+#units that may appear in [] after a number
+UNITS = {
+    #length
+    'm': LENGTH, 'cm': LENGTH, 'mm': LENGTH, 'um': LENGTH,
+    'micron': LENGTH, 'in': LENGTH, 'ft': LENGTH, 'yd': LENGTH,
+    'mile': LENGTH,
+    #mass
+    'kg': MASS, 'g': MASS, 'lb': MASS, 'slug': MASS, 'tonne': MASS,
+    'oz': MASS,
+    #time
+    's': TIME, 'min': TIME, 'hr': TIME, 'h': TIME, 'day': TIME,
+    'year': TIME,
+    #current
+    'A': dims(amp=1), 'amp': dims(amp=1),
+    #temperature
+    'K': TEMPERATURE, 'C': TEMPERATURE, 'R': TEMPERATURE, 'F': TEMPERATURE,
+    #amount
+    'mol': dims(mol=1),
+    #angle
+    'rad': dims(rad=1), 'degree': dims(rad=1), 'deg': dims(rad=1),
+    'rev': dims(rad=1),
+    #solid angle
+    'sr': dims(sr=1),
+    #derived
+    'N': FORCE, 'dyne': FORCE, 'lbf': FORCE,
+    'Pa': PRESSURE, 'bar': PRESSURE, 'atm': PRESSURE, 'psi': PRESSURE,
+    'J': ENERGY, 'cal': ENERGY, 'BTU': ENERGY, 'erg': ENERGY,
+    'W': POWER, 'hp': POWER,
+    'Hz': dims(s=-1),
+    'l': VOLUME, 'litre': VOLUME,
+    'poise': VISCOSITY,
+    }
+PREFIXES = ('T', 'G', 'M', 'k', 'h', 'd', 'c', 'm', 'u', 'n', 'p')
+
+#functions of a location, like massFlow()@inlet; a suffix _x, _y or _z
+#gives a component
+LOCATION_QUANTITIES = {'massFlow': MASS_FLOW, 'area': AREA,
+    'volume': VOLUME, 'force': FORCE, 'torque': ENERGY,
+    'count': DIMENSIONLESS}
+#functions of a variable at a location, like areaAve(Pressure)@outlet:
+#the dimensions of the variable times these
+LOCATION_FUNCTIONS = {'areaAve': DIMENSIONLESS, 'areaInt': AREA,
+    'massFlowAve': DIMENSIONLESS, 'massFlowAveAbs': DIMENSIONLESS,
+    'massFlowInt': MASS_FLOW, 'massAve': DIMENSIONLESS, 'massInt': MASS,
+    'volumeAve': DIMENSIONLESS, 'volumeInt': VOLUME,
+    'lengthAve': DIMENSIONLESS, 'lengthInt': LENGTH,
+    'ave': DIMENSIONLESS, 'sum': DIMENSIONLESS, 'maxVal': DIMENSIONLESS,
+    'minVal': DIMENSIONLESS, 'probe': DIMENSIONLESS,
+    'rmsAve': DIMENSIONLESS}
+#functions of dimensionless (or angle) arguments with dimensionless results
+DIMENSIONLESS_FUNCTIONS = ('exp', 'loge', 'log10', 'sin', 'cos', 'tan',
+                           'step')
+
+#solver variables; a fluid prefix (Water.) and a component or frame suffix
+#(u, in Stn Frame) are ignored
+VARIABLES = {
+    'Pressure': PRESSURE, 'Static Pressure': PRESSURE,
+    'Total Pressure': PRESSURE, 'Absolute Pressure': PRESSURE,
+    'Wall Shear': PRESSURE,
+    'Temperature': TEMPERATURE, 'Static Temperature': TEMPERATURE,
+    'Total Temperature': TEMPERATURE,
+    'Velocity': VELOCITY, 'Density': DENSITY,
+    'Dynamic Viscosity': VISCOSITY, 'Eddy Viscosity': VISCOSITY,
+    'Turbulence Kinetic Energy': SPECIFIC_ENERGY,
+    'Turbulence Eddy Dissipation': dims(m=2, s=-3),
+    'Static Enthalpy': SPECIFIC_ENERGY, 'Total Enthalpy': SPECIFIC_ENERGY,
+    'Specific Heat Capacity at Constant Pressure': dims(m=2, s=-2, K=-1),
+    'Static Entropy': dims(m=2, s=-2, K=-1),
+    'Thermal Conductivity': dims(kg=1, m=1, s=-3, K=-1),
+    'Wall Heat Flux': dims(kg=1, s=-3),
+    'Mach Number': DIMENSIONLESS, 'Volume Fraction': DIMENSIONLESS,
+    'Yplus': DIMENSIONLESS,
+    #constants, coordinates and time
+    'pi': DIMENSIONLESS, 'e': DIMENSIONLESS,
+    'x': LENGTH, 'y': LENGTH, 'z': LENGTH, 'r': LENGTH, 't': TIME,
+    }
+COMPONENTS = ('u', 'v', 'w', 'X', 'Y', 'Z', 'Axial', 'Radial',
+              'Circumferential')
+FRAMES = (' in Stn Frame', ' in Rel Frame')
+
+_token = re.compile(r'''\s*(?:
+     (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+    |(?P<unit>\[[^\]]*\])
+    |(?P<location>@\s*[\w.:]+(?:[ \t]+[\w.:]+)*)
+    |(?P<name>[A-Za-z_][\w.]*(?:[ \t]+[A-Za-z_][\w.]*)*)
+    |(?P<op>\*\*|<=|>=|==|!=|&&|\|\||[-+*/^()<>,!])
+    )''', re.VERBOSE)
+
+def tokenize(expr):
+    """The (kind, text) tokens of a CEL expression."""
+    tokens = []
+    pos = 0
+    expr = expr.strip()
+    while pos < len(expr):
+        m = _token.match(expr, pos)
+        if m is None or m.end() == pos:
+            raise Unresolved('cannot read ' + repr(expr[pos:]))
+        tokens.append((m.lastgroup, m.group(m.lastgroup)))
+        pos = m.end()
+    return tokens
+
+def unit_dimensions(text):
+    """The dimensions of a unit string such as 'kg m^-3'."""
+    try:
+        exponents = cfxunitsinfo.unit_exponents(text)
+    except ValueError:
+        raise Unresolved(str(sys.exc_info()[1]))
+    result = DIMENSIONLESS
+    for name, n in exponents:
+        if name in UNITS:
+            d = UNITS[name]
+        elif name[:1] in PREFIXES and name[1:] in UNITS:
+            d = UNITS[name[1:]]
+        else:
+            raise Unresolved('unknown unit ' + name)
+        result = multiply(result, power(d, n))
+    return result
+
+def format_dimensions(d):
+    """*d* written the way CFX reports dimensions, '<dimensionless>' for
+       none."""
+    parts = []
+    for b, n in zip(BASE_UNITS, d):
+        if n == 0:
+            continue
+        if n == 1:
+            parts.append(b)
+        elif n == int(n):
+            parts.append(b + '^' + str(int(n)))
+        else:
+            parts.append(b + '^' + repr(n))
+    if len(parts) == 0:
+        return '<dimensionless>'
+    return ' '.join(parts)
+
+def _fold(f, *values):
+    """f(*values), for folding constants: None if any value is None or the
+       result is not a finite float, as for (-8)^(1/3) or 10^400."""
+    if None in values:
+        return None
+    try:
+        v = float(f(*values))
+    except (ArithmeticError, ValueError):
+        return None
+    if v != v or abs(v) == float('inf'):
+        return None
+    return v
+
+def _same(a, b, what):
+    if a != b:
+        raise Unresolved('inconsistent dimensions for ' + what)
+    return a
+
+class _Parser(object):
+    """Recursive descent over the tokens of one expression.  Each rule
+       returns (dimensions, value), value being the number for a constant
+       without units and None otherwise."""
+    def __init__(self, analyser, expr):
+        self.analyser = analyser
+        self.expr = expr
+        self.tokens = tokenize(expr)
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def take(self, text = None):
+        kind, t = self.peek()
+        if kind is None or (text is not None and t != text):
+            raise Unresolved('expected ' + str(text) + ' in ' + self.expr)
+        self.pos += 1
+        return kind, t
+
+    def parse(self):
+        d, v = self.logical()
+        if self.pos != len(self.tokens):
+            raise Unresolved('unexpected ' + self.peek()[1] + ' in ' +
+                             self.expr)
+        return d
+
+    def logical(self):
+        d, v = self.comparison()
+        while self.peek() in (('op', '&&'), ('op', '||')):
+            self.take()
+            self.comparison()
+            d, v = DIMENSIONLESS, None
+        return d, v
+
+    def comparison(self):
+        d, v = self.additive()
+        if self.peek()[0] == 'op' and \
+           self.peek()[1] in ('<', '>', '<=', '>=', '==', '!='):
+            op = self.take()[1]
+            _same(d, self.additive()[0], op)
+            d, v = DIMENSIONLESS, None
+        return d, v
+
+    def additive(self):
+        d, v = self.multiplicative()
+        while self.peek() in (('op', '+'), ('op', '-')):
+            op = self.take()[1]
+            d2, v2 = self.multiplicative()
+            d = _same(d, d2, op)
+            if op == '+':
+                v = _fold(lambda a, b: a + b, v, v2)
+            else:
+                v = _fold(lambda a, b: a - b, v, v2)
+        return d, v
+
+    def multiplicative(self):
+        d, v = self.unary()
+        while self.peek() in (('op', '*'), ('op', '/')):
+            op = self.take()[1]
+            d2, v2 = self.unary()
+            if op == '*':
+                d = multiply(d, d2)
+                v = _fold(lambda a, b: a * b, v, v2)
+            else:
+                d = divide(d, d2)
+                v = _fold(lambda a, b: a / b, v, v2)
+        return d, v
+
+    def unary(self):
+        if self.peek() in (('op', '-'), ('op', '+')):
+            op = self.take()[1]
+            d, v = self.unary()
+            if op == '-' and v is not None:
+                v = -v
+            return d, v
+        if self.peek() == ('op', '!'):
+            self.take()
+            self.unary()
+            return DIMENSIONLESS, None
+        return self.exponential()
+
+    def exponential(self):
+        d, v = self.primary()
+        if self.peek() in (('op', '^'), ('op', '**')):
+            self.take()
+            d2, v2 = self.unary()
+            if v2 is None or d2 != DIMENSIONLESS:
+                raise Unresolved('exponent is not a number in ' + self.expr)
+            d = power(d, v2)
+            v = _fold(pow, v, v2)
+        return d, v
+
+    def primary(self):
+        kind, t = self.take()
+        if kind == 'number':
+            if self.peek()[0] == 'unit':
+                return unit_dimensions(self.take()[1][1:-1]), None
+            return DIMENSIONLESS, _fold(float, t)
+        if kind == 'unit':
+            return unit_dimensions(t[1:-1]), None
+        if (kind, t) == ('op', '('):
+            d, v = self.logical()
+            self.take(')')
+            return d, v
+        if kind == 'name':
+            if self.peek() == ('op', '('):
+                return self.call(t), None
+            return self.analyser.name_dimensions(t), None
+        raise Unresolved('unexpected ' + t + ' in ' + self.expr)
+
+    def call(self, name):
+        self.take('(')
+        args = []
+        if self.peek() != ('op', ')'):
+            args.append(self.logical()[0])
+            while self.peek() == ('op', ','):
+                self.take()
+                args.append(self.logical()[0])
+        self.take(')')
+        if self.peek()[0] == 'location':
+            self.take()
+        return self.analyser.function_dimensions(name, args)
+
+class DimensionAnalyser(object):
+    """Finds the dimensions of CEL expressions that may use the named
+       library *expressions*, a dictionary of name -> CEL text such as
+       CCLParser.expressions."""
+    def __init__(self, expressions = None):
+        if expressions is None:
+            expressions = {}
+        self.expressions = expressions
+        self._library = {} #name -> dimensions, or the Unresolved raised
+        self._resolving = set()
+
+    def dimensions(self, expr):
+        """The dimensions of the CEL text *expr*, as a tuple of the
+           exponents of BASE_UNITS.  Raises Unresolved."""
+        return _Parser(self, expr).parse()
+
+    def dimension_string(self, expr):
+        """The dimensions of *expr* as CFX would report them."""
+        return format_dimensions(self.dimensions(expr))
+
+    def name_dimensions(self, name):
+        if name in self.expressions:
+            return self._library_dimensions(name)
+        for candidate in self._variable_names(name):
+            if candidate in VARIABLES:
+                return VARIABLES[candidate]
+        raise Unresolved('unknown name ' + name)
+
+    def _variable_names(self, name):
+        """*name* and its forms without a fluid prefix, frame or
+           component."""
+        names = [name]
+        if '.' in name:
+            names.append(name.rsplit('.', 1)[1])
+        for n in list(names):
+            for frame in FRAMES:
+                if n.endswith(frame):
+                    n = n[:-len(frame)]
+                    names.append(n)
+            words = n.rsplit(' ', 1)
+            if len(words) == 2 and words[1] in COMPONENTS:
+                names.append(words[0])
+        return names
+
+    def _library_dimensions(self, name):
+        if name not in self._library:
+            if name in self._resolving:
+                raise Unresolved('expression ' + name + ' refers to itself')
+            self._resolving.add(name)
+            try:
+                self._library[name] = self.dimensions(self.expressions[name])
+            except Unresolved:
+                self._library[name] = sys.exc_info()[1]
+            finally:
+                self._resolving.discard(name)
+        d = self._library[name]
+        if isinstance(d, Unresolved):
+            raise d
+        return d
+
+    def function_dimensions(self, name, args):
+        base = name
+        if name[-2:] in ('_x', '_y', '_z'):
+            base = name[:-2]
+        if base in LOCATION_QUANTITIES and len(args) == 0:
+            return LOCATION_QUANTITIES[base]
+        if base in LOCATION_FUNCTIONS and len(args) == 1:
+            return multiply(args[0], LOCATION_FUNCTIONS[base])
+        if name in ('abs', 'min', 'max') and len(args) >= 1:
+            for a in args[1:]:
+                _same(args[0], a, name)
+            return args[0]
+        if name == 'sqrt' and len(args) == 1:
+            return power(args[0], 0.5)
+        if name in DIMENSIONLESS_FUNCTIONS and len(args) == 1:
+            if args[0] not in (DIMENSIONLESS, dims(rad=1)):
+                raise Unresolved(name + ' of dimensioned argument')
+            return DIMENSIONLESS
+        if name == 'if' and len(args) == 3:
+            return _same(args[1], args[2], name)
+        raise Unresolved('unknown function ' + name)
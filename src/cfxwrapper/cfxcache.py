@@ -0,0 +1,454 @@
+"""Persistent store for the results of CFX runs.
+
+   Results are appended to an SQLite table keyed by the input tuple, so
+   adding a point never rewrites the points already stored and a crash
+   can lose at most the point being written.  Several wrapper processes
+   may share one store file.  UnitStore keeps the units found for monitor
+   point expressions by the generator in the same way."""
+
+from bisect import bisect_left, bisect_right
+import cPickle
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+def _connect(filename, timeout):
+    """An SQLite connection in autocommit and WAL mode that can be shared
+       by threads (callers serialise with a lock) and processes."""
+    db = sqlite3.connect(filename, timeout=timeout, isolation_level=None,
+                         check_same_thread=False)
+    db.text_factory = str
+    db.execute('PRAGMA journal_mode=WAL')
+    return db
+
+def key_text(key):
+    """The text stored for an input tuple: equal inputs give equal text."""
+    try:
+        key = tuple([float(v) for v in key])
+    except (TypeError, ValueError):
+        key = tuple(key)
+    return repr(key)
+
+def close_enough(a, b, atol, rtol):
+    """True if every a[i] is within max(atol[i], rtol[i]*max(|a[i]|, |b[i]|))
+       of b[i]."""
+    for x, y, at, rt in zip(a, b, atol, rtol):
+        if abs(x - y) > max(at, rt * max(abs(x), abs(y))):
+            return False
+    return True
+
+def tolerance_bound(x, atol, rtol):
+    """The largest |x - y| close_enough() can accept for any y, given x:
+       |x - y| <= rtol*|y| <= rtol*(|x| + |x - y|) bounds it by
+       rtol*|x|/(1 - rtol), and by nothing for rtol >= 1."""
+    if rtol >= 1.0:
+        return float('inf')
+    bound = max(atol, rtol * abs(x) / (1.0 - rtol))
+    return bound * (1.0 + 1e-12) #round-off in the test itself
+
+class SortedIndex(object):
+    """Per-input sorted index over input tuples for lookups with per-input
+       tolerances.
+
+       The values of each input are kept sorted.  A query bisects each of
+       them for the points within tolerance_bound() of it on that input,
+       takes the input with the fewest, and tests those points in full, so
+       a lookup costs O(d log n) plus the candidates of one input, however
+       many inputs there are."""
+    def __init__(self, atol, rtol):
+        self.atol = list(atol)
+        self.rtol = list(rtol)
+        self.values = [[] for t in self.atol] #sorted, per input
+        self.ids = [[] for t in self.atol] #point index of each value
+        self.points = []
+
+    def __len__(self):
+        return len(self.points)
+
+    def add(self, key, value):
+        """Index the float tuple *key* with *value*."""
+        if len(key) != len(self.atol):
+            return
+        id = len(self.points)
+        self.points.append((key, value))
+        for x, values, ids in zip(key, self.values, self.ids):
+            pos = bisect_right(values, x)
+            values.insert(pos, x)
+            ids.insert(pos, id)
+
+    def _candidates(self, key):
+        """The point indices, in the order added, within the tolerance
+           bound of *key* on the input that has fewest of them."""
+        best = None
+        for i, x in enumerate(key):
+            tol = tolerance_bound(x, self.atol[i], self.rtol[i])
+            lo = bisect_left(self.values[i], x - tol)
+            hi = bisect_right(self.values[i], x + tol)
+            if best is None or hi - lo < best[2] - best[1]:
+                best = (i, lo, hi)
+                if lo == hi:
+                    break
+        i, lo, hi = best
+        return sorted(self.ids[i][lo:hi])
+
+    def find(self, key):
+        """The indexed (key, value) closest to *key* within tolerance, or
+           None."""
+        if len(key) != len(self.atol) or len(self.points) == 0:
+            return None
+        best = None
+        for id in self._candidates(key):
+            k, v = self.points[id]
+            if close_enough(key, k, self.atol, self.rtol):
+                d = max([abs(x - y) for x, y in zip(key, k)])
+                if best is None or d <= best[0]: #later rows win
+                    best = (d, k, v)
+        if best is None:
+            return None
+        return best[1], best[2]
+
+class ResultStore(object):
+    """Dictionary-like store of output tuples keyed by input tuples.
+
+       Every assignment appends a row; a lookup returns the latest row for
+       the key.  *timeout* is how long, in seconds, a writer waits for
+       another process to release the file.
+
+       lookup() also finds a stored point within per-input tolerances of
+       the key; see set_tolerances()."""
+    def __init__(self, filename, timeout = 60.0):
+        self.filename = filename
+        self.atol = []
+        self.rtol = []
+        self._index = None
+        self._index_id = 0 #last row id added to self._index
+        self._lock = threading.Lock()
+        self._db = _connect(filename, timeout)
+        self._db.execute('CREATE TABLE IF NOT EXISTS results ('
+                         'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'key TEXT NOT NULL, inputs BLOB NOT NULL, '
+                         'value BLOB NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS results_key '
+                         'ON results (key)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS imports ('
+                         'filename TEXT PRIMARY KEY)')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _query(self, sql, args = ()):
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    def _append(self, items, picklefile = None):
+        """Add (input tuple, output tuple) pairs in one transaction and, if
+           *picklefile* is given, record it as imported.  Returns False if
+           *picklefile* was already imported, when nothing is added."""
+        rows = [(key_text(k), sqlite3.Binary(cPickle.dumps(tuple(k), 2)),
+                 sqlite3.Binary(cPickle.dumps(v, 2))) for k, v in items]
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                if picklefile is not None:
+                    if self._db.execute('SELECT 1 FROM imports '
+                                        'WHERE filename = ?',
+                                        (picklefile,)).fetchall():
+                        self._db.execute('ROLLBACK')
+                        return False
+                    self._db.execute('INSERT INTO imports VALUES (?)',
+                                     (picklefile,))
+                self._db.executemany('INSERT INTO results '
+                                     '(key, inputs, value) VALUES (?, ?, ?)',
+                                     rows)
+            except:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+        return True
+
+    def __setitem__(self, key, value):
+        self._append([(key, value)])
+
+    def __getitem__(self, key):
+        rows = self._query('SELECT value FROM results WHERE key = ? '
+                           'ORDER BY id DESC LIMIT 1', (key_text(key),))
+        if len(rows) == 0:
+            raise KeyError(key)
+        return cPickle.loads(str(rows[0][0]))
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return len(self._query('SELECT 1 FROM results WHERE key = ? LIMIT 1',
+                               (key_text(key),))) > 0
+
+    def __len__(self):
+        return self._query('SELECT COUNT(DISTINCT key) FROM results')[0][0]
+
+    def set_tolerances(self, atol, rtol):
+        """Set the absolute and relative tolerance of each input for
+           lookup().  All zero means exact lookups only."""
+        with self._lock:
+            self.atol = [float(t) for t in atol]
+            self.rtol = [float(t) for t in rtol]
+            self._index = None
+            self._index_id = 0
+
+    def _rows_since(self, row_id):
+        """(row id, input tuple, output tuple) for every row after *row_id*,
+           oldest first.  The caller holds self._lock."""
+        rows = self._db.execute('SELECT id, inputs, value FROM results '
+                                'WHERE id > ? ORDER BY id',
+                                (row_id,)).fetchall()
+        return [(id, cPickle.loads(str(k)), cPickle.loads(str(v)))
+                for id, k, v in rows]
+
+    def rows_since(self, row_id = 0):
+        """(row id, input tuple, output tuple) for every row written, by
+           this or any other process, after *row_id*; oldest first."""
+        with self._lock:
+            return self._rows_since(row_id)
+
+    def _update_index(self):
+        """Add the rows written since the last update, by this or any other
+           process, to the index."""
+        with self._lock:
+            if self._index is None:
+                self._index = SortedIndex(self.atol, self.rtol)
+                self._index_id = 0
+            for id, k, v in self._rows_since(self._index_id):
+                try:
+                    key = tuple([float(x) for x in k])
+                except (TypeError, ValueError):
+                    continue
+                self._index.add(key, v)
+                self._index_id = id
+            return self._index
+
+    def lookup(self, key):
+        """Return (stored key, value) for *key*, or for the closest stored
+           point within the tolerances.  Raises KeyError if there is none."""
+        rows = self._query('SELECT inputs, value FROM results WHERE key = ? '
+                           'ORDER BY id DESC LIMIT 1', (key_text(key),))
+        if len(rows) > 0:
+            k, v = rows[0]
+            return cPickle.loads(str(k)), cPickle.loads(str(v))
+        if len(self.atol) != len(key) or \
+           not [t for t in self.atol + self.rtol if t > 0]:
+            raise KeyError(key)
+        try:
+            fkey = tuple([float(x) for x in key])
+        except (TypeError, ValueError):
+            raise KeyError(key)
+        found = self._update_index().find(fkey)
+        if found is None:
+            raise KeyError(key)
+        return found
+
+    def items(self):
+        """(input tuple, output tuple) for the latest row of every key."""
+        rows = self._query('SELECT inputs, value FROM results WHERE id IN '
+                           '(SELECT MAX(id) FROM results GROUP BY key) '
+                           'ORDER BY id')
+        return [(cPickle.loads(str(k)), cPickle.loads(str(v)))
+                for k, v in rows]
+
+    def keys(self):
+        return [k for k, v in self.items()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __str__(self):
+        return self.filename + ': ' + str(len(self)) + ' results'
+
+    def update(self, other):
+        """Add every item of the dictionary *other* in one transaction."""
+        self._append(other.iteritems())
+
+    def import_pickle(self, picklefile):
+        """Add the results in an old pickled cache dictionary, once.
+
+           Returns the number of results imported, 0 if *picklefile* does
+           not exist or was imported before."""
+        picklefile = os.path.abspath(picklefile)
+        if not os.path.exists(picklefile):
+            return 0
+        if self._query('SELECT 1 FROM imports WHERE filename = ?',
+                       (picklefile,)):
+            return 0
+        f = open(picklefile, 'rb')
+        try:
+            old = cPickle.load(f)
+        finally:
+            f.close()
+        if not self._append(old.iteritems(), picklefile):
+            return 0
+        return len(old)
+
+class ResFileCache(object):
+    """CFX result files of solved points, kept to warm start new solves.
+
+       The files are kept in *directory*, with an index of their input
+       tuples.  When their total size is over *budget* bytes the least
+       recently used are deleted.  Several wrapper processes may share
+       one directory."""
+    def __init__(self, directory, budget, timeout = 60.0):
+        self.directory = directory
+        self.budget = budget
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+        self._db = _connect(os.path.join(directory, 'index.db'), timeout)
+        self._db.execute('CREATE TABLE IF NOT EXISTS resfiles ('
+                         'name TEXT PRIMARY KEY, inputs BLOB NOT NULL, '
+                         'size INTEGER NOT NULL, used REAL NOT NULL)')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def add(self, inputs, resfile, move = False):
+        """Keep *resfile*, the result of solving *inputs*, and return the
+           path of the kept file.  The file is copied, or moved if *move*:
+           a hard link would follow the original when it is rewritten."""
+        name = hashlib.sha1(key_text(inputs)).hexdigest() + '.res'
+        path = self.path(name)
+        tmp = path + '.' + str(os.getpid()) + '.tmp'
+        if move:
+            shutil.move(resfile, tmp)
+        else:
+            shutil.copyfile(resfile, tmp)
+        if os.path.exists(path):
+            os.remove(path) #os.rename will not replace on Windows
+        os.rename(tmp, path)
+        blob = sqlite3.Binary(cPickle.dumps(tuple(inputs), 2))
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO resfiles VALUES '
+                             '(?, ?, ?, ?)',
+                             (name, blob, os.path.getsize(path), time.time()))
+        self.trim(keep=name)
+        return path
+
+    def total(self):
+        """Total size in bytes of the files kept."""
+        with self._lock:
+            size = self._db.execute('SELECT SUM(size) FROM resfiles'
+                                    ).fetchall()[0][0]
+        return size or 0
+
+    def trim(self, budget = None, keep = None):
+        """Delete least recently used files until the total size is within
+           *budget* (by default self.budget).  The file named *keep* is
+           not deleted.  Returns the number deleted."""
+        if budget is None:
+            budget = self.budget
+        with self._lock:
+            rows = self._db.execute('SELECT name, size FROM resfiles '
+                                    'ORDER BY used DESC').fetchall()
+            total = sum([size for name, size in rows])
+            deleted = 0
+            for name, size in reversed(rows):
+                if total <= budget:
+                    break
+                if name == keep:
+                    continue
+                self._db.execute('DELETE FROM resfiles WHERE name = ?',
+                                 (name,))
+                try:
+                    os.remove(self.path(name))
+                except OSError:
+                    pass #already gone
+                total -= size
+                deleted += 1
+        return deleted
+
+    def nearest(self, inputs):
+        """Path of the kept file solved at the inputs nearest to *inputs*,
+           measured in units of the spread of each input over the files
+           kept, or None if there are none.  Marks the file as used."""
+        with self._lock:
+            rows = self._db.execute('SELECT name, inputs FROM resfiles'
+                                    ).fetchall()
+            points = []
+            for name, k in rows:
+                k = cPickle.loads(str(k))
+                if len(k) == len(inputs):
+                    points.append((name, k))
+            if len(points) == 0:
+                return None
+            spread = []
+            for i in range(len(inputs)):
+                values = [k[i] for name, k in points] + [inputs[i]]
+                spread.append((max(values) - min(values)) or 1.0)
+            best = None
+            for name, k in points:
+                d = sum([((a - b) / s) ** 2
+                         for a, b, s in zip(inputs, k, spread)])
+                if best is None or d < best[0]:
+                    best = (d, name)
+            name = best[1]
+            if not os.path.exists(self.path(name)):
+                self._db.execute('DELETE FROM resfiles WHERE name = ?',
+                                 (name,))
+                best = None
+            else:
+                self._db.execute('UPDATE resfiles SET used = ? '
+                                 'WHERE name = ?', (time.time(), name))
+        if best is None:
+            return self.nearest(inputs) #try the next nearest
+        return self.path(name)
+
+class UnitStore(object):
+    """Units found for the CEL expressions of monitor points, kept in the
+       SQLite file *filename*, which several generators may share.  The
+       units of an expression depend on its text, the solution units of
+       its flow (a dictionary of base unit -> unit) and the definitions in
+       the .def file, given by the hash of its contents."""
+    def __init__(self, filename, timeout = 60.0):
+        self.filename = filename
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+        self._db = _connect(filename, timeout)
+        self._db.execute('CREATE TABLE IF NOT EXISTS units ('
+                         'key TEXT PRIMARY KEY, units TEXT NOT NULL)')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    @staticmethod
+    def key(expr, solution_units, def_digest):
+        return repr((expr, tuple(sorted(solution_units.items())), def_digest))
+
+    def get(self, expr, solution_units, def_digest):
+        """The units stored for *expr*, or None."""
+        with self._lock:
+            rows = self._db.execute('SELECT units FROM units WHERE key = ?',
+                (self.key(expr, solution_units, def_digest),)).fetchall()
+        if len(rows) == 0:
+            return None
+        return rows[0][0]
+
+    def put(self, expr, solution_units, def_digest, units):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO units VALUES (?, ?)',
+                (self.key(expr, solution_units, def_digest), units))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM units'
+                                    ).fetchall()[0][0]
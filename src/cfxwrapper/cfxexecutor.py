@@ -0,0 +1,297 @@
+"""Executors that run CFX solves here or on other hosts.
+
+   A SolveTask is everything a host needs to solve one design point: the
+   CCL fragment setting the inputs and the CFX command lines, which name
+   their files relative to the run directory.  An executor runs tasks
+   and gives back, for each, a job whose result() is a dictionary of
+   monitor point name -> last value and the path of the result file.
+
+   LocalExecutor runs tasks on this host.  QueueExecutor puts them in a
+   job queue directory on a file system shared with the worker nodes,
+   where QueueWorker processes (python cfxexecutor.py <queue directory>)
+   take them one at a time; the CFX installation and the files named in
+   the commands must have the same paths on every node.  WorkerProcesses
+   starts workers on this host, in place of a scheduler, for testing."""
+
+import multiprocessing
+import os
+import pickle
+import socket
+import sys
+import time
+import uuid
+
+from cfxmonitor import read_histories
+from cfxprocess import SolveCancelled, SolveError, SolveJob, SolveTimeout
+import cfxscratch
+
+#subdirectories of a queue directory
+PENDING = 'pending' #<name>.task, waiting for a worker
+RUNNING = 'running' #<name>.task, taken by a worker
+DONE = 'done' #<name>.result
+CANCEL = 'cancel' #<name>, asks the worker running it to stop
+RUNS = 'runs' #scratch space of the workers
+
+#errors a worker can report, by name
+ERRORS = dict([(e.__name__, e) for e in (SolveError, SolveCancelled,
+                                         SolveTimeout)])
+
+class SolveTask(object):
+    """One design point to solve: *inputs*, the *ccl* text setting them,
+       the commands *cmds* to run in the run directory, and the base name
+       *base* of the files they use there: <base>.ccl, <base>.res and the
+       monitor file <base>mon.txt."""
+    def __init__(self, inputs, ccl, cmds, base):
+        self.inputs = tuple(inputs)
+        self.ccl = ccl
+        self.cmds = cmds
+        self.base = base
+
+    def state(self):
+        """The task as a dictionary of built-in types, to be written to a
+           queue independent of where this module is imported from."""
+        return {'inputs': self.inputs, 'ccl': self.ccl, 'cmds': self.cmds,
+                'base': self.base}
+
+    def read(self, rundir):
+        """(monitor point name -> last value, result file path) after the
+           commands have run in *rundir*."""
+        monfile = os.path.join(rundir, self.base + 'mon.txt')
+        try:
+            histories = read_histories(monfile)
+        except IOError:
+            raise SolveError('no monitor file ' + monfile)
+        values = dict([(n, h[-1]) for n, h in histories.items() if h])
+        if len(values) == 0:
+            raise SolveError('no monitor point values in ' + monfile)
+        return values, os.path.join(rundir, self.base + '.res')
+
+    def job(self, rundir, finish = None, timeout = None):
+        """A SolveJob, not started, running the task in *rundir*; its
+           result is read(rundir), or *finish* of it."""
+        f = open(os.path.join(rundir, self.base + '.ccl'), 'w')
+        f.write(self.ccl)
+        f.close()
+
+        def read():
+            if finish is not None:
+                return finish(self.read(rundir))
+            return self.read(rundir)
+        return SolveJob(self.cmds, rundir, finish=read, timeout=timeout)
+
+class Executor(object):
+    """Runs SolveTasks.  submit() returns a job with the done(), result(),
+       cancel() and add_done_callback() of a cfxprocess.SolveJob."""
+    def submit(self, task, finish = None, timeout = None):
+        """Start *task*; the result of the job is *finish*(SolveTask.read
+           result) if *finish* is given.  *timeout* is in seconds."""
+        raise NotImplementedError('submit')
+
+    def close(self):
+        pass
+
+class LocalExecutor(Executor):
+    """Runs each task on this host in a new run directory of the
+       cfxscratch.ScratchSpace *scratch*."""
+    def __init__(self, scratch):
+        self.scratch = scratch
+
+    def submit(self, task, finish = None, timeout = None):
+        rundir = self.scratch.new_run(task.base)
+        job = task.job(rundir, finish, timeout)
+        job.add_done_callback(lambda job: self.scratch.finish(rundir))
+        return job.start()
+
+def _write_file(filename, obj):
+    """Pickle *obj* to *filename* so readers never see it half written."""
+    tmpname = filename + '.' + uuid.uuid4().hex + '.tmp'
+    f = open(tmpname, 'wb')
+    try:
+        pickle.dump(obj, f, 2)
+    finally:
+        f.close()
+    os.rename(tmpname, filename)
+
+def _read_file(filename):
+    f = open(filename, 'rb')
+    try:
+        return pickle.load(f)
+    finally:
+        f.close()
+
+def make_queue(queuedir):
+    """Make the subdirectories of the queue directory *queuedir*."""
+    for sub in (PENDING, RUNNING, DONE, CANCEL, RUNS):
+        path = os.path.join(queuedir, sub)
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                if not os.path.isdir(path): #not made by another process
+                    raise
+
+class QueuedJob(SolveJob):
+    """A task in a queue directory, waited for by a thread polling for
+       its result.  Cancelling it takes it out of the queue if no worker
+       has it yet, else asks the worker to stop it."""
+    def __init__(self, queuedir, name, finish = None, timeout = None):
+        super(QueuedJob, self).__init__([], finish=self._collect,
+                                        timeout=timeout)
+        self.queuedir = queuedir
+        self.name = name
+        self.convert = finish
+
+    def _path(self, sub, suffix = ''):
+        return os.path.join(self.queuedir, sub, self.name + suffix)
+
+    def _collect(self):
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+        resultfile = self._path(DONE, '.result')
+        while not os.path.exists(resultfile):
+            if self._cancelled:
+                raise SolveCancelled('cancelled ' + self.name)
+            if deadline is not None and time.time() > deadline:
+                self._withdraw()
+                raise SolveTimeout(self.name + ' took more than ' +
+                                   str(self.timeout) + ' s')
+            time.sleep(self.poll_interval)
+        if self._cancelled: #finished anyway
+            os.remove(resultfile)
+            raise SolveCancelled('cancelled ' + self.name)
+        value, error = _read_file(resultfile)
+        os.remove(resultfile)
+        if error is not None:
+            raise ERRORS.get(error[0], SolveError)(error[1])
+        if self.convert is not None:
+            return self.convert(value)
+        return value
+
+    def cancel(self):
+        if not self.done():
+            super(QueuedJob, self).cancel()
+            self._withdraw()
+
+    def _withdraw(self):
+        """Take the task out of the queue, or ask its worker to stop."""
+        try:
+            os.remove(self._path(PENDING, '.task'))
+        except OSError:
+            open(self._path(CANCEL), 'w').close() #a worker has it
+
+class QueueExecutor(Executor):
+    """Puts tasks in the queue directory *queuedir* for QueueWorkers."""
+    poll_interval = 1.0
+
+    def __init__(self, queuedir):
+        self.queuedir = queuedir
+        make_queue(queuedir)
+
+    def submit(self, task, finish = None, timeout = None):
+        #names sort in the order submitted, and are unique across hosts
+        name = '%017.6f_%s' % (time.time(), uuid.uuid4().hex)
+        job = QueuedJob(self.queuedir, name, finish, timeout)
+        job.poll_interval = self.poll_interval
+        _write_file(job._path(PENDING, '.task'), task.state())
+        return job.start()
+
+class QueueWorker(object):
+    """Takes tasks from the queue directory *queuedir* one at a time and
+       runs them in run directories under <queuedir>/runs, kept within
+       *budget* bytes."""
+    def __init__(self, queuedir, budget = 20 * 1024 ** 3,
+                 poll_interval = 1.0):
+        self.queuedir = queuedir
+        self.poll_interval = poll_interval
+        make_queue(queuedir)
+        self.scratch = cfxscratch.ScratchSpace(os.path.join(queuedir, RUNS),
+                                               budget)
+        self.name = socket.gethostname() + ' ' + str(os.getpid())
+
+    def _claim(self):
+        """The name of a pending task this worker now has, or None."""
+        pending = os.path.join(self.queuedir, PENDING)
+        for filename in sorted(os.listdir(pending)):
+            if not filename.endswith('.task'):
+                continue
+            try:
+                #only one worker's rename succeeds
+                os.rename(os.path.join(pending, filename),
+                          os.path.join(self.queuedir, RUNNING, filename))
+            except OSError:
+                continue
+            return filename[:-len('.task')]
+        return None
+
+    def run_once(self):
+        """Run one pending task; False if there was none."""
+        name = self._claim()
+        if name is None:
+            return False
+        taskfile = os.path.join(self.queuedir, RUNNING, name + '.task')
+        cancelfile = os.path.join(self.queuedir, CANCEL, name)
+        value = error = None
+        try:
+            task = SolveTask(**_read_file(taskfile))
+            rundir = self.scratch.new_run(task.base)
+            try:
+                job = task.job(rundir).start()
+                while not job.wait(self.poll_interval):
+                    if os.path.exists(cancelfile):
+                        job.cancel()
+                value = job.result()
+            finally:
+                self.scratch.finish(rundir)
+        except SolveError:
+            e = sys.exc_info()[1]
+            error = (type(e).__name__, str(e))
+        except:
+            error = ('SolveError', str(sys.exc_info()[1]))
+        print self.name + ' ran ' + name + ': ' + str(error or value[0])
+        if os.path.exists(cancelfile):
+            os.remove(cancelfile) #nobody waits for the result
+        else:
+            _write_file(os.path.join(self.queuedir, DONE, name + '.result'),
+                        (value, error))
+        os.remove(taskfile)
+        self.scratch.collect()
+        return True
+
+    def serve(self, stop = None):
+        """Run tasks until *stop* (a threading or multiprocessing Event)
+           is set, or for ever."""
+        while stop is None or not stop.is_set():
+            if not self.run_once():
+                if stop is None:
+                    time.sleep(self.poll_interval)
+                else:
+                    stop.wait(self.poll_interval)
+
+def _serve(queuedir, poll_interval, stop):
+    QueueWorker(queuedir, poll_interval=poll_interval).serve(stop)
+
+class WorkerProcesses(object):
+    """*processes* QueueWorkers for *queuedir* on this host, each in its
+       own process, until close()."""
+    def __init__(self, queuedir, processes, poll_interval = 1.0):
+        make_queue(queuedir)
+        self._stop = multiprocessing.Event()
+        self.processes = [multiprocessing.Process(target=_serve,
+                              args=(queuedir, poll_interval, self._stop))
+                          for n in range(processes)]
+        for p in self.processes:
+            p.daemon = True
+            p.start()
+
+    def close(self):
+        """Stop the workers once they finish their tasks."""
+        self._stop.set()
+        for p in self.processes:
+            p.join()
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print 'usage: python cfxexecutor.py <queue directory>'
+        sys.exit(2)
+    QueueWorker(sys.argv[1]).serve()
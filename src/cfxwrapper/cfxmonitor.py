@@ -0,0 +1,143 @@
+"""Convergence monitoring of running CFX solves.
+
+   A ConvergenceMonitor samples the monitor point histories of a running
+   solve at intervals, by running cfx5mondata on its run directory, and
+   once every Window criterion holds asks the solver to stop with
+   cfx5stop, so a run that has settled need not finish its iterations."""
+
+import os.path
+import subprocess
+import sys
+import threading
+
+import cfxunitsinfo
+
+def read_histories(filename):
+    """Monitor point histories from a cfx5mondata output file, as a
+       dictionary of monitor point name -> list of values, one per
+       iteration.  Values that are not numbers are left out."""
+    f = open(filename, 'r')
+    try:
+        lines = [l.strip() for l in f.readlines() if l.strip()]
+    finally:
+        f.close()
+    if len(lines) == 0:
+        return {}
+    nameline = lines[0].replace('USER POINT,', '').replace('"', '')
+    names = nameline.strip().split(',')
+    histories = dict([(n, []) for n in names])
+    for line in lines[1:]:
+        for name, valstr in zip(names, line.split(',')):
+            val, isnum = cfxunitsinfo.get_number(valstr)
+            if isnum:
+                histories[name].append(val)
+    return histories
+
+class Window(object):
+    """Holds once the last *iterations* values of monitor point *name* lie
+       within max(atol, rtol*|mean|) of each other."""
+    def __init__(self, name, iterations, atol = 0.0, rtol = 0.0):
+        self.name = name
+        self.iterations = iterations
+        self.atol = atol
+        self.rtol = rtol
+
+    def holds(self, history):
+        if len(history) < self.iterations:
+            return False
+        last = history[-self.iterations:]
+        mean = sum(last) / len(last)
+        return max(last) - min(last) <= max(self.atol,
+                                            self.rtol * abs(mean))
+
+    def __repr__(self):
+        return 'Window(%r, %r, atol=%r, rtol=%r)' % (self.name,
+            self.iterations, self.atol, self.rtol)
+
+class ConvergenceMonitor(object):
+    """Samples the histories of a running solve every *interval* seconds.
+
+       *rundir* is the run directory of the solve.  *samplecmd*(outfile)
+       is the cfx5mondata command writing the histories to *outfile*,
+       *stopcmd* the cfx5stop command.  When every Window in *criteria*
+       holds the run is stopped, once.  self.histories holds the latest
+       sample; *sampled*(monitor), if given, is called after each one."""
+    def __init__(self, rundir, samplecmd, stopcmd, criteria,
+                 interval = 60.0, sampled = None):
+        self.rundir = rundir
+        self.samplecmd = samplecmd
+        self.stopcmd = stopcmd
+        self.criteria = criteria
+        self.interval = interval
+        self.sampled = sampled
+        self.histories = {}
+        self.converged = False #the criteria held and the run was stopped
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop sampling; the solve is left alone."""
+        self._finished.set()
+
+    def history(self, name):
+        """A copy of the latest history of monitor point *name*."""
+        with self._lock:
+            return list(self.histories.get(name, []))
+
+    def sample(self):
+        """Read the histories now.  Returns False if the run directory is
+           not there (yet) or cfx5mondata failed."""
+        if not os.path.isdir(self.rundir):
+            return False
+        outfile = os.path.join(os.path.dirname(self.rundir),
+                               os.path.basename(self.rundir) + 'hist.txt')
+        devnull = open(os.devnull, 'w')
+        try:
+            return_code = subprocess.call(self.samplecmd(outfile),
+                                          stdout=devnull,
+                                          stderr=subprocess.STDOUT)
+        except OSError:
+            print 'Error sampling ' + self.rundir
+            print sys.exc_info()[1]
+            return False
+        finally:
+            devnull.close()
+        if return_code != 0 or not os.path.exists(outfile):
+            return False
+        histories = read_histories(outfile)
+        with self._lock:
+            self.histories = histories
+            self.samples += 1
+        if self.sampled is not None:
+            self.sampled(self)
+        return True
+
+    def check(self):
+        """True if every criterion holds for the latest histories."""
+        with self._lock:
+            return len(self.criteria) > 0 and \
+                   not [c for c in self.criteria
+                        if not c.holds(self.histories.get(c.name, []))]
+
+    def _run(self):
+        while not self._finished.wait(self.interval):
+            if not self.sample() or not self.check():
+                continue
+            print 'Converged by ' + str(self.criteria) + ', stopping ' + \
+                  self.rundir
+            try:
+                subprocess.call(self.stopcmd)
+            except OSError:
+                print 'Error in ' + str(self.stopcmd)
+                print sys.exc_info()[1]
+            else:
+                self.converged = True
+            return
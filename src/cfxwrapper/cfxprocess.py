@@ -0,0 +1,190 @@
+"""Background runs of the CFX executables.
+
+   A SolveJob runs a list of commands one after another without blocking
+   its caller, passes each line the commands write to a callback as it
+   arrives, and can be cancelled or given a time limit.  Any number of
+   jobs can be in flight from one thread; wait_any() and wait_all() wait
+   on several at once."""
+
+import subprocess
+import sys
+import threading
+import time
+
+class SolveError(RuntimeError):
+    """A command of a SolveJob failed."""
+
+class SolveCancelled(SolveError):
+    """The SolveJob was cancelled."""
+
+class SolveTimeout(SolveError):
+    """The SolveJob ran out of time."""
+
+class SolveJob(object):
+    """Runs *cmds* in *cwd*, one after another, in a background thread.
+
+       *output*, if given, is called as output(stream, line) for every line
+       written, *stream* being 'stdout' or 'stderr'; it is called from the
+       threads reading the commands' output.  Once every command returns
+       0, *finish*() gives the result of the job.  *timeout* is in seconds
+       for the whole job.  Call start() to begin."""
+    poll_interval = 0.05
+
+    def __init__(self, cmds, cwd = None, output = None, finish = None,
+                 timeout = None):
+        self.cmds = cmds
+        self.cwd = cwd
+        self.output = output
+        self.finish = finish
+        self.timeout = timeout
+        self.process = None #the command running now
+        self.monitor = None #a cfxmonitor.ConvergenceMonitor set by the caller
+        self.return_code = None
+        self._value = None
+        self._error = None
+        self._cancelled = False
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._callbacks = []
+        self._thread = None
+
+    @classmethod
+    def finished(cls, value):
+        """A job that has already finished with *value*."""
+        job = cls([])
+        job._value = value
+        job._done.set()
+        return job
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def _pump(self, stream, name):
+        for line in iter(stream.readline, ''):
+            if self.output is not None:
+                self.output(name, line)
+        stream.close()
+
+    def _run_one(self, cmd, deadline):
+        with self._lock:
+            if self._cancelled:
+                raise SolveCancelled('cancelled before ' + str(cmd))
+            self.process = subprocess.Popen(cmd, cwd=self.cwd,
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.PIPE)
+        readers = [threading.Thread(target=self._pump, args=(s, n))
+                   for s, n in ((self.process.stdout, 'stdout'),
+                                (self.process.stderr, 'stderr'))]
+        for r in readers:
+            r.daemon = True
+            r.start()
+        #Popen.wait has no time limit, so poll
+        while self.process.poll() is None:
+            if deadline is not None and time.time() > deadline:
+                self._kill()
+                self.process.wait()
+                raise SolveTimeout(str(cmd) + ' took more than ' +
+                                   str(self.timeout) + ' s')
+            time.sleep(self.poll_interval)
+        for r in readers:
+            r.join()
+        self.return_code = self.process.returncode
+        if self._cancelled:
+            raise SolveCancelled('cancelled during ' + str(cmd))
+        if self.return_code != 0:
+            raise SolveError(str(cmd) + ': return code ' +
+                             str(self.return_code))
+
+    def _run(self):
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+        try:
+            for cmd in self.cmds:
+                self._run_one(cmd, deadline)
+            if self._cancelled:
+                raise SolveCancelled('cancelled')
+            if self.finish is not None:
+                self._value = self.finish()
+        except SolveError:
+            self._error = sys.exc_info()[1]
+        except (OSError, IOError):
+            self._error = SolveError(str(sys.exc_info()[1]))
+        except:
+            self._error = sys.exc_info()[1]
+        with self._lock:
+            self._done.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+        for callback in callbacks:
+            callback(self)
+
+    def _kill(self):
+        try:
+            self.process.kill()
+        except OSError:
+            pass #finished meanwhile
+
+    def cancel(self):
+        """Stop the job, killing the command running now."""
+        with self._lock:
+            self._cancelled = True
+            if self.process is not None and self.process.poll() is None:
+                self._kill()
+
+    def cancelled(self):
+        return self._cancelled and isinstance(self._error, SolveCancelled)
+
+    def done(self):
+        return self._done.is_set()
+
+    def add_done_callback(self, callback):
+        """Call *callback*(job) when the job is done, or now if it is."""
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def wait(self, timeout = None):
+        """Wait up to *timeout* seconds for the job; True if it is done."""
+        if timeout is None:
+            while not self._done.wait(1.0): #stays interruptible
+                pass
+            return True
+        return self._done.wait(timeout)
+
+    def result(self, timeout = None):
+        """The result of *finish*, once done.  Raises the error the job
+           stopped with, or SolveTimeout if it is not done in *timeout*."""
+        if not self.wait(timeout):
+            raise SolveTimeout('still running after ' + str(timeout) + ' s')
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+def wait_any(jobs, timeout = None):
+    """Wait until one of *jobs* is done; return the ones that are."""
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+    while True:
+        done = [j for j in jobs if j.done()]
+        if done or (deadline is not None and time.time() >= deadline):
+            return done
+        time.sleep(SolveJob.poll_interval)
+
+def wait_all(jobs, timeout = None):
+    """Wait until all of *jobs* are done; return the ones that are."""
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+    for j in jobs:
+        if deadline is None:
+            j.wait()
+        else:
+            j.wait(max(0.0, deadline - time.time()))
+    return [j for j in jobs if j.done()]
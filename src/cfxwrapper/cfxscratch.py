@@ -0,0 +1,151 @@
+"""Scratch space for CFX runs.
+
+   Every solve gets its own run directory under one root, marked active
+   while the solver may still write to it.  collect() keeps the finished
+   runs within a disk budget: first their text output is compressed, then
+   sweep() deletes the oldest runs.  Only directories made by new_run(),
+   which records them with a marker file, are ever compressed or deleted;
+   anything else under the root is left alone."""
+
+import gzip
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+ACTIVE = '.active' #marker file in a run directory while it is in use
+RUN = '.run' #marker file recording that new_run() made the directory
+
+def disk_usage(path):
+    """Total size in bytes of the files under *path*."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass #removed meanwhile
+    return total
+
+def gzip_file(filename):
+    """Replace *filename* by *filename*.gz."""
+    src = open(filename, 'rb')
+    try:
+        dst = gzip.open(filename + '.gz', 'wb')
+        try:
+            shutil.copyfileobj(src, dst)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+    os.remove(filename)
+
+class ScratchSpace(object):
+    """Run directories under *root*, kept within *budget* bytes.
+
+       Files matching *compress* (by default the solver's .out and the
+       logs) are gzipped in finished runs before any run is deleted.  A
+       run whose active marker is older than *stale_age* seconds is taken
+       to belong to a process that died, and is collected too."""
+    def __init__(self, root, budget, compress = ('.out', '.log', 'hist.txt'),
+                 stale_age = 7 * 24 * 3600.0):
+        self.root = root
+        self.budget = budget
+        self.compress = compress
+        self.stale_age = stale_age
+        self._lock = threading.Lock()
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def new_run(self, prefix = 'run'):
+        """Make and return a new, active, run directory."""
+        rundir = tempfile.mkdtemp(prefix=prefix + '_', dir=self.root)
+        owner = socket.gethostname() + ' ' + str(os.getpid()) + '\n'
+        for marker in (RUN, ACTIVE):
+            f = open(os.path.join(rundir, marker), 'w')
+            f.write(owner)
+            f.close()
+        return rundir
+
+    def finish(self, rundir):
+        """Mark *rundir* finished, so collect() may compress or delete it."""
+        try:
+            os.remove(os.path.join(rundir, ACTIVE))
+        except OSError:
+            pass
+
+    def runs(self):
+        """(modification time, path) of the finished runs made by
+           new_run(), oldest first."""
+        now = time.time()
+        runs = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not os.path.isfile(os.path.join(path, RUN)):
+                continue #not ours
+            try:
+                active = os.path.getmtime(os.path.join(path, ACTIVE))
+            except OSError:
+                active = None
+            if active is not None and now - active < self.stale_age:
+                continue
+            try:
+                runs.append((os.path.getmtime(path), path))
+            except OSError:
+                pass #removed meanwhile
+        runs.sort()
+        return runs
+
+    def usage(self):
+        return disk_usage(self.root)
+
+    def collect(self, budget = None):
+        """Bring the root within *budget* bytes (by default self.budget).
+           Returns (files compressed, runs deleted)."""
+        if budget is None:
+            budget = self.budget
+        compressed = deleted = 0
+        with self._lock:
+            total = self.usage()
+            if total <= budget:
+                return compressed, deleted
+            runs = self.runs()
+            for mtime, path in runs:
+                for dirpath, dirnames, filenames in os.walk(path):
+                    for name in filenames:
+                        if not name.endswith(self.compress):
+                            continue
+                        filename = os.path.join(dirpath, name)
+                        before = os.path.getsize(filename)
+                        gzip_file(filename)
+                        total -= before - os.path.getsize(filename + '.gz')
+                        compressed += 1
+                if total <= budget:
+                    return compressed, deleted
+            deleted = self._sweep(runs, total, budget)
+        return compressed, deleted
+
+    def sweep(self, budget = 0, keep = ()):
+        """Delete finished runs, oldest first, until the root is within
+           *budget* bytes, except the run directories in *keep*.  Returns
+           the number of runs deleted."""
+        with self._lock:
+            return self._sweep(self.runs(), self.usage(), budget, keep)
+
+    def _sweep(self, runs, total, budget, keep = ()):
+        keep = set([os.path.normcase(os.path.abspath(k)) for k in keep if k])
+        deleted = 0
+        for mtime, path in runs:
+            if total <= budget:
+                break
+            if os.path.normcase(os.path.abspath(path)) in keep:
+                continue
+            size = disk_usage(path)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            deleted += 1
+        return deleted
@@ -0,0 +1,195 @@
+"""Pools of solver sessions.
+
+   A SessionPool keeps a fixed number of solver slots and hands each point
+   submitted to the first slot that is free, preferring the slot whose
+   last point was nearest, so a slot that keeps solver state warm gets
+   the points that benefit from it.  A slot is a SolverSession: start()
+   pays the start-up cost once, then solve() is called for each point.
+
+   cfx5solve has no resident mode that takes new points, so LaunchSession,
+   the session for CFX itself, keeps no solver state: each point is a new
+   cfx5solve, warm started, as any solve is, from the nearest kept result
+   file whichever slot made it.  For CFX the slots only bound how many
+   solves run at once and keep nearby points together."""
+
+import sys
+import threading
+
+from cfxprocess import SolveCancelled, SolveError, SolveTimeout
+
+class SolverSession(object):
+    """One solver slot.  Subclasses implement solve()."""
+    def __init__(self, name = ''):
+        self.name = name
+        self.started = False
+        self.last_inputs = None #the point solved last
+
+    def start(self):
+        """Pay the start-up cost; called once before the first solve."""
+        self.started = True
+
+    def solve(self, inputvals):
+        """Start solving *inputvals* and return a started SolveJob."""
+        raise NotImplementedError('solve')
+
+    def close(self):
+        self.started = False
+
+class LaunchSession(SolverSession):
+    """Runs each point as a new cfx5solve through *wrapper*; nothing is
+       started once or kept between the points of the slot."""
+    def __init__(self, wrapper, name = ''):
+        super(LaunchSession, self).__init__(name)
+        self.wrapper = wrapper
+
+    def solve(self, inputvals):
+        return self.wrapper._start_point(inputvals)
+
+class PooledJob(object):
+    """A point waiting for, or running in, a slot of a SessionPool.  Has
+       the done(), result(), cancel() and add_done_callback() of a
+       SolveJob; self.session is the slot it ran in."""
+    def __init__(self, inputvals):
+        self.inputvals = tuple(inputvals)
+        self.session = None
+        self.inner = None #the SolveJob of the session
+        self._value = None
+        self._error = None
+        self._cancelled = False
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def _finish(self, value = None, error = None):
+        with self._lock:
+            self._value = value
+            self._error = error
+            self._done.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+        for callback in callbacks:
+            callback(self)
+
+    def done(self):
+        return self._done.is_set()
+
+    def cancel(self):
+        """Drop the point if it is waiting, or cancel its solve."""
+        with self._lock:
+            self._cancelled = True
+            inner = self.inner
+        if inner is not None:
+            inner.cancel()
+
+    def cancelled(self):
+        return self._cancelled and isinstance(self._error, SolveCancelled)
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def wait(self, timeout = None):
+        if timeout is None:
+            while not self._done.wait(1.0):
+                pass
+            return True
+        return self._done.wait(timeout)
+
+    def result(self, timeout = None):
+        if not self.wait(timeout):
+            raise SolveTimeout('still running after ' + str(timeout) + ' s')
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+def _distance(a, b):
+    """Sum of the relative differences of two input tuples."""
+    d = 0.0
+    for x, y in zip(a, b):
+        d += abs(x - y) / (max(abs(x), abs(y)) or 1.0)
+    return d
+
+class SessionPool(object):
+    """*slots* sessions made by *factory*(slot number), each served by a
+       thread that takes the next point when its session is free.  With
+       *affinity* a free session takes the waiting point nearest to its
+       last point, else the one waiting longest.  Sessions are started
+       when first needed and kept until close()."""
+    def __init__(self, factory, slots, affinity = True):
+        self.sessions = [factory(n) for n in range(slots)]
+        self.affinity = affinity
+        self._queue = []
+        self._closed = False
+        self._cond = threading.Condition()
+        self._threads = []
+        for session in self.sessions:
+            t = threading.Thread(target=self._serve, args=(session,))
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, inputvals):
+        """Queue a point; returns its PooledJob."""
+        job = PooledJob(inputvals)
+        with self._cond:
+            if self._closed:
+                raise SolveError('session pool is closed')
+            self._queue.append(job)
+            self._cond.notify()
+        return job
+
+    def _take(self, session):
+        """The next waiting point for *session*; the caller holds
+           self._cond."""
+        n = 0
+        if self.affinity and session.last_inputs is not None:
+            distances = [_distance(session.last_inputs, job.inputvals)
+                         for job in self._queue]
+            n = distances.index(min(distances))
+        return self._queue.pop(n)
+
+    def _serve(self, session):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait(1.0)
+                if self._closed:
+                    return
+                job = self._take(session)
+            if job._cancelled:
+                job._finish(error=SolveCancelled('cancelled while waiting'))
+                continue
+            try:
+                if not session.started:
+                    session.start()
+                with job._lock:
+                    job.session = session
+                    job.inner = session.solve(job.inputvals)
+                    if job._cancelled:
+                        job.inner.cancel()
+                value = job.inner.result()
+            except SolveError:
+                job._finish(error=sys.exc_info()[1])
+            except:
+                job._finish(error=SolveError(str(sys.exc_info()[1])))
+            else:
+                session.last_inputs = job.inputvals
+                job._finish(value)
+
+    def close(self):
+        """Stop the slots once they finish their points; points still
+           waiting are cancelled."""
+        with self._cond:
+            self._closed = True
+            waiting = self._queue
+            self._queue = []
+            self._cond.notify_all()
+        for job in waiting:
+            job._finish(error=SolveCancelled('session pool closed'))
+        for t in self._threads:
+            t.join()
+        for session in self.sessions:
+            session.close()
@@ -0,0 +1,158 @@
+"""Response surface over cached CFX results.
+
+   RBFSurrogate interpolates the cached (inputs -> outputs) pairs with
+   multiquadric radial basis functions plus a constant, and estimates its
+   own error from the leave-one-out residuals of the points around a
+   query (Rippa's formula), so a caller can decide whether to trust an
+   estimate or run the solver.  Points are added one at a time by a
+   bordered update of the inverse of the interpolation matrix.
+
+   Needs numpy."""
+
+import sys
+
+try:
+    import numpy
+except ImportError: # pragma: no cover
+    numpy = None
+
+class SingularFit(ValueError):
+    """The interpolation matrix of the points fitted is singular, as when
+       two points have the same inputs."""
+
+class RBFSurrogate(object):
+    """Multiquadric RBF interpolant phi(r) = sqrt(r**2 + c**2).
+
+       Inputs are divided by *scales* (by default the spread of the first
+       points fitted, per input) before distances are taken.  *shape* is
+       c in the scaled space; by default the mean distance from a point to
+       its nearest neighbour in the first fit.  *smoothing* is added to
+       the diagonal and lets noisy results be approximated, not matched."""
+    def __init__(self, scales = None, shape = None, smoothing = 0.0):
+        if numpy is None:
+            raise ImportError('RBFSurrogate needs numpy')
+        self.scales = scales
+        self.shape = shape
+        self.smoothing = smoothing
+        self.x = None #scaled inputs, one row per point
+        self.y = None #outputs, one row per point
+        self.minv = None #inverse of [[0, 1'], [1, A]]
+        self.weights = None
+        self.loo = None #leave-one-out errors, one row per point
+        self.nn2 = None #squared distance from each point to its nearest
+
+    def __len__(self):
+        if self.x is None:
+            return 0
+        return len(self.x)
+
+    def _phi(self, d2):
+        return numpy.sqrt(d2 + self.shape ** 2)
+
+    def _sqdist(self, a, b):
+        """Squared distances between the rows of *a* and of *b*."""
+        diff = a[:, numpy.newaxis, :] - b[numpy.newaxis, :, :]
+        return (diff ** 2).sum(-1)
+
+    def fit(self, inputs, outputs):
+        """Fit from scratch to sequences of input and output tuples.
+           Raises SingularFit, leaving no fit, if the inputs repeat."""
+        x = numpy.array(inputs, dtype=float)
+        y = numpy.array(outputs, dtype=float)
+        if self.scales is None:
+            spread = x.max(0) - x.min(0)
+            self.scales = numpy.where(spread > 0, spread, 1.0)
+        self.scales = numpy.asarray(self.scales, dtype=float)
+        x = x / self.scales
+        d2 = self._sqdist(x, x)
+        if self.shape is None:
+            if len(x) > 1:
+                nn = numpy.sqrt(d2 + numpy.diag([numpy.inf] * len(x)))
+                self.shape = float(nn.min(1).mean())
+            if not self.shape:
+                self.shape = 1.0
+        n = len(x)
+        m = numpy.zeros((n + 1, n + 1))
+        m[0, 1:] = 1.0
+        m[1:, 0] = 1.0
+        m[1:, 1:] = self._phi(d2) + self.smoothing * numpy.eye(n)
+        try:
+            minv = numpy.linalg.inv(m)
+        except numpy.linalg.LinAlgError:
+            raise SingularFit(str(sys.exc_info()[1]))
+        if not numpy.isfinite(minv).all():
+            raise SingularFit('interpolation matrix is singular')
+        self.minv = minv
+        self.nn2 = (d2 + numpy.diag([numpy.inf] * n)).min(1)
+        self.x = x
+        self.y = y.reshape(n, -1)
+        self._solve()
+
+    def add(self, inputs, outputs):
+        """Add one point without refitting.  Returns False, leaving the fit
+           unchanged, if the point makes the system singular (a repeat)."""
+        if self.x is None:
+            if self.scales is None or self.shape is None:
+                return False #need fit() first to choose them
+            self.fit([inputs], [outputs])
+            return True
+        xn = numpy.asarray(inputs, dtype=float) / self.scales
+        b = numpy.empty(len(self.minv))
+        b[0] = 1.0
+        d2 = ((self.x - xn) ** 2).sum(1)
+        if d2.min() <= 0:
+            return False
+        b[1:] = self._phi(d2)
+        d = self._phi(0.0) + self.smoothing
+        mb = self.minv.dot(b)
+        s = d - b.dot(mb)
+        if abs(s) <= 1e-12 * abs(d):
+            return False
+        n = len(self.minv)
+        minv = numpy.empty((n + 1, n + 1))
+        minv[:n, :n] = self.minv + numpy.outer(mb, mb) / s
+        minv[:n, n] = -mb / s
+        minv[n, :n] = -mb / s
+        minv[n, n] = 1.0 / s
+        self.minv = minv
+        self.nn2 = numpy.append(numpy.minimum(self.nn2, d2), d2.min())
+        self.x = numpy.vstack([self.x, xn])
+        yn = numpy.asarray(outputs, dtype=float).reshape(1, -1)
+        self.y = numpy.vstack([self.y, yn])
+        self._solve()
+        return True
+
+    def _solve(self):
+        rhs = numpy.vstack([numpy.zeros((1, self.y.shape[1])), self.y])
+        self.weights = self.minv.dot(rhs)
+        #Rippa: the error at point k when it is left out of the fit
+        diag = numpy.diag(self.minv)[1:]
+        self.loo = self.weights[1:] / diag[:, numpy.newaxis]
+
+    def predict(self, inputs):
+        """Estimated outputs for one input tuple, or one row per tuple for
+           a sequence of them."""
+        x = numpy.asarray(inputs, dtype=float)
+        single = x.ndim == 1
+        x = numpy.atleast_2d(x) / self.scales
+        phi = self._phi(self._sqdist(x, self.x))
+        y = self.weights[0] + phi.dot(self.weights[1:])
+        if single:
+            return y[0]
+        return y
+
+    def error(self, inputs, neighbours = None):
+        """Estimated error of predict(*inputs*), per output.
+
+           The largest leave-one-out error of the *neighbours* nearest
+           points (by default one more than the number of inputs).  Beyond
+           the reach of the data, further from every point than any point
+           is from its nearest neighbour, the error is infinite."""
+        x = numpy.asarray(inputs, dtype=float) / self.scales
+        d2 = ((self.x - x) ** 2).sum(1)
+        if len(self.x) < 2 or d2.min() > self.nn2.max():
+            return numpy.inf * numpy.ones(self.y.shape[1])
+        if neighbours is None:
+            neighbours = self.x.shape[1] + 1
+        nearest = numpy.argsort(d2)[:neighbours]
+        return abs(self.loo[nearest]).max(0)
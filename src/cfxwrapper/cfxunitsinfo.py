@@ -1,4 +1,6 @@
+import collections
 import os
+import threading
 
 """Translate a units string from CFX to OpenMDAO. Also info about CFX I/0."""
 
@@ -10,6 +12,66 @@ def get_number(s):
     except ValueError:
         return 0, False
 
+def lru_cache(maxsize = 1024):
+    """Decorator remembering the results of a function of hashable
+       arguments for the *maxsize* argument tuples used last.  Exceptions
+       are not remembered; the results should not be changed."""
+    def decorate(function):
+        cache = collections.OrderedDict()
+        lock = threading.Lock()
+        def cached(*args):
+            with lock:
+                if args in cache:
+                    value = cache.pop(args)
+                    cache[args] = value #now the most recent
+                    return value
+            value = function(*args)
+            with lock:
+                cache[args] = value
+                if len(cache) > maxsize:
+                    cache.popitem(last = False)
+            return value
+        cached.__name__ = function.__name__
+        cached.__doc__ = function.__doc__
+        cached.cache = cache
+        return cached
+    return decorate
+
+class SlottedObject(object):
+    """Base for the small model classes that use __slots__ instead of a
+       per-instance dictionary.  Supplies pickling for all protocols."""
+    __slots__ = ()
+    def __getstate__(self):
+        state = {}
+        for cls in type(self).__mro__:
+            for k in getattr(cls, '__slots__', ()):
+                if hasattr(self, k):
+                    state[k] = getattr(self, k)
+        return state
+    def __setstate__(self, state):
+        for k, v in state.iteritems():
+            setattr(self, k, v)
+
+def intern_string(s):
+    """Intern *s* so equal names share one string object."""
+    try:
+        return intern(s)
+    except TypeError: # not a plain str
+        return s
+
+@lru_cache(maxsize = 4096)
+def _interned_path(key):
+    return tuple([intern_string(x) for x in key])
+
+def intern_path(p):
+    """Return *p* as a tuple of interned segments.
+
+       Equal paths used recently share one tuple, so the many inputs below
+       one boundary do not each hold their own copy of its path.  Only the
+       last 4096 paths are remembered, so a long-lived process does not
+       keep every path it has seen."""
+    return _interned_path(tuple(p))
+
 def make_unique_name(currpath, n):
     s = ''
     for p in currpath:
@@ -22,24 +84,21 @@ def make_unique_name(currpath, n):
     s = s.replace(' ', '_')
     return s
 
-class PossibleInput:
-    """Information about a possible input variable in the CFX Flow."""
-    path = [] #empty list - will contain full path to the item
-    name = ''
-    value = 0
-    units = ''
-    varname = ''
+class PossibleInput(SlottedObject):
+    """Information about a possible input variable in the CFX Flow.
+       *path* is kept as a shared tuple of interned segments."""
+    __slots__ = ('path', 'name', 'value', 'units', 'varname')
     def __init__(self, p, n, v, u, varname = ''):
-        self.path = p[0:len(p)]
-        self.name = n
+        self.path = intern_path(p)
+        self.name = intern_string(n)
         self.value = v
-        self.units = u
+        self.units = intern_string(u)
         if varname == '':
             self.varname = make_unique_name(self.path, self.name)
         else:
             self.varname = varname
     def info(self, stripquotes = False):
-        s = str(self.path) + ': ' + self.name + ' = ' + str(self.value) + \
+        s = str(list(self.path)) + ': ' + self.name + ' = ' + str(self.value) + \
                ' [' + self.units + ']'
         if stripquotes:
             return s.replace('\'', '')
@@ -55,14 +114,16 @@ class PossibleInput:
                 self.units + ']\n')
         f.write(ends)
 
-class MonitorPointOutput:
+class MonitorPointOutput(SlottedObject):
     """Information about a monitor point used as an output variable."""
+    __slots__ = ('flowname', 'name', 'expression_value', 'option', 'units',
+                 'varname')
     def __init__(self, flowname, name, expr, option, units, varname = ''):
-        self.flowname = flowname
+        self.flowname = intern_string(flowname)
         self.name = name
         self.expression_value = expr
-        self.option = option
-        self.units = units
+        self.option = intern_string(option)
+        self.units = intern_string(units)
         if varname == '':
             s = flowname + '__' + name
             self.varname =  s.replace(' ', '_')
@@ -79,7 +140,7 @@ class MonitorPointOutput:
 
 #Basic translations - based on list in CFX documentation
 # // CFX-Pre User's Guide // 19. Units and Dimensions // 19.2. Using Units in CFX-Pre // 19.2.1. Units Commonly Used in CFX
-basics = {'mile': 'mi', 'foot': 'ft', #length
+basics = {'mile': 'mi', 'foot': 'ft', 'micron': 'um', #length
     'K': 'degK', 'C': 'degC', 'R': 'degR', 'F': 'degF', #temperature
     'litre': 'l', 'gallon': 'galUK', 'gallonUSliquid': 'galUS', #volume
     'tonne': 'tn', 'lb': 'lbm', #mass
@@ -89,30 +150,80 @@ basics = {'mile': 'mi', 'foot': 'ft', #length
     'BTU': 'Btu', #energy
     'radian': 'rad', 'degree': 'deg' #angle
     }
+#CFX units with the same name in OpenMDAO
+same = set(['m', 'cm', 'mm', 'um', 'in', 'ft', 'yd', 'mi', #length
+    'kg', 'g', 'lbm', 'slug', 'oz', #mass
+    's', 'min', 'h', 'day', 'year', #time
+    'A', 'mol', 'rad', 'deg', 'sr', #current, amount, angle
+    'N', 'lbf', 'dyn', 'Pa', 'bar', 'atm', 'psi', #force, pressure
+    'J', 'cal', 'erg', 'Btu', 'W', 'hp', 'Hz', 'l']) #energy, power, ...
 prefixes = {'nano': 'n', 'micro': 'u', 'centi': 'c', 'kilo': 'k',
     'milli': 'm', 'mega': 'M', 'giga': 'G'}
+#the factors of the prefixes, for a basic translation that is not one unit
+prefix_factors = {'nano': '1e-9', 'micro': '1e-6', 'centi': '0.01',
+    'kilo': '1000.0', 'milli': '0.001', 'mega': '1e6', 'giga': '1e9'}
+
+@lru_cache()
+def unit_tokens(s):
+    """The (unit, exponent) pairs of the CFX units string *s*, such as
+       'kg m^-3', in order.  Raises ValueError for a part that is not a
+       unit with an optional numeric exponent."""
+    tokens = []
+    for p in s.replace('*', ' ').split():
+        unit, caret, exponentstring = p.partition('^')
+        exponent = 1.0
+        if caret:
+            exponent, isnum = get_number(exponentstring)
+            if not isnum:
+                raise ValueError('exponent ' + exponentstring + ' of ' + unit +
+                                 ' is not numeric')
+        if unit == '':
+            raise ValueError('no unit in ' + p)
+        tokens.append((unit, exponent))
+    return tuple(tokens)
+
+@lru_cache()
+def unit_exponents(s):
+    """The canonical exponents of the CFX units string *s*: (unit,
+       exponent) pairs sorted by unit, each unit once, none with exponent
+       0, so that equal units give equal tuples."""
+    exponents = {}
+    for unit, exponent in unit_tokens(s):
+        exponents[unit] = exponents.get(unit, 0.0) + exponent
+    return tuple(sorted([(u, e) for u, e in exponents.iteritems() if e != 0]))
 
+def _exponent_string(exponent):
+    if exponent == int(exponent):
+        return str(int(exponent))
+    return repr(exponent)
+
+def _translate_unit(unit):
+    """The OpenMDAO units for one CFX unit, matched whole.  A prefix is
+       only split off when the rest is a unit in basics or same; anything
+       else is returned unchanged."""
+    if unit in basics:
+        return basics[unit]
+    for prefix, val in prefixes.iteritems():
+        rest = unit[len(prefix):]
+        if unit.startswith(prefix) and (rest in basics or rest in same):
+            rest = basics.get(rest, rest)
+            if ' ' in rest:
+                return '(' + prefix_factors[prefix] + ' * ' + rest + ')'
+            return val + rest
+    return unit
+
+@lru_cache()
 def translate(s):
-    answer = ''
-    parts = s.split()
-    lastindex = len(parts) - 1
-    #import pdb; pdb.set_trace()
-    for i, p in enumerate(parts):
-        newp = p
-        #look for long-form prefix
-        for prefix, val in prefixes.iteritems():
-            if newp.startswith(prefix):
-                newp = newp.replace(prefix, val, 1)
-                break
-        #look for basic translation:
-        for k, v in basics.iteritems():
-            newp = newp.replace(k, v)
-        #replace ^ with **
-        newp = newp.replace('^', '**')
-        answer = answer +  newp
-        if (i != lastindex):
-            answer = answer + ' * '
-    return answer
+    """The OpenMDAO units string for the CFX units string *s*."""
+    parts = []
+    for unit, exponent in unit_tokens(s):
+        newp = _translate_unit(unit)
+        if exponent != 1:
+            if ' ' in newp and not newp.startswith('('):
+                newp = '(' + newp + ')'
+            newp = newp + '**' + _exponent_string(exponent)
+        parts.append(newp)
+    return ' * '.join(parts)
 
 
         
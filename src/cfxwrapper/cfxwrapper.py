@@ -4,57 +4,103 @@ from openmdao.main.api import Component
 from openmdao.lib.datatypes.api import Float, Str
 from openmdao.lib.components.api import ExternalCode
 
+from itertools import imap, izip
+from cStringIO import StringIO
 from os import environ
+from multiprocessing.pool import ThreadPool
 import os.path
 import sys
+import threading
 
-import pickle
 import cclparser
 import cfxunitsinfo
+from cfxcache import ResFileCache, ResultStore, key_text
+from cfxexecutor import SolveTask
+from cfxmonitor import ConvergenceMonitor, Window
+from cfxprocess import SolveError, SolveJob
+import cfxscratch
+from cfxsession import LaunchSession, SessionPool
+from cfxsurrogate import RBFSurrogate, SingularFit
 
 class CFXWrapper(ExternalCode):
     """Base class for wrappers for ANSYS CFX.  Is only used by a generated CFX Wrapper.  See cfxwrappergenerator.GenerateCFXWrapper."""
     newdeffile = Str('', desc='a new CFX .def file to use instead of the original, can be used to apply deflections to all nodes', 
                      iotype='in')
+    #default tolerances for serving an input from the cache; the relative
+    #one absorbs float round-off, see set_cache_tolerance
+    cache_atol = 0.0
+    cache_rtol = 1e-12
+    #answer execute from a response surface over the cached results when
+    #its estimated error, as a fraction of the spread of each output, is
+    #below surrogate_tol; 0 never uses it.  see surrogate_estimate
+    surrogate_tol = 0.0
+    surrogate_min_points = 0 #0 for twice the number of inputs plus one
+    #start each solve from the kept result file of the nearest point
+    #solved before; the kept files are trimmed to resfile_budget bytes
+    warmstart = True
+    resfile_budget = 10 * 1024 ** 3
+    #cfxmonitor.Window criteria on monitor points (by name or output
+    #varname); when all hold, a running solve is stopped early.  the
+    #histories are sampled every monitor_interval seconds
+    convergence = []
+    monitor_interval = 60.0
+    #every solve runs in its own directory under <workdir>/<base>Runs;
+    #finished ones are compressed, then deleted, to stay within this
+    scratch_budget = 20 * 1024 ** 3
+    #True to bring the run directories and kept result files within their
+    #budgets when the wrapper is made, as well as after every run
+    collect_on_start = False
+    #solver slots kept by session_pool() for execute_batch; 0 for none.
+    #each point is still a new cfx5solve, so for CFX the slots only bound
+    #how many solve at once and give nearby points to the same slot
+    session_slots = 0
+    #a cfxexecutor.Executor to run the solves on, such as a QueueExecutor
+    #feeding other hosts; None runs them here, monitored as above
+    executor = None
 
     def __init__(self):
         super(CFXWrapper, self).__init__()
         self.inputvals = [] #empty list of floats, set in subclass execute
         self.outputvals = [] #empty list - set in execute, used in subclass execute
-        self.cache = {} #empty dictionary to cache calculations        
         self.cfxpath = os.path.join(self.ansyspath, 'CFX', 'bin')
         self.cclfile = os.path.join(self.workdir, self.base + '.ccl')
         self.fullname = os.path.join(self.workdir, self.base)
         self.monfile = os.path.join(self.workdir, self.base + 'mon.txt')
-        self.solvecmd = [os.path.join(self.cfxpath, 'cfx5solve.exe'),
-                       '-def', self.deffile,
-                       '-ccl', self.cclfile,
-                       '-fullname', self.fullname]
-        self.readmoncmd = [os.path.join(self.cfxpath, 'cfx5mondata.exe'),
-                  '-res', self.fullname + '.res',
-                  '-lastvaluesonly',
-                  '-varrule', 'CATEGORY = USER POINT',
-                  '-out', self.monfile]
-        if self.cachefile != '':
-            #import pdb; pdb.set_trace()
-            if os.path.exists(self.cachefile):
-                cachepickle = open(self.cachefile, 'r')
-                self.cache = pickle.load(cachepickle)
-                cachepickle.close()
-                print 'Loaded cache ' + self.cachefile + '\n' + str(self.cache)
-        else:
+        self.solvecmd = self._make_solvecmd(self.cclfile, self.fullname)
+        self.readmoncmd = self._make_readmoncmd(self.fullname + '.res',
+                                                self.monfile)
+        if self.cachefile == '':
             self.cachefile = os.path.join(self.workdir, self.base + 'Cache.txt')
+        #results are kept in a store next to the cache file; a pickled
+        #cache written by earlier versions is imported into it once
+        self.cache = ResultStore(self.storefile(self.cachefile))
+        n = self.cache.import_pickle(self.cachefile)
+        if n:
+            print 'Imported ' + str(n) + ' results from ' + self.cachefile
+        print 'Loaded cache ' + str(self.cache)
+        n = len(self.possibleins)
+        self.cache.set_tolerances([self.cache_atol] * n,
+                                  [self.cache_rtol] * n)
+        self.surrogate = None
+        self._surrogate_id = 0 #last cache row added to self.surrogate
+        self._surrogate_keys = set() #key_text of the points in it
+        self.resfiles = ResFileCache(os.path.join(self.workdir,
+                                                  self.base + 'Results'),
+                                     self.resfile_budget)
+        self.sessions = None #made by session_pool()
+        self.scratch = cfxscratch.ScratchSpace(os.path.join(self.workdir,
+                                                            self.base + 'Runs'),
+                                               self.scratch_budget)
         if self.origresfile != '':
             #get the original values
-            cmd = [os.path.join(self.cfxpath, 'cfx5mondata.exe'),
-                  '-res', self.origresfile,
-                  '-lastvaluesonly',
-                   '-varrule', 'CATEGORY = USER POINT',
-                  '-out', self.monfile]
+            cmd = self._make_readmoncmd(self.origresfile, self.monfile)
             self.readmon(cmd)
             #import pdb; pdb.set_trace()
-            self.cache[tuple(self.inputvals)] = tuple(self.outputvals)
-            print 'Updated cache from origresfile' + self.origresfile + '\n' + str(self.cache)
+            intuple = tuple(self.inputvals)
+            if self.cache.get(intuple) != tuple(self.outputvals):
+                self.cache[intuple] = tuple(self.outputvals)
+            print 'Updated cache from origresfile' + self.origresfile + '\n' + \
+                  str(tuple(self.inputvals)) + ': ' + str(tuple(self.outputvals))
 
             
         #Info output
@@ -64,6 +110,7 @@ class CFXWrapper(ExternalCode):
         print 'CFX Input File ' + self.deffile
         print 'Generated CCL File ' + self.cclfile
         print 'Base for CFX Output ' + self.fullname
+        print 'Run Directories ' + self.scratch.root
         print 'Solve Command ' + str(self.solvecmd)
         print 'Read Monitor Command ' + str(self.readmoncmd)
         print 'Possible Variables:'
@@ -71,112 +118,564 @@ class CFXWrapper(ExternalCode):
             i.output()
         for i in self.possibleouts:
             i.output()
-        print 'Cache file ' + self.cachefile
+        print 'Cache file ' + self.cache.filename
+        if self.collect_on_start:
+            self.collect_garbage()
+
+    @staticmethod
+    def storefile(cachefile):
+        """The result store used for *cachefile*."""
+        if cachefile.endswith('.db'):
+            return cachefile
+        return os.path.splitext(cachefile)[0] + '.db'
+
+    def set_cache_tolerance(self, varname, atol = 0.0, rtol = 0.0):
+        """Serve input *varname* from the cache when it is within
+           max(atol, rtol*|value|) of a cached value."""
+        for counter, i in enumerate(self.possibleins):
+            if i.varname == varname:
+                atols = list(self.cache.atol)
+                rtols = list(self.cache.rtol)
+                atols[counter] = atol
+                rtols[counter] = rtol
+                self.cache.set_tolerances(atols, rtols)
+                return
+        raise KeyError(varname)
+
+    def _update_surrogate(self):
+        """Fit the surrogate once there are enough cached results and add
+           the results cached since, one at a time.  Only the latest result
+           for each input tuple is used; a point solved again refits the
+           surrogate to the latest results."""
+        n = len(self.possibleins)
+        rows = self.cache.rows_since(self._surrogate_id)
+        if len(rows) == 0:
+            return
+        latest = {}
+        for id, inputs, outputs in rows:
+            if len(inputs) == n and len(outputs) == len(self.possibleouts) \
+               and not [v for v in outputs if v != v or abs(v) == float('inf')]:
+                latest[key_text(inputs)] = (id, inputs, outputs)
+        points = [(i, o) for id, i, o in sorted(latest.values())]
+        if self.surrogate is not None and \
+           [k for k in latest if k in self._surrogate_keys]:
+            #solved again: refit to the latest result of every point
+            self.surrogate = None
+            self._surrogate_keys = set()
+            self._surrogate_id = 0
+            self._update_surrogate()
+            return
+        if self.surrogate is None:
+            minpoints = self.surrogate_min_points or 2 * n + 1
+            if len(points) < minpoints:
+                return #wait for more, fit them all at once
+            surrogate = RBFSurrogate()
+            surrogate.fit([i for i, o in points], [o for i, o in points])
+            self.surrogate = surrogate
+        else:
+            for inputs, outputs in points:
+                self.surrogate.add(inputs, outputs)
+        self._surrogate_keys.update(latest)
+        self._surrogate_id = rows[-1][0]
+
+    def surrogate_estimate(self, inputvals):
+        """Return estimated output values for *inputvals* from a surrogate
+           fitted to the cached results, or None when there are too few of
+           them or the estimated error of any output is more than
+           self.surrogate_tol times its spread."""
+        try:
+            self._update_surrogate()
+        except ImportError:
+            print 'Surrogate needs numpy: ' + str(sys.exc_info()[1])
+            self.surrogate_tol = 0.0
+            return None
+        except SingularFit:
+            #run the solver; refit when there are more results
+            print 'Cannot fit surrogate: ' + str(sys.exc_info()[1])
+            self.surrogate = None
+            self._surrogate_keys = set()
+            self._surrogate_id = 0
+            return None
+        if self.surrogate is None:
+            return None
+        err = self.surrogate.error(inputvals)
+        y = self.surrogate.y
+        spread = y.max(0) - y.min(0)
+        spread[spread <= 0] = 1.0
+        if (err > self.surrogate_tol * spread).any():
+            return None
+        return [float(v) for v in self.surrogate.predict(inputvals)]
+
+    def collect_garbage(self):
+        """Keep the disk space used by runs within the budgets: compress
+           or delete the finished run directories self.scratch made and
+           trim the kept result files.  Nothing else in self.workdir is
+           touched."""
+        compressed, deleted = self.scratch.collect()
+        if compressed or deleted:
+            print 'Compressed ' + str(compressed) + ' files, deleted ' + \
+                  str(deleted) + ' runs in ' + self.scratch.root
+        self.resfiles.trim()
+
+    def _finish_run(self, rundir):
+        self.scratch.finish(rundir)
+        self.collect_garbage()
 
     def picklecache(self):
-        picklefile = open(self.cachefile, 'w')
-        pickle.dump(self.cache, picklefile)
-        picklefile.close()
+        """Results are written to the store as they are added, so there is
+           nothing left to save; kept for existing callers."""
+        pass
 
-    def readmon(self, cmd):
+    def readmon(self, cmd, monfile = None):
+        """Run the cfx5mondata command *cmd* and set self.outputvals from
+           the file it writes, *monfile* (by default self.monfile)."""
+        if monfile is None:
+            monfile = self.monfile
         self.command = cmd
         try:
             #import pdb; pdb.set_trace()
             super(CFXWrapper, self).execute()
         except:
-            print "Error in " + str(self.readmoncmd)
+            print "Error in " + str(cmd)
             print sys.exc_info()[0]
         else:
             if self.return_code == 0:
-                # parse the self.monfile
-                try:
-                    f = open(self.monfile, 'r')
-                except IOError:
-                    print 'Problem opening monitor file ' + self.monfile
-                    print sys.exc_info()[0]
+                outputvals = self._parse_monfile(monfile)
+                if outputvals is None:
                     self.return_code = -1
                 else:
-                    lines = f.readlines()
-                    n = len(lines)
-                    #import pdb; pdb.set_trace()
-                    nameline = lines[0].replace('USER POINT,', '')
-                    nameline = nameline.replace('"', '')
-                    nameline = nameline.strip()
-                    names = nameline.split(',')
-                    valline = lines[n-1].strip()
-                    vals = valline.split(',')
-                    numvals = len(vals)
-                    numnames = len(names)
-                    print str(numnames) + ' names; ' + str(numvals) + ' vals'
-                    dict = {} #empty dictionary
-                    for i, l in enumerate(names):
-                        if i < numvals:
-                            dict[l] = vals[i]
-        
-                    f.close()
-
-                    # set outputvals
-                    self.outputvals = []
-                    for o in self.possibleouts:
-                        key = o.name
-                        try:
-                            valstr = dict[key]
-                        except KeyError:
-                            #import pdb; pdb.set_trace()
-                            print 'Could not find monitor point ' + o.name + \
-                                  ' in ' + self.monfile
-                            print sys.exc_info()[0]
-                            val = Float('nan')
-                        else:
-                            val, isnum = cfxunitsinfo.get_number(valstr)
-                            if not isnum:
-                                #import pdb; pdb.set_trace()
-                                print 'Value for monitor point ' + o.name + \
-                                  ' in ' + self.monfile + ' is not a number'
-                                val = Float('nan')
-                        self.outputvals.append(val)
-                        print o.name + ' = ' + str(val)
+                    self.outputvals = outputvals
+
+    def _make_solvecmd(self, cclfile, fullname, initial = ''):
+        """The cfx5solve command line for a CCL file and an output base name,
+           starting from the result file *initial* if one is given."""
+        if len(self.newdeffile) == 0 or self.deffile == self.newdeffile:
+            cmd = [os.path.join(self.cfxpath, 'cfx5solve.exe'),
+                   '-def', self.deffile,
+                   '-ccl', cclfile]
+            if initial != '':
+                cmd += ['-initial-file', initial]
+            return cmd + ['-fullname', fullname]
+        #MDPL - NOT WORKING
+        return [os.path.join(self.cfxpath, 'cfx5solve.exe'),
+                '-def', self.newdeffile,
+                '-ccl', cclfile,
+                '-initial-file', self.origresfile,
+                '-fullname', fullname]
+
+    def _make_readmoncmd(self, resfile, monfile):
+        """The cfx5mondata command line that writes the last monitor point
+           values in *resfile* to *monfile*."""
+        return [os.path.join(self.cfxpath, 'cfx5mondata.exe'),
+                '-res', resfile,
+                '-lastvaluesonly',
+                '-varrule', 'CATEGORY = USER POINT',
+                '-out', monfile]
+
+    def _initial_file(self, inputvals):
+        """The result file to warm start a solve of *inputvals* from: the
+           kept file of the nearest point solved, else origresfile."""
+        if not self.warmstart:
+            return ''
+        initial = self.resfiles.nearest(inputvals)
+        if initial is None:
+            if self.origresfile != '' and os.path.exists(self.origresfile):
+                return self.origresfile
+            return ''
+        return initial
+
+    def _keep_resfile(self, inputvals, resfile, move = False):
+        """Keep the result file of a solved point to warm start others."""
+        if not self.warmstart:
+            return
+        try:
+            print 'Kept ' + self.resfiles.add(inputvals, resfile, move)
+        except (IOError, OSError):
+            print 'Could not keep result file ' + resfile
+            print sys.exc_info()[1]
+
+    def _make_mondatacmd(self, rundir, outfile):
+        """The cfx5mondata command line that writes the monitor point
+           histories of the running solve in *rundir* to *outfile*."""
+        return [os.path.join(self.cfxpath, 'cfx5mondata.exe'),
+                '-dir', rundir,
+                '-varrule', 'CATEGORY = USER POINT',
+                '-out', outfile]
+
+    def _make_stopcmd(self, rundir):
+        """The cfx5stop command line for the running solve in *rundir*."""
+        return [os.path.join(self.cfxpath, 'cfx5stop.exe'),
+                '-directory', rundir]
+
+    def _monitor(self, fullname, criteria = None, sampled = None):
+        """A ConvergenceMonitor, not started, for the solve writing to
+           *fullname*, or None if there are no criteria (by default
+           self.convergence).  Criteria may name outputs by varname."""
+        if criteria is None:
+            criteria = self.convergence
+        if not criteria:
+            return None
+        names = dict([(o.varname, o.name) for o in self.possibleouts])
+        criteria = [Window(names.get(c.name, c.name), c.iterations,
+                           c.atol, c.rtol) for c in criteria]
+        rundir = fullname + '.dir' #where cfx5solve runs for -fullname
+        return ConvergenceMonitor(rundir,
+            lambda outfile: self._make_mondatacmd(rundir, outfile),
+            self._make_stopcmd(rundir), criteria, self.monitor_interval,
+            sampled)
+
+    def _ccl_text(self, inputvals):
+        """The CCL that changes the inputs that differ from the values in
+           the original definition file."""
+        cf = StringIO()
+        for counter, i in enumerate(self.possibleins):
+            if inputvals[counter] != i.value:
+                i.cclout(cf, inputvals[counter])
+            print i.varname + ' = ' + str(inputvals[counter])
+        return cf.getvalue()
+
+    def _write_ccl(self, cclfile, inputvals):
+        cf = open(cclfile, 'w')
+        cf.write(self._ccl_text(inputvals))
+        cf.close()
+
+    def make_task(self, inputvals):
+        """A cfxexecutor.SolveTask for solving *inputvals* on any host,
+           warm started from the nearest kept result file."""
+        cmds = [self._make_solvecmd(self.base + '.ccl', self.base,
+                                    self._initial_file(inputvals)),
+                self._make_readmoncmd(self.base + '.res',
+                                      self.base + 'mon.txt')]
+        return SolveTask(inputvals, self._ccl_text(inputvals), cmds,
+                         self.base)
+
+    def _outputs_from(self, values, source):
+        """The values of self.possibleouts from a dictionary of monitor
+           point name -> value read from *source*."""
+        outputvals = []
+        for o in self.possibleouts:
+            try:
+                val = values[o.name]
+            except KeyError:
+                print 'Could not find monitor point ' + o.name + \
+                      ' in ' + source
+                val = float('nan')
+            outputvals.append(val)
+            print o.name + ' = ' + str(val)
+        return outputvals
+
+    def _parse_monfile(self, monfile):
+        """Return the values of self.possibleouts read from a cfx5mondata
+           output file, or None if the file could not be read."""
+        try:
+            f = open(monfile, 'r')
+        except IOError:
+            print 'Problem opening monitor file ' + monfile
+            print sys.exc_info()[0]
+            return None
+        lines = f.readlines()
+        n = len(lines)
+        nameline = lines[0].replace('USER POINT,', '')
+        nameline = nameline.replace('"', '')
+        nameline = nameline.strip()
+        names = nameline.split(',')
+        valline = lines[n-1].strip()
+        vals = valline.split(',')
+        numvals = len(vals)
+        numnames = len(names)
+        print str(numnames) + ' names; ' + str(numvals) + ' vals'
+        dict = {} #empty dictionary
+        for i, l in enumerate(names):
+            if i < numvals:
+                dict[l] = vals[i]
+
+        f.close()
+
+        outputvals = []
+        for o in self.possibleouts:
+            key = o.name
+            try:
+                valstr = dict[key]
+            except KeyError:
+                print 'Could not find monitor point ' + o.name + \
+                      ' in ' + monfile
+                print sys.exc_info()[0]
+                val = Float('nan')
+            else:
+                val, isnum = cfxunitsinfo.get_number(valstr)
+                if not isnum:
+                    print 'Value for monitor point ' + o.name + \
+                      ' in ' + monfile + ' is not a number'
+                    val = Float('nan')
+            outputvals.append(val)
+            print o.name + ' = ' + str(val)
+        return outputvals
 
     def execute(self):
-        use_old_df = False
         if len(self.newdeffile) == 0 or self.deffile == self.newdeffile:
-            use_old_df = True
             intuple = tuple(self.inputvals)
-            #see if in cache
-            if intuple in self.cache:
-                outtuple = self.cache[intuple]
+            #see if in cache, within the tolerances
+            try:
+                cached, outtuple = self.cache.lookup(intuple)
+            except KeyError:
+                pass
+            else:
                 self.outputvals = list(outtuple)
-                print 'Found in cache: ' + str(intuple) + ': ' + str(outtuple)
+                print 'Found in cache: ' + str(cached) + ': ' + str(outtuple)
                 return
-    
+            if self.surrogate_tol > 0:
+                estimate = self.surrogate_estimate(self.inputvals)
+                if estimate is not None:
+                    self.outputvals = estimate
+                    self.return_code = 0
+                    print 'Estimated by surrogate: ' + str(intuple) + ': ' + \
+                          str(tuple(estimate))
+                    return
+
+        if self.executor is not None:
+            outputvals = self._run_point(self.inputvals)
+            if outputvals is None:
+                self.return_code = -1
+            else:
+                self.return_code = 0
+                self.outputvals = outputvals
+                self.cache[tuple(self.inputvals)] = tuple(outputvals)
+            return
+        rundir = self._scratch_dir()
+        try:
+            self._execute_in(rundir)
+        finally:
+            self._finish_run(rundir)
+
+    def _execute_in(self, rundir):
+        """Solve self.inputvals in the run directory *rundir*."""
+        cclfile = os.path.join(rundir, self.base + '.ccl')
+        fullname = os.path.join(rundir, self.base)
+        monfile = os.path.join(rundir, self.base + 'mon.txt')
         #Write the ccl file
-        cf = open(self.cclfile, 'w')
-        for counter, i in enumerate(self.possibleins):
-            if self.inputvals[counter] != i.value:
-                i.cclout(cf, self.inputvals[counter])
-            print i.varname + ' = ' + str(self.inputvals[counter])
-        cf.close()
-    
+        self._write_ccl(cclfile, self.inputvals)
+
             #Execute
-        if use_old_df:
-            self.command = self.solvecmd
-        else: #MDPL - NOT WORKING
-            self.command = [os.path.join(self.cfxpath, 'cfx5solve.exe'),
-                '-def', self.newdeffile,
-                '-ccl', self.cclfile,
-                '-initial-file', self.origresfile,
-                '-fullname', self.fullname]
+        self.command = self._make_solvecmd(cclfile, fullname,
+                                           self._initial_file(self.inputvals))
         
+        monitor = self._monitor(fullname)
+        if monitor is not None:
+            monitor.start()
         try:
-            super(CFXWrapper, self).execute()
+            try:
+                super(CFXWrapper, self).execute()
+            finally:
+                if monitor is not None:
+                    monitor.stop()
         except:
-            print "Error in " + str(self.solvecmd)
+            print "Error in " + str(self.command)
             print sys.exc_info()[0]
             self.return_code = -1
         else:
             #Get the results
             if self.return_code == 0:
                 #import pdb; pdb.set_trace()
-                self.readmon(self.readmoncmd)
-                self.cache[tuple(self.inputvals)] = tuple(self.outputvals)
-                self.picklecache()
+                self.readmon(self._make_readmoncmd(fullname + '.res', monfile),
+                             monfile)
+                if self.return_code == 0:
+                    self.cache[tuple(self.inputvals)] = tuple(self.outputvals)
+                    self._keep_resfile(self.inputvals, fullname + '.res',
+                                       move=True)
+
+    def _scratch_dir(self):
+        """Make a new run directory for one solve."""
+        return self.scratch.new_run(self.base)
+
+    def _start_point(self, inputvals, timeout = None, output = None,
+                     solved = None, criteria = None, sampled = None):
+        """Start solving one design point in its own scratch directory and
+           return the SolveJob; its result is the list of output values,
+           or what *solved*(output values) returns.  Only touches files in
+           the scratch directory, so several points can run at once.  Lines
+           the CFX commands write go to the log file in the scratch
+           directory and to *output*(stream, line).  job.monitor is the
+           ConvergenceMonitor for *criteria*, or None.
+
+           With self.executor the point is solved there instead, without
+           the log, *output* or monitor."""
+        if self.executor is not None:
+            return self._submit(inputvals, timeout, solved)
+        scratch = self._scratch_dir()
+        cclfile = os.path.join(scratch, self.base + '.ccl')
+        fullname = os.path.join(scratch, self.base)
+        monfile = os.path.join(scratch, self.base + 'mon.txt')
+        self._write_ccl(cclfile, inputvals)
+        solvecmd = self._make_solvecmd(cclfile, fullname,
+                                       self._initial_file(inputvals))
+        readmoncmd = self._make_readmoncmd(fullname + '.res', monfile)
+        log = open(os.path.join(scratch, self.base + '.log'), 'w')
+        loglock = threading.Lock()
+
+        def write(stream, line):
+            with loglock:
+                log.write(line)
+            if output is not None:
+                output(stream, line)
+
+        def finish():
+            log.close()
+            outputvals = self._parse_monfile(monfile)
+            if outputvals is None:
+                raise SolveError('no monitor point values in ' + monfile)
+            self._keep_resfile(inputvals, fullname + '.res', move=True)
+            if solved is not None:
+                return solved(outputvals)
+            return outputvals
+
+        job = SolveJob([solvecmd, readmoncmd], scratch, write, finish, timeout)
+        job.monitor = self._monitor(fullname, criteria, sampled)
+        job.add_done_callback(lambda job: log.close())
+        job.add_done_callback(lambda job: self._finish_run(scratch))
+        if job.monitor is not None:
+            job.monitor.start()
+            job.add_done_callback(lambda job: job.monitor.stop())
+        return job.start()
+
+    def _submit(self, inputvals, timeout = None, solved = None):
+        """Solve one design point with self.executor; see _start_point."""
+        def finish(result):
+            values, resfile = result
+            outputvals = self._outputs_from(values, resfile)
+            if os.path.exists(resfile): #not if the host has its own disk
+                self._keep_resfile(inputvals, resfile)
+            if solved is not None:
+                return solved(outputvals)
+            return outputvals
+        return self.executor.submit(self.make_task(inputvals), finish,
+                                    timeout)
+
+    def _run_point(self, inputvals):
+        """Solve one design point in its own scratch directory.
+
+           Returns the list of output values, or None if the solve or the
+           monitor point extraction failed."""
+        try:
+            return self._start_point(inputvals).result()
+        except SolveError:
+            print "Error solving " + str(tuple(inputvals))
+            print sys.exc_info()[1]
+            return None
+
+    def execute_async(self, inputvals = None, timeout = None, output = None,
+                      criteria = None, sampled = None):
+        """Start solving *inputvals* (by default self.inputvals) and return
+           at once with a cfxprocess.SolveJob.
+
+           job.result() waits and gives the output tuple, or raises a
+           cfxprocess.SolveError; job.cancel() kills the running command;
+           *timeout* limits the whole solve, in seconds.  Lines the CFX
+           commands write are passed to *output*(stream, line) as they
+           arrive.  A point found in the cache gives a job that is already
+           done; a solved point is added to the cache.  Many jobs can be in
+           flight at once, see cfxprocess.wait_any.
+
+           job.monitor follows the monitor point histories and stops the
+           solve once the cfxmonitor.Window *criteria* (by default
+           self.convergence) hold; *sampled*(monitor) is called after each
+           sample."""
+        if inputvals is None:
+            inputvals = self.inputvals
+        intuple = tuple(inputvals)
+        use_cache = len(self.newdeffile) == 0 or \
+                    self.deffile == self.newdeffile
+        if use_cache:
+            try:
+                cached, outtuple = self.cache.lookup(intuple)
+            except KeyError:
+                pass
+            else:
+                print 'Found in cache: ' + str(cached) + ': ' + str(outtuple)
+                return SolveJob.finished(outtuple)
+
+        def solved(outputvals):
+            outtuple = tuple(outputvals)
+            if use_cache:
+                self.cache[intuple] = outtuple
+            return outtuple
+
+        return self._start_point(intuple, timeout, output, solved, criteria,
+                                 sampled)
+
+    def session_pool(self, factory = None):
+        """The cfxsession.SessionPool of self.session_slots slots that
+           execute_batch routes points to, made on first use by *factory*(
+           slot number), by default a cfxsession.LaunchSession."""
+        if self.sessions is None:
+            if factory is None:
+                factory = lambda n: LaunchSession(self, self.base + str(n))
+            self.sessions = SessionPool(factory, self.session_slots)
+        return self.sessions
+
+    def close_sessions(self):
+        if self.sessions is not None:
+            self.sessions.close()
+            self.sessions = None
+
+    def _pooled_result(self, job):
+        """The output values of a point solved in a session slot, or None
+           if it failed."""
+        try:
+            return job.result()
+        except SolveError:
+            print "Error solving " + str(job.inputvals)
+            print sys.exc_info()[1]
+            return None
+
+    def execute_batch(self, list_of_inputvals, max_parallel = 1):
+        """Solve several independent design points.
+
+           Each entry of *list_of_inputvals* is a sequence of input values in
+           the order of self.possibleins.  Points found in the cache are
+           served from it and never submitted; the others run in their own
+           scratch directories, at most *max_parallel* at a time, or in
+           the slots of session_pool() if self.session_slots is set.
+           Returns a list of output tuples in the order of
+           *list_of_inputvals*, with None for a point that failed."""
+        use_cache = len(self.newdeffile) == 0 or \
+                    self.deffile == self.newdeffile
+        results = [None] * len(list_of_inputvals)
+        pending = {} #input tuple -> indices into results
+        for n, inputvals in enumerate(list_of_inputvals):
+            intuple = tuple(inputvals)
+            if use_cache:
+                try:
+                    cached, results[n] = self.cache.lookup(intuple)
+                except KeyError:
+                    pass
+                else:
+                    print 'Found in cache: ' + str(cached) + ': ' + \
+                          str(results[n])
+                    continue
+            pending.setdefault(intuple, []).append(n)
+        if len(pending) == 0:
+            return results
+
+        points = sorted(pending, key=lambda t: pending[t][0])
+        pool = None
+        if self.session_slots > 0:
+            jobs = [self.session_pool().submit(p) for p in points]
+            solved = izip(points, imap(self._pooled_result, jobs))
+        else:
+            pool = ThreadPool(max(1, min(max_parallel, len(pending))))
+            solved = izip(points, pool.imap(self._run_point, points))
+        try:
+            #cache each result as soon as it and those before it are in
+            for intuple, outputvals in solved:
+                if outputvals is None:
+                    continue
+                outtuple = tuple(outputvals)
+                for n in pending[intuple]:
+                    results[n] = outtuple
+                if use_cache:
+                    self.cache[intuple] = outtuple
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return results
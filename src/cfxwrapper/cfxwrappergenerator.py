@@ -1,37 +1,42 @@
 
+import hashlib
 import logging
+from multiprocessing.pool import ThreadPool
 from os import environ
 import os.path
+import shutil
+import subprocess
 import sys
+import tempfile
 #import pickle
 
 import cclparser
+import celunits
+import cfxcache
 import cfxunitsinfo
 
 from openmdao.lib.components.api import ExternalCode
-from openmdao.util.filewrap import FileParser
 
 indent1 = '    '
 indent2 = indent1 + indent1
 indent3 = indent2 + indent1
 
 class TestRunner:
-    """Internal class to run CFX only to get error messages telling us the units of Monitor Points."""
-    def __init__(self, deffile, workdir, base, ansyspath, logger = None):
+    """Internal class to run CFX only to get error messages telling us the units of Monitor Points.
+       Up to *parallel* runs go at a time, each in a directory of its own."""
+    def __init__(self, deffile, workdir, base, ansyspath, logger = None,
+                 parallel = 1):
         #import pdb; pdb.set_trace()
         self.deffile = deffile
         self.workdir = workdir
         self.base = base
         self.logger = logger
-        cfxpath = os.path.join(ansyspath, 'CFX', 'bin')
-        test_name = 'TEST_' + self.base
-        self.cclfile = os.path.join(self.workdir, test_name + '.ccl')
-        fullname = os.path.join(self.workdir, test_name)
-        self.solvecmd = [os.path.join(cfxpath, 'cfx5solve.exe'),
-           '-def', self.deffile,
-           '-ccl', self.cclfile,
-           '-fullname', fullname]
-        self.outfile = os.path.join(self.workdir, test_name + '.out')
+        self.parallel = parallel
+        self.cfxpath = os.path.join(ansyspath, 'CFX', 'bin')
+        self.test_name = 'TEST_' + self.base
+        self._def_digest = None
+        self.flow_dict = {} #base unit -> solution unit, see set_flow_dict
+        self._translations = {} #(dimensions, flow_dict items) -> units
         self.units_translations = {
             #length
             'm' : 'm', 'cm': 'cm', 'mm': 'mm', 'in': 'inch', 'ft': 'ft',
@@ -66,6 +71,50 @@ class TestRunner:
             print msg
         if self.logger <> None:
             self.logger.debug(msg)
+
+    def def_digest(self):
+        """SHA-1 hex digest of the contents of the .def file, or None if it
+           cannot be read."""
+        if self._def_digest is None:
+            h = hashlib.sha1()
+            try:
+                f = open(self.deffile, 'rb')
+                try:
+                    while True:
+                        block = f.read(1 << 20)
+                        if not block:
+                            break
+                        h.update(block)
+                finally:
+                    f.close()
+            except IOError:
+                return None
+            self._def_digest = h.hexdigest()
+        return self._def_digest
+
+    def new_run(self):
+        """Make a directory for one run of CFX.  Returns the directory, the
+           CCL file and output file in it, and the solve command."""
+        rundir = tempfile.mkdtemp(prefix=self.test_name + '_',
+                                  dir=self.workdir)
+        fullname = os.path.join(rundir, self.test_name)
+        cclfile = fullname + '.ccl'
+        solvecmd = [os.path.join(self.cfxpath, 'cfx5solve.exe'),
+           '-def', self.deffile,
+           '-ccl', cclfile,
+           '-fullname', fullname]
+        return rundir, cclfile, fullname + '.out', solvecmd
+
+    def map(self, function, items):
+        """[function(i) for i in items], up to self.parallel at a time."""
+        if self.parallel <= 1 or len(items) <= 1:
+            return map(function, items)
+        pool = ThreadPool(min(self.parallel, len(items)))
+        try:
+            return pool.map(function, items)
+        finally:
+            pool.close()
+            pool.join()
             
     def set_flow_dict(self, fl):
         #import pdb; pdb.set_trace()
@@ -127,51 +176,41 @@ class TestRunner:
             s = s + ')'
         return s
             
+    def units_of(self, dimensions):
+        """The units for *dimensions* as CFX reports them."""
+        if dimensions == '<dimensionless>':
+            return ''
+        return self.translate(dimensions)
+
     def translate(self, u):
+        """The OpenMDAO units for the dimensions *u* reported by CFX, in the
+           solution units of the flow; remembered for each flow."""
+        key = (u, tuple(sorted(self.flow_dict.items())))
+        if key not in self._translations:
+            self._translations[key] = self._translate(u)
+        return self._translations[key]
+
+    def _translate(self, u):
         numerator = {}
         denominator = {}
         for b in self.base_units:
             numerator[b] = 0
             denominator[b] = 0
-        #import pdb; pdb.set_trace()
-        us = u.split()
-        for s in us:
-            if '^' in s:
-                ss = s.split('^')
-                unitstring = ss[0]
-                exponentstring = ss[1]
-                is_neg = False
-                if exponentstring.startswith('-'):
-                    is_neg = True
-                    exponentstring = exponentstring[1:]
-                exponent, isnum = cfxunitsinfo.get_number(exponentstring)
-                if not isnum:
-                    self.do_logging('ERROR: for unit expression ' + u +\
-                          ' exponent ' + exponentstring + ' is not numeric.', both = True)
-                    return ''
-                if is_neg:
-                    if unitstring in denominator:
-                        denominator[unitstring] = \
-                            denominator[unitstring] + exponent
-                    else:
-                        self.do_logging('ERROR: for unit expression ' + u +\
-                          ' unknown unit ' + unitstring, both = True)
-                        return ''
-                else:
-                    if unitstring in numerator:
-                        numerator[unitstring] = \
-                            numerator[unitstring] + exponent
-                    else:
-                        self.do_logging('ERROR: for unit expression ' + u +\
-                          ' unknown unit ' + unitstring, both = True)
-                        return ''
+        try:
+            exponents = cfxunitsinfo.unit_exponents(u)
+        except ValueError:
+            self.do_logging('ERROR: for unit expression ' + u + ' ' +
+                            str(sys.exc_info()[1]) + '.', both = True)
+            return ''
+        for unitstring, exponent in exponents:
+            if unitstring not in numerator:
+                self.do_logging('ERROR: for unit expression ' + u +\
+                      ' unknown unit ' + unitstring, both = True)
+                return ''
+            if exponent > 0:
+                numerator[unitstring] = exponent
             else:
-                if s in numerator:
-                    numerator[s] = numerator[s] + 1
-                else:
-                    self.do_logging('ERROR: for unit expression ' + u +\
-                      ' unknown unit ' + s, both = True)
-                    return ''
+                denominator[unitstring] = -exponent
         numstring = self._exponents_to_string(numerator)
         if numstring != '':
             denomstring = self._exponents_to_string(denominator)
@@ -181,21 +220,64 @@ class TestRunner:
                 return numstring
             else:
                 return numstring + '/' + denomstring
+        return ''
         
 
 
+#the error TestCFX provokes for each monitor point, as in
+#Inconsistent dimensions on each side of '+' operator at position 25.
+#Dimensions on left:  'lb s^-1'
+#Dimensions on right: '<dimensionless>'.
+#Error processing expression: Expression Value = (massFlow()@SEAL_inlet) + 1 + 1 [m]
+DIMENSION_ERROR = 'Inconsistent dimensions on each side of \'+\' operator'
+
+def read_dimension_errors(outfile):
+    """The dimensions CFX reported for each probed expression in the
+       cfx5solve output file *outfile*, as a dictionary of expression ->
+       dimensions, in one pass over the file."""
+    f = open(outfile, 'r')
+    try:
+        lines = f.readlines()
+    finally:
+        f.close()
+    found = {} #empty dictionary
+    for n, line in enumerate(lines[:-3]):
+        if DIMENSION_ERROR not in line:
+            continue
+        left = lines[n + 1].replace('Dimensions on left:', '').strip()
+        e = lines[n + 3].replace(
+            'Error processing expression: Expression Value = (', '').replace(
+            ') + 1 + 1 [m]', '').strip()
+        found.setdefault(e, left.replace('\'', ''))
+    return found
+
 class TestCFX(ExternalCode):
     """Run a test of CFX to get error messages related to monitor point units.
        This is very convoluted, but it seems to be the only way to get CFX to
-       tell us what it knows about units."""
-    def __init__(self, runner, flow, name, expr, logger = None):
+       tell us what it knows about units.
+
+       All the monitor points in *probes*, a list of (name, expression), by
+       default just *name*, are tested in one run.  If CFX does not report
+       them all, it stopped at an error: the others are run again, and a
+       run that reports none is split.  Batches that are run again are
+       split to use the parallel runs of the TestRunner.  self.dims maps
+       the names to their units, self.dim is the units of *name*."""
+    def __init__(self, runner, flow, name, expr, logger = None,
+                 probes = None):
         super(TestCFX, self).__init__()
         self.logger = logger
         self.runner = runner
         self.flow = flow
         self.name = name
         self.expr = expr
+        if probes is None:
+            probes = [(name, expr)]
+        self.probes = probes
         self.units = ''
+        self.dim = ''
+        self.dims = {} #empty dictionary
+        self.unknown = set() #names with no units reported
+        self.runs = 0 #number of times CFX was run
         
     def do_logging(self, msg, both = False):
         if both or self.logger == None:
@@ -203,8 +285,8 @@ class TestCFX(ExternalCode):
         if self.logger <> None:
             self.logger.debug(msg)
 
-    def execute(self):
-        f = open(self.runner.cclfile, 'w')
+    def _write_ccl(self, cclfile, probes):
+        f = open(cclfile, 'w')
         f.write('FLOW: ' + self.flow.name + '\n')
         f.write('  SOLUTION UNITS:\n' +
             '    Angle Units = [rad]\n' +
@@ -217,77 +299,137 @@ class TestCFX(ExternalCode):
             )
         f.write('OUTPUT CONTROL:\n')
         f.write('MONITOR OBJECTS:\n')
-        f.write('MONITOR POINT: TEST_' + self.name + '\n')
-        f.write('Expression Value = (' + self.expr + ') + 1 + 1 [m]\n')
-        f.write('Option = Expression\n')
-        f.write('END\n')
+        for name, expr in probes:
+            f.write('MONITOR POINT: TEST_' + name + '\n')
+            f.write('Expression Value = (' + expr + ') + 1 + 1 [m]\n')
+            f.write('Option = Expression\n')
+            f.write('END\n')
         f.write('END\n')
         f.write('END\n')
         f.write('END\n')
         f.close()
+
+    def _run(self, probes):
+        """Run CFX on *probes* in a new directory; the dimensions reported
+           for each expression, or None if there is no output file.  The
+           directory is kept for inspection if nothing was reported."""
+        rundir, cclfile, outfile, solvecmd = self.runner.new_run()
+        self._write_ccl(cclfile, probes)
         #Execute
-        self.command = self.runner.solvecmd
-        
-        if os.path.exists(self.runner.outfile):
-            os.remove(self.runner.outfile)
-            
+        devnull = open(os.devnull, 'w')
         try:
-            #import pdb; pdb.set_trace()
-            super(TestCFX, self).execute()
-            pass
-        except:
-            pass #we expect an error, since we've inserted erroneous monitor points
-
-        # parse the output file for errors about expressions
-        #Inconsistent dimensions on each side of '+' operator at position 25.
-        #Dimensions on left:  'lb s^-1'
-        #Dimensions on right: '<dimensionless>'.
-        #Error processing expression: Expression Value = (massFlow()@SEAL_inlet) + 1 + 1 [m]
-        
-        parser = FileParser()
-        done = False
+            subprocess.call(solvecmd, cwd=rundir, stdout=devnull,
+                            stderr=subprocess.STDOUT)
+        except OSError:
+            self.do_logging('ERROR: cannot run ' + str(solvecmd), both = True)
+        finally:
+            devnull.close()
+        #we expect an error, since we've inserted erroneous monitor points
         try:
-            parser.set_file(self.runner.outfile)
+            found = read_dimension_errors(outfile)
         except IOError:
-            self.do_logging('ERROR: cannot open file ' + self.runner.outfile, both = True)
-            self.dim = ''
-            import pdb; pdb.set_trace()
-        
-        while not done:
-            try:
-                parser.mark_anchor(
-                    'Inconsistent dimensions on each side of \'+\' operator')
-                left = parser.transfer_line(1).replace(
-                    'Dimensions on left:','').strip()
-                right = parser.transfer_line(2).replace(
-                    'Dimensions on right:','').strip()
-                e = parser.transfer_line(3).replace(
-                    'Error processing expression: Expression Value = (','').replace(
-                    ') + 1 + 1 [m]','').strip()
-                if e == self.expr:
-                    self.dim = left.replace('\'', '')
-                    if self.dim == '<dimensionless>':
-                        self.dim = ''
-                    else:
-                        self.dim = self.runner.translate(self.dim)
-                    self.do_logging('Units for ' + self.flow.name + ': ' + self.name + ': ' + self.dim)
-                    break
-                
-                #MDPL finish - use the units
-                #MDPL check if using ANSYS 14 elsewhere
-                #MDPL The possibleinputs and possibleoutputs seems convoluted:
-                #   can we simplify?
-            
-                parser.current_row = parser.current_row + 3
-                
-            except RuntimeError: # did not find key, so done
-                done = True
-                self.do_logging('Unknown units for ' + self.flow.name + ': ' + self.name, both = True)
-                self.dim = ''
+            self.do_logging('ERROR: cannot open file ' + outfile, both = True)
+            return None
+        if len(found):
+            shutil.rmtree(rundir, ignore_errors=True)
+        return found
+
+    def _unknown(self, name):
+        self.do_logging('Unknown units for ' + self.flow.name + ': ' + name, both = True)
+        self.dims[name] = ''
+        self.unknown.add(name)
+
+    def _split(self, probes, parts):
+        """*probes* in up to *parts* batches of about the same size."""
+        n = len(probes)
+        parts = min(parts, n)
+        return [probes[i * n // parts:(i + 1) * n // parts]
+                for i in range(parts)]
+
+    def _sort(self, probes, found):
+        """Set the units of *probes* that are in *found*, the result of a
+           run.  Returns the batches to run again."""
+        if found is None:
+            for name, expr in probes:
+                self._unknown(name)
+            return []
+        missing = []
+        for name, expr in probes:
+            if expr not in found:
+                missing.append((name, expr))
+                continue
+            dim = self.runner.units_of(found[expr])
+            self.dims[name] = dim
+            self.do_logging('Units for ' + self.flow.name + ': ' + name + ': ' + dim)
+        if len(missing) == 0:
+            return []
+        if len(missing) < len(probes):
+            #stopped at an error after the ones found
+            return self._split(missing, self.runner.parallel)
+        if len(probes) > 1:
+            #one stops CFX before any is reported
+            return self._split(probes, max(2, self.runner.parallel))
+        self._unknown(probes[0][0])
+        return []
+
+    def execute(self):
+        self.dims = {} #empty dictionary
+        self.unknown = set()
+        self.runs = 0
+        batches = [self.probes]
+        while len(batches):
+            self.runs += len(batches)
+            results = self.runner.map(self._run, batches)
+            again = []
+            for probes, found in zip(batches, results):
+                again.extend(self._sort(probes, found))
+            batches = again
+        self.dim = self.dims.get(self.name, '')
 
 def _add_quotes(s):
     return '\'' + s + '\''
 
+def _input_key(i):
+    return (i.path, i.name, i.value, i.units)
+
+def _output_key(o):
+    return (o.flowname, o.name, o.expression_value, o.option, o.units)
+
+class WrapperChanges:
+    """The inputs (PossibleInput) and outputs (MonitorPointOutput) added,
+       removed and changed by GenerateCFXWrapper.update, matched by varname."""
+    def __init__(self, old_inputs, new_inputs, old_outputs, new_outputs):
+        self.added_inputs, self.removed_inputs, self.changed_inputs = \
+            self._compare(old_inputs, new_inputs, _input_key)
+        self.added_outputs, self.removed_outputs, self.changed_outputs = \
+            self._compare(old_outputs, new_outputs, _output_key)
+
+    def _compare(self, old, new, key):
+        olddict = dict([(x.varname, x) for x in old])
+        newdict = dict([(x.varname, x) for x in new])
+        added = [x for x in new if x.varname not in olddict]
+        removed = [x for x in old if x.varname not in newdict]
+        changed = [x for x in new if x.varname in olddict and
+                   key(olddict[x.varname]) != key(x)]
+        return added, removed, changed
+
+    def __nonzero__(self):
+        return bool(self.added_inputs or self.removed_inputs or
+                    self.changed_inputs or self.added_outputs or
+                    self.removed_outputs or self.changed_outputs)
+
+    def output(self):
+        s = ''
+        for title, items in (('Added input', self.added_inputs),
+                             ('Removed input', self.removed_inputs),
+                             ('Changed input', self.changed_inputs),
+                             ('Added output', self.added_outputs),
+                             ('Removed output', self.removed_outputs),
+                             ('Changed output', self.changed_outputs)):
+            for x in items:
+                s += title + ': ' + x.output() + '\n'
+        return s
+
 class GenerateCFXWrapper:
     """Generate the subclass of CFXWrapper specifically for the given CCL, .def, and .res files.
     
@@ -322,9 +464,23 @@ class GenerateCFXWrapper:
             
         parser: cclparser.CCLParser (optional)
             an existing CCLParser for the origcclfile. Used only for testing. If None, parser is created. Default None.
+            
+        parsecachedir: string (optional)
+            if not empty, directory in which the created CCLParser caches its parsed results, so that regenerating from an unchanged CCL file skips parsing. Default ''.
+            
+        parallel_probes: int (optional)
+            number of runs of CFX finding the units of monitor points that may go at a time. Default 1.
+            
+        static_units: bool (optional)
+            if True, the units of monitor points are found by analysing their expressions (see celunits), and CFX is run only for those it cannot resolve. Default True.
+            
+        unitsfile: string (optional)
+            file keeping the units found for monitor point expressions, by expression, solution units and .def file contents, so that they are not found again; wrappers for other models may share it.  If None, CFXUnits.db in workingdir; if empty, units are not kept.  Default None.
     """
     def __init__(self, origcclfile, deffile, workingdir, name = '',
-                 origresfile = '', cachefile = '', ansyspathstring = 'AWP_ROOT145', logger = None, parser = None):
+                 origresfile = '', cachefile = '', ansyspathstring = 'AWP_ROOT145', logger = None, parser = None,
+                 parsecachedir = '', parallel_probes = 1, unitsfile = None,
+                 static_units = True):
         self.logger = logger
         self.cclfile = origcclfile
         self.deffile = deffile
@@ -339,12 +495,21 @@ class GenerateCFXWrapper:
         else:
             self.base = name
         self.cachefile = cachefile
+        self.parallel_probes = parallel_probes
+        self.static_units = static_units
+        if unitsfile is None:
+            unitsfile = os.path.join(self.workdir, 'CFXUnits.db')
+        self.unitstore = None
+        if unitsfile != '':
+            self.unitstore = cfxcache.UnitStore(unitsfile)
         self.componentfile = os.path.join(self.workdir, self.base +'.py')
         self.inputs = [] #empty list
         self.outputs = [] #empty list
+        self.known_units = {} #units_key -> units, see collect
 
         if parser == None:
-            self.parser = cclparser.CCLParser(self.cclfile)
+            self.parser = cclparser.CCLParser(self.cclfile, logger = self.logger,
+                                              cachedir = parsecachedir)
             self.need_parse = True
         else:
             self.parser = parser
@@ -414,7 +579,7 @@ class GenerateCFXWrapper:
         for i in self.inputs:
             f.write(indent2 +
                 'self.possibleins.append(cfxunitsinfo.PossibleInput(' +
-                str(i.path) + ', ' +
+                str(list(i.path)) + ', ' +
                 _add_quotes(i.name) + ','  +
                 _add_quotes(str(i.value)) + ', ' +
                 _add_quotes(i.units) + ', ' +
@@ -439,26 +604,102 @@ class GenerateCFXWrapper:
         f.write(indent2 + 'super(' + classname + ',self).__init__()\n')
         
                 
-    def generate(self, dump = False):
-        """Generate the wrapper."""
-        triplequote = '"""'
-        if self.need_parse:
-            self.parser.parse()
-        if dump: 
-            self.do_logging(self.parser.output())
+    def library_text(self, expr):
+        """The library expressions *expr* uses, directly or through other
+           library expressions, as sorted (name, text) pairs; all of them
+           if *expr* cannot be read."""
+        expressions = self.parser.expressions
+        found = {} #empty dictionary
+        todo = [expr]
+        while todo:
+            try:
+                tokens = celunits.tokenize(todo.pop())
+            except celunits.Unresolved:
+                return tuple(sorted(expressions.items()))
+            for kind, t in tokens:
+                if kind == 'name' and t in expressions and t not in found:
+                    found[t] = expressions[t]
+                    todo.append(expressions[t])
+        return tuple(sorted(found.items()))
+
+    def units_key(self, flow, name, expr, option):
+        """What the units of monitor point *name* of *flow* depend on: its
+           expression and option, the solution units of the flow and the
+           text of the library expressions it uses."""
+        units = tuple([tuple(sorted(u.items())) for u in flow.units])
+        return (flow.name, name, expr, option, units,
+                self.library_text(expr))
+
+    def collect(self, known_units = None):
+        """Fill self.inputs and self.outputs from the parsed CCL.
+
+           *known_units* maps units_key() to units already found for a
+           monitor point; only the other monitor points are run through
+           TestCFX.  self.known_units is set to the same for the units
+           found now."""
+        if known_units is None:
+            known_units = {} #empty dictionary
+        self.inputs = [] #empty list
+        self.outputs = [] #empty list
+        self.known_units = {} #empty dictionary
         self._getnumerics(self.parser.expressions, ['LIBRARY:', 'CEL:', 'EXPRESSIONS:'], use_simple_name = True)
-        tr = TestRunner(self.deffile, self.workdir, self.base, self.ansyspath, logger = self.logger)
+        tr = TestRunner(self.deffile, self.workdir, self.base, self.ansyspath, logger = self.logger,
+                        parallel = self.parallel_probes)
+        analyser = None
+        if self.static_units:
+            analyser = celunits.DimensionAnalyser(self.parser.expressions)
         for fl in self.parser.flows:
             self._get_inputs(fl)
             tr.set_flow_dict(fl)
+            points = [] #empty list
             for k, v in fl.monitorpoints.iteritems():
                 option = v['Option']
                 if option == 'Expression':
-                    expr = v['Expression Value']
-                    tester = TestCFX(tr, fl, k, expr, logger = self.logger)
-                    tester.execute()
-                    self.outputs.append(cfxunitsinfo.MonitorPointOutput(
-                        fl.name, k, expr, option, tester.dim))
+                    points.append((k, v['Expression Value'], option))
+            keys = dict([(k, self.units_key(fl, k, expr, option))
+                         for k, expr, option in points])
+            #the units not known yet are all found in one run of CFX
+            probes = [(k, expr) for k, expr, option in points
+                      if keys[k] not in known_units]
+            dims = {} #empty dictionary
+            if analyser is not None:
+                for k, expr in probes:
+                    try:
+                        dims[k] = tr.units_of(analyser.dimension_string(expr))
+                    except celunits.Unresolved:
+                        self.do_logging('Cannot analyse ' + k + ': ' +
+                                        str(sys.exc_info()[1]))
+                    else:
+                        self.do_logging('Units for ' + fl.name + ': ' + k +
+                                        ': ' + dims[k] + ' (analysed)')
+                probes = [(k, expr) for k, expr in probes if k not in dims]
+            digest = None
+            if self.unitstore is not None and len(probes):
+                digest = tr.def_digest()
+            if digest is not None:
+                for k, expr in probes:
+                    dim = self.unitstore.get(expr, tr.flow_dict, digest)
+                    if dim is not None:
+                        dims[k] = dim
+                probes = [(k, expr) for k, expr in probes if k not in dims]
+            if len(probes):
+                tester = TestCFX(tr, fl, '', '', logger = self.logger,
+                                 probes = probes)
+                tester.execute()
+                for k, expr in probes:
+                    dims[k] = tester.dims[k]
+                    if digest is not None and k not in tester.unknown:
+                        self.unitstore.put(expr, tr.flow_dict, digest,
+                                           dims[k])
+            for k, expr, option in points:
+                key = keys[k]
+                if key in known_units:
+                    dim = known_units[key]
+                else:
+                    dim = dims.get(k, '')
+                self.known_units[key] = dim
+                self.outputs.append(cfxunitsinfo.MonitorPointOutput(
+                    fl.name, k, expr, option, dim))
         self.do_logging('INPUTS:')
         for i in self.inputs: 
             self.do_logging(i.output())
@@ -466,6 +707,45 @@ class GenerateCFXWrapper:
         for i in self.outputs: 
             self.do_logging(i.output())
 
+    def generate(self, dump = False):
+        """Generate the wrapper."""
+        if self.need_parse:
+            self.parser.parse()
+        if dump: 
+            self.do_logging(self.parser.output())
+        self.collect()
+        return self.write_component()
+
+    def update(self):
+        """Bring the wrapper up to date after the CCL file has been edited
+           and exported again.
+
+           Only the changed blocks of the CCL file are parsed again (see
+           CCLParser.reparse), units are found again only for monitor
+           points whose units_key() changed, and the component file is
+           rewritten if any input or output changed.  Returns a
+           WrapperChanges.
+
+           The first update parses the whole file again; it also makes the
+           parser incremental, so later updates parse only the changed
+           blocks.  A plain generate() does not pay for the block digests."""
+        old_inputs = self.inputs
+        old_outputs = self.outputs
+        self.parser.incremental = True
+        ccl_changes = self.parser.reparse()
+        self.do_logging(ccl_changes.output())
+        self.collect(self.known_units)
+        changes = WrapperChanges(old_inputs, self.inputs, old_outputs,
+                                 self.outputs)
+        self.do_logging(changes.output())
+        if changes:
+            self.write_component()
+        return changes
+
+    def write_component(self):
+        """Write the wrapper component for self.inputs and self.outputs.
+           Returns the file name and the class name."""
+        triplequote = '"""'
         classname = self.base + 'Wrapper'
 
         f = open(self.componentfile, 'w')
@@ -0,0 +1,314 @@
+"""Benchmarks for CCL parsing and wrapper generation on synthetic models.
+
+A synthetic CCL file with *flows* x *domains* x *boundaries* boundaries
+and *monitors* monitor points per flow is written for each size, and the
+time and peak memory of these stages are measured:
+
+    preprocess  StringArrayParser.preprocess on the lines of the file
+    parse       CCLParser(filename).parse()
+    getnumerics GenerateCFXWrapper._getnumerics over the expressions and
+                every boundary
+    emit        GenerateCFXWrapper.write_component
+
+Each stage runs in a fresh process so its peak memory can be taken from
+resource.getrusage (not available on Windows, where it is reported as
+null).  The results are written as JSON; pass an earlier results file
+with --compare to print the ratio of each time to the earlier one.
+
+    python bench_cfxwrapper.py [--sizes 1x2x8x10,2x4x16x50] [--repeat 3]
+                               [--output results.json] [--compare old.json]
+"""
+
+import json
+import multiprocessing
+import optparse
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+from cfxwrapper import cclparser
+from cfxwrapper import cfxunitsinfo
+from cfxwrapper import cfxwrappergenerator
+
+DEFAULT_SIZES = '1x2x8x10,2x4x16x25,4x8x32x50'
+STAGES = ('preprocess', 'parse', 'getnumerics', 'emit')
+
+_boundary_types = ('INLET', 'OUTLET', 'WALL', 'OPENING', 'SYMMETRY',
+                   'INTERFACE', 'WALL', 'WALL')
+
+def _boundary(f, d, b, btype):
+    lines = ['    BOUNDARY: F%dD%dB%d' % (f, d, b),
+             '      Boundary Type = %s' % btype,
+             '      Location = LOC_%d_%d_%d' % (f, d, b)]
+    if btype == 'INLET':
+        lines += ['      BOUNDARY CONDITIONS:',
+                  '        FLOW REGIME:',
+                  '          Option = Subsonic',
+                  '        END',
+                  '        MASS AND MOMENTUM:',
+                  '          Option = Total Pressure',
+                  '          Relative Pressure = %g [Pa] # inlet pressure'
+                      % (1000.0 + b),
+                  '        END',
+                  '        TURBULENCE:',
+                  '          Eddy Length Scale = 0.001 [m]',
+                  '          Fractional Intensity = 0.05',
+                  '          Option = Intensity and Length Scale',
+                  '        END',
+                  '      END']
+    elif btype == 'OUTLET':
+        lines += ['      BOUNDARY CONDITIONS:',
+                  '        MASS AND MOMENTUM:',
+                  '          Mass Flow Rate = %g [kg s^-1]' % (1.0 + b),
+                  '          Option = Mass Flow Rate',
+                  '        END',
+                  '      END']
+    elif btype == 'WALL':
+        lines += ['      BOUNDARY CONDITIONS:',
+                  '        HEAT TRANSFER:',
+                  '          Fixed Temperature = %g [K]' % (300.0 + b),
+                  '          Option = Fixed Temperature',
+                  '        END',
+                  '        MASS AND MOMENTUM:',
+                  '          Option = No Slip Wall',
+                  '        END',
+                  '        WALL ROUGHNESS:',
+                  '          Option = Smooth Wall',
+                  '        END',
+                  '      END']
+    elif btype == 'OPENING':
+        lines += ['      BOUNDARY CONDITIONS:',
+                  '        MASS AND MOMENTUM:',
+                  '          Option = Opening Pressure and Direction',
+                  '          Relative Pressure = 0 [Pa]',
+                  '        END',
+                  '      END']
+    lines.append('    END')
+    return lines
+
+def make_ccl(flows, domains, boundaries, monitors):
+    """Return the text of a synthetic CCL file with *flows* flows, each
+       with *domains* domains of *boundaries* boundaries, and *monitors*
+       monitor points per flow.  Includes comments, blank lines and
+       continuation lines."""
+    lines = ['# CCL generated by bench_cfxwrapper.make_ccl',
+             'LIBRARY:',
+             '  CEL:',
+             '    EXPRESSIONS:']
+    for f in xrange(flows):
+        for m in xrange(monitors):
+            if m % 5 == 4:
+                lines += ['      expr%d_%d = areaAve(Pressure)@LOC_%d_0_0 - \\'
+                              % (f, m, f),
+                          '          areaAve(Pressure)@LOC_%d_0_1' % f]
+            else:
+                lines.append('      expr%d_%d = massFlow()@LOC_%d_0_%d'
+                             % (f, m, f, m % max(boundaries, 1)))
+    lines += ['      pin = 101325 [Pa]',
+              '      tin = 300 [K] # inlet temperature',
+              '    END',
+              '  END',
+              '  MATERIAL: Water',
+              '    Material Group = Water Data',
+              '    Option = Pure Substance',
+              '  END',
+              'END',
+              '']
+    for f in xrange(flows):
+        lines += ['FLOW: Flow Analysis %d' % f,
+                  '  SOLUTION UNITS:',
+                  '    Angle Units = [rad]',
+                  '    Length Units = [m]',
+                  '    Mass Units = [kg]',
+                  '    Solid Angle Units = [sr]',
+                  '    Temperature Units = [K]',
+                  '    Time Units = [s]',
+                  '  END',
+                  '  ANALYSIS TYPE:',
+                  '    Option = Steady State',
+                  '  END']
+        for d in xrange(domains):
+            lines += ['  DOMAIN: F%dD%d' % (f, d),
+                      '    Coord Frame = Coord 0',
+                      '    Domain Type = Fluid',
+                      '    Location = Passage %d' % d,
+                      '    # boundaries of this domain']
+            for b in xrange(boundaries):
+                lines += _boundary(f, d, b,
+                                   _boundary_types[b % len(_boundary_types)])
+            lines += ['    DOMAIN MODELS:',
+                      '      DOMAIN MOTION:',
+                      '        Angular Velocity = %d [rev min^-1]'
+                          % (1000 + d),
+                      '        Option = Rotating',
+                      '      END',
+                      '    END',
+                      '  END',
+                      '']
+        lines += ['  OUTPUT CONTROL:',
+                  '    MONITOR OBJECTS:',
+                  '      Monitor Coefficient Loop Convergence = On']
+        for m in xrange(monitors):
+            lines += ['      MONITOR POINT: Mon%d' % m,
+                      '        Coord Frame = Coord 0',
+                      '        Expression Value = \\',
+                      '          expr%d_%d' % (f, m),
+                      '        Option = Expression',
+                      '      END']
+        lines += ['    END',
+                  '  END',
+                  'END']
+    return '\n'.join(lines) + '\n'
+
+def parse_size(s):
+    """'1x2x8x10' -> (1, 2, 8, 10)"""
+    return tuple([int(x) for x in s.split('x')])
+
+def _generator(cclfile, workdir, parser):
+    os.environ.setdefault('AWP_ROOT145', '')
+    return cfxwrappergenerator.GenerateCFXWrapper(cclfile, '', workdir,
+        'Bench', parser = parser, logger = _quiet)
+
+class _Quiet(object):
+    def debug(self, msg):
+        pass
+_quiet = _Quiet()
+
+def _run_stage(stage, cclfile, workdir):
+    """Run *stage* once, returning the seconds it took."""
+    if stage == 'preprocess':
+        f = open(cclfile, 'r')
+        sap = cclparser.StringArrayParser(f.readlines())
+        f.close()
+        start = time.time()
+        sap.preprocess()
+        return time.time() - start
+    if stage == 'parse':
+        start = time.time()
+        cclparser.CCLParser(cclfile, _quiet).parse()
+        return time.time() - start
+
+    parser = cclparser.CCLParser(cclfile, _quiet)
+    parser.parse()
+    gen = _generator(cclfile, workdir, parser)
+    start = time.time()
+    gen.inputs = []
+    gen._getnumerics(parser.expressions, ['LIBRARY:', 'CEL:', 'EXPRESSIONS:'],
+                     use_simple_name = True)
+    for fl in parser.flows:
+        gen._get_inputs(fl)
+    if stage == 'getnumerics':
+        return time.time() - start
+    gen.outputs = []
+    for fl in parser.flows:
+        for k, v in fl.monitorpoints.iteritems():
+            gen.outputs.append(cfxunitsinfo.MonitorPointOutput(fl.name, k,
+                v['Expression Value'], v['Option'], 'kg s**-1'))
+    start = time.time()
+    gen.write_component()
+    return time.time() - start
+
+def _maxrss_kb():
+    if resource is None:
+        return None
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        kb /= 1024 # bytes there
+    return kb
+
+def _stage_process(stage, cclfile, workdir, repeat, queue):
+    before = _maxrss_kb()
+    times = [_run_stage(stage, cclfile, workdir) for i in xrange(repeat)]
+    after = _maxrss_kb()
+    peak = None
+    if before is not None:
+        peak = after - before
+    queue.put((min(times), peak))
+
+def measure(stage, cclfile, workdir, repeat = 3):
+    """Best time in seconds and peak memory growth in KB of *stage*."""
+    queue = multiprocessing.Queue()
+    p = multiprocessing.Process(target = _stage_process,
+                                args = (stage, cclfile, workdir, repeat, queue))
+    p.start()
+    result = queue.get()
+    p.join()
+    return result
+
+def run(sizes, repeat = 3, stages = STAGES, log = sys.stdout):
+    """Run the benchmarks for each (flows, domains, boundaries, monitors)
+       in *sizes*.  Returns a list of result dictionaries."""
+    results = []
+    workdir = tempfile.mkdtemp()
+    try:
+        for size in sizes:
+            cclfile = os.path.join(workdir, 'bench_%dx%dx%dx%d.ccl' % size)
+            text = make_ccl(*size)
+            f = open(cclfile, 'w')
+            f.write(text)
+            f.close()
+            nlines = text.count('\n')
+            for stage in stages:
+                seconds, peak = measure(stage, cclfile, workdir, repeat)
+                results.append({'stage': stage,
+                    'flows': size[0], 'domains': size[1],
+                    'boundaries': size[2], 'monitors': size[3],
+                    'lines': nlines, 'seconds': seconds, 'peak_kb': peak})
+                if log is not None:
+                    log.write('%-12s %-14s %8d lines %10.4f s %10s KB\n' % (
+                        stage, 'x'.join([str(x) for x in size]), nlines,
+                        seconds, peak))
+    finally:
+        shutil.rmtree(workdir, ignore_errors = True)
+    return results
+
+def _key(r):
+    return (r['stage'], r['flows'], r['domains'], r['boundaries'],
+            r['monitors'])
+
+def compare(results, old_results, log = sys.stdout):
+    """Print the ratio of each time in *results* to that in *old_results*."""
+    old = dict([(_key(r), r) for r in old_results])
+    for r in results:
+        o = old.get(_key(r))
+        if o is not None and o['seconds'] > 0:
+            log.write('%-12s %-14s %8.2fx\n' % (r['stage'],
+                'x'.join([str(x) for x in _key(r)[1:]]),
+                r['seconds'] / o['seconds']))
+
+def main(argv = None):
+    op = optparse.OptionParser(usage = __doc__)
+    op.add_option('--sizes', default = DEFAULT_SIZES,
+        help = 'comma separated flowsxdomainsxboundariesxmonitors sizes')
+    op.add_option('--repeat', type = 'int', default = 3,
+        help = 'runs per stage; the best time is reported')
+    op.add_option('--stages', default = ','.join(STAGES))
+    op.add_option('--output', default = 'bench_cfxwrapper.json',
+        help = 'JSON file for the results')
+    op.add_option('--compare', default = '',
+        help = 'earlier JSON results to compare with')
+    options, args = op.parse_args(argv)
+    sizes = [parse_size(s) for s in options.sizes.split(',')]
+    results = run(sizes, options.repeat, options.stages.split(','))
+    f = open(options.output, 'w')
+    json.dump({'python': platform.python_version(),
+               'platform': platform.platform(),
+               'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+               'results': results}, f, indent = 1)
+    f.close()
+    if options.compare != '':
+        f = open(options.compare, 'r')
+        old = json.load(f)
+        f.close()
+        compare(results, old['results'])
+
+if __name__ == "__main__": # pragma: no cover
+    main()
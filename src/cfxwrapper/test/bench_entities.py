@@ -0,0 +1,137 @@
+"""Report the memory used per Boundary, Domain, Flow, PossibleInput and
+MonitorPointOutput, comparing the __slots__ classes with the previous
+dictionary based classes.
+
+    python bench_entities.py [count]
+"""
+
+import sys
+
+from cfxwrapper import cclparser
+from cfxwrapper import cfxunitsinfo
+
+
+# The dictionary based classes as they were before __slots__ was used.
+
+class DictBoundary:
+    def __init__(self, n, d):
+        self.name = n
+        self.attributes = d
+        self.type = d.get('Boundary Type', '')
+
+class DictDomain:
+    def __init__(self, n):
+        self.name = n
+        self.domaintype = ''
+        self.location = ''
+        self.inlets = []
+        self.outlets = []
+        self.openings = []
+        self.interfaces = []
+        self.walls = []
+        self.symmetries = []
+
+class DictFlow:
+    def __init__(self, n):
+        self.name = n
+        self.units = []
+        self.domains = []
+        self.monitorpoints = {}
+
+class DictPossibleInput:
+    def __init__(self, p, n, v, u, varname = ''):
+        self.path = p[0:len(p)]
+        self.name = n
+        self.value = v
+        self.units = u
+        self.varname = cfxunitsinfo.make_unique_name(self.path, self.name)
+
+class DictMonitorPointOutput:
+    def __init__(self, flowname, name, expr, option, units, varname = ''):
+        self.flowname = flowname
+        self.name = name
+        self.expression_value = expr
+        self.option = option
+        self.units = units
+        self.varname = (flowname + '__' + name).replace(' ', '_')
+
+
+def deep_size(objs):
+    """Total bytes of *objs* and everything they refer to, counting each
+       object once, so shared strings and tuples are only counted once."""
+    seen = set()
+    todo = list(objs)
+    total = 0
+    while todo:
+        o = todo.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, dict):
+            todo.extend(o.keys())
+            todo.extend(o.values())
+        elif isinstance(o, (list, tuple, set)):
+            todo.extend(o)
+        elif hasattr(o, '__dict__'):
+            todo.append(o.__dict__)
+        if hasattr(type(o), '__slots__'):
+            for cls in type(o).__mro__:
+                for k in getattr(cls, '__slots__', ()):
+                    if hasattr(o, k):
+                        todo.append(getattr(o, k))
+    return total
+
+
+def _text(s):
+    # build a fresh string, as reading it from a file would
+    return ''.join(list(s))
+
+def make_boundaries(cls, count):
+    return [cls(_text('Blade %d' % (i % 50)),
+                {'Boundary Type': _text('WALL'), 'Location': _text('BLADE')})
+            for i in xrange(count)]
+
+def make_domains(cls, count):
+    return [cls(_text('R%d' % (i % 10))) for i in xrange(count)]
+
+def make_flows(cls, count):
+    return [cls(_text('Flow Analysis 1')) for i in xrange(count)]
+
+def make_inputs(cls, count):
+    return [cls([_text('FLOW: Flow Analysis 1'), _text('DOMAIN: R1'),
+                 _text('BOUNDARY: inlet %d' % (i % 20)),
+                 _text('BOUNDARY CONDITIONS:'), _text('MASS AND MOMENTUM:')],
+                _text('Relative Pressure'), 1.0 * i, _text('Pa'))
+            for i in xrange(count)]
+
+def make_outputs(cls, count):
+    return [cls(_text('Flow Analysis 1'), _text('Mon%d' % i),
+                _text('massFlow()@inlet'), _text('Expression'),
+                _text('kg/s'))
+            for i in xrange(count)]
+
+CASES = [('Boundary', make_boundaries, DictBoundary, cclparser.Boundary),
+    ('Domain', make_domains, DictDomain, cclparser.Domain),
+    ('Flow', make_flows, DictFlow, cclparser.Flow),
+    ('PossibleInput', make_inputs, DictPossibleInput,
+        cfxunitsinfo.PossibleInput),
+    ('MonitorPointOutput', make_outputs, DictMonitorPointOutput,
+        cfxunitsinfo.MonitorPointOutput)]
+
+def run(count = 10000):
+    """Return a list of (entity, bytes before, bytes after) per entity."""
+    results = []
+    for name, make, before, after in CASES:
+        b = deep_size(make(before, count)) / float(count)
+        a = deep_size(make(after, count)) / float(count)
+        results.append((name, b, a))
+    return results
+
+if __name__ == "__main__": # pragma: no cover
+    count = 10000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    print '%-20s %12s %12s' % ('bytes per entity', 'before', 'after')
+    for name, b, a in run(count):
+        print '%-20s %12.1f %12.1f' % (name, b, a)
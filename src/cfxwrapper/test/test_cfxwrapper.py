@@ -1,20 +1,802 @@
 
+import os
+import pickle
+import shutil
+import stat
+import sys
+import tempfile
+import time
 import unittest
 
+from cfxwrapper import cclparser
+from cfxwrapper import celunits
+from cfxwrapper import cfxcache
+from cfxwrapper import cfxexecutor
+from cfxwrapper import cfxmonitor
+from cfxwrapper import cfxprocess
+from cfxwrapper import cfxscratch
+from cfxwrapper import cfxsession
+from cfxwrapper import cfxsurrogate
+from cfxwrapper import cfxunitsinfo
+from cfxwrapper import cfxwrappergenerator
+from cfxwrapper.cfxwrapper import CFXWrapper
+
+SAMPLE_CCL = """\
+LIBRARY:
+  CEL:
+    EXPRESSIONS:
+      ptin = 3 [atm]
+      Myflow = massFlow()@inlet # comment
+    END
+  END
+END
+FLOW: Flow Analysis 1
+  SOLUTION UNITS:
+    Length Units = [mm]
+    Mass Units = [kg]
+  END
+  DOMAIN: R1
+    Domain Type = Fluid
+    Location = B1
+    BOUNDARY: inlet
+      Boundary Type = INLET
+      Location = INFLOW
+      BOUNDARY CONDITIONS:
+        MASS AND MOMENTUM:
+          Option = Total Pressure
+          Relative Pressure = \\
+            ptin
+        END
+      END
+    END
+    BOUNDARY: Blade
+      Boundary Type = WALL
+      Location = BLADE
+    END
+  END
+  OUTPUT CONTROL:
+    MONITOR OBJECTS:
+      MONITOR POINT: Mon1
+        Expression Value = Myflow
+        Option = Expression
+      END
+    END
+  END
+END
+"""
+
+# Stand-ins for the CFX executables: the "solver" doubles the inlet
+# pressure into Mon1 and logs every run to solves.txt next to itself, and
+# the contents of any initial file to initial.txt.  Pressures from 100 up
+# take (p - 100) * 10 iterations of 0.1 s, with Mon1 = 2 p + 10 / 2**i,
+# unless stopped by cfx5stop.
+FAKE_SOLVE = """\
+import os, shutil, sys, time
+args = sys.argv[1:]
+ccl = args[args.index('-ccl') + 1]
+fullname = args[args.index('-fullname') + 1]
+bindir = os.path.dirname(sys.argv[0])
+p = 3.0
+for line in open(ccl):
+    if line.startswith('Relative Pressure ='):
+        p = float(line.split('=')[1].split('[')[0])
+open(os.path.join(bindir, 'solves.txt'), 'a').write('%r\\n' % p)
+print 'solving %r' % p
+sys.stdout.flush()
+if '-initial-file' in args:
+    open(os.path.join(bindir, 'initial.txt'), 'a').write(
+        open(args[args.index('-initial-file') + 1]).read())
+val = 2.0 * p
+if p >= 100:
+    rundir = fullname + '.dir'
+    os.mkdir(rundir)
+    for i in range(int((p - 100) * 10)):
+        if os.path.exists(os.path.join(rundir, 'stop')):
+            break
+        val = 2.0 * p + 10.0 / 2 ** i
+        open(os.path.join(rundir, 'hist'), 'a').write('%r\\n' % val)
+        time.sleep(0.1)
+    shutil.rmtree(rundir)
+open(fullname + '.res', 'w').write('%r\\n' % val)
+"""
+
+FAKE_MONDATA = """\
+import os, sys
+args = sys.argv[1:]
+if '-dir' in args:
+    val = open(os.path.join(args[args.index('-dir') + 1], 'hist')).read()
+else:
+    val = open(args[args.index('-res') + 1]).read()
+open(args[args.index('-out') + 1], 'w').write('"USER POINT,Mon1"\\n' + val)
+"""
+
+FAKE_STOP = """\
+import os, sys
+open(os.path.join(sys.argv[sys.argv.index('-directory') + 1], 'stop'), 'w')
+"""
+
+# Stand-in for the unit probe runs of cfx5solve: reports the dimensions
+# of every probed expression, or only the first if there is a file
+# firstonly next to it, and none if one of them is bad().  Logs the runs
+# to probes.txt.
+FAKE_PROBE = """\
+import os, sys
+args = sys.argv[1:]
+ccl = args[args.index('-ccl') + 1]
+fullname = args[args.index('-fullname') + 1]
+bindir = os.path.dirname(sys.argv[0])
+open(os.path.join(bindir, 'probes.txt'), 'a').write(os.getcwd() + '\\n')
+dims = {'Myflow': 'kg s^-1', 'area()@inlet': 'm^2'}
+prefix = 'Expression Value = ('
+exprs = [l[len(prefix):].split(') + 1 + 1')[0] for l in open(ccl)
+         if l.startswith(prefix)]
+out = open(fullname + '.out', 'w')
+if 'bad()' in exprs:
+    sys.exit(1)
+for expr in exprs:
+    out.write("Inconsistent dimensions on each side of '+' operator.\\n"
+              "Dimensions on left:  '%s'\\n"
+              "Dimensions on right: '<dimensionless>'.\\n"
+              "Error processing expression: %s%s) + 1 + 1 [m]\\n"
+              % (dims.get(expr, '<dimensionless>'), prefix, expr))
+    if os.path.exists(os.path.join(bindir, 'firstonly')):
+        break
+sys.exit(1)
+"""
+
+def make_fake_cfx(ansyspath, solve = FAKE_SOLVE):
+    """Write the stand-in executables into *ansyspath*/CFX/bin."""
+    bindir = os.path.join(ansyspath, 'CFX', 'bin')
+    os.makedirs(bindir)
+    for name, text in (('cfx5solve.exe', solve),
+                       ('cfx5mondata.exe', FAKE_MONDATA),
+                       ('cfx5stop.exe', FAKE_STOP)):
+        filename = os.path.join(bindir, name)
+        f = open(filename, 'w')
+        f.write('#!' + sys.executable + '\n' + text)
+        f.close()
+        os.chmod(filename, stat.S_IRWXU)
+    return bindir
+
+class SampleWrapper(CFXWrapper):
+    """Looks like a generated wrapper for SAMPLE_CCL."""
+    def __init__(self, tempdir):
+        self.varnames = ['ptin', 'Mon1']
+        self.inputvals = [3.0]
+        self.possibleins = [cfxunitsinfo.PossibleInput(
+            ['FLOW: Flow Analysis 1', 'DOMAIN: R1', 'BOUNDARY: inlet',
+             'BOUNDARY CONDITIONS:', 'MASS AND MOMENTUM:'],
+            'Relative Pressure', 3.0, 'atm', 'ptin')]
+        self.possibleouts = [cfxunitsinfo.MonitorPointOutput(
+            'Flow Analysis 1', 'Mon1', 'Myflow', 'Expression', '', 'Mon1')]
+        self.workdir = tempdir
+        self.base = 'sample'
+        self.origresfile = ''
+        self.deffile = os.path.join(tempdir, 'sample.def')
+        self.cachefile = ''
+        self.ansyspath = tempdir
+        super(SampleWrapper, self).__init__()
+
+
+def gen_runner(gen, flow, parallel = 1):
+    """The TestRunner of GenerateCFXWrapper *gen* for *flow*."""
+    runner = cfxwrappergenerator.TestRunner(gen.deffile, gen.workdir,
+                                            gen.base, gen.ansyspath,
+                                            parallel=parallel)
+    runner.set_flow_dict(flow)
+    return runner
+
+class FakeSolver(cfxsession.SolverSession):
+    """Stand-in solver: *function*(inputvals) gives the outputs after
+       *duration* seconds, once *startup* seconds have been paid by
+       start().  Counts its starts and solves."""
+    def __init__(self, function, startup = 0.0, duration = 0.0, name = ''):
+        super(FakeSolver, self).__init__(name)
+        self.function = function
+        self.startup = startup
+        self.duration = duration
+        self.starts = 0
+        self.solved = []
+
+    def start(self):
+        time.sleep(self.startup)
+        self.starts += 1
+        super(FakeSolver, self).start()
+
+    def solve(self, inputvals):
+        def finish():
+            time.sleep(self.duration)
+            self.solved.append(tuple(inputvals))
+            return self.function(inputvals)
+        return cfxprocess.SolveJob([], finish=finish).start()
 
 class CFXWrapperTestCase(unittest.TestCase):
 
     def setUp(self):
-        pass
+        self.tempdir = tempfile.mkdtemp()
+        self.cclfile = os.path.join(self.tempdir, 'sample.ccl')
+        f = open(self.cclfile, 'w')
+        f.write(SAMPLE_CCL)
+        f.close()
         
     def tearDown(self):
-        pass
+        shutil.rmtree(self.tempdir, ignore_errors=True)
         
-    # add some tests here...
-    
-    #def test_CFXWrapper(self):
-        #pass
+    def test_parse(self):
+        parser = cclparser.CCLParser(self.cclfile)
+        parser.parse(do_location_dictionary=True, do_length_units=True)
+        self.assertEqual(parser.expressions,
+                         {'ptin': '3 [atm]', 'Myflow': 'massFlow()@inlet'})
+        self.assertEqual(len(parser.flows), 1)
+        flow = parser.flows[0]
+        self.assertEqual(flow.name, 'Flow Analysis 1')
+        self.assertEqual(flow.units[0]['Length Units'], '[mm]')
+        self.assertEqual([d.name for d in flow.domains], ['R1'])
+        domain = flow.domains[0]
+        self.assertEqual(domain.domaintype, 'Fluid')
+        self.assertEqual([b.name for b in domain.inlets], ['inlet'])
+        self.assertEqual([b.name for b in domain.walls], ['Blade'])
+        mm = domain.inlets[0].attributes['BOUNDARY CONDITIONS:'][
+            'MASS AND MOMENTUM:']
+        self.assertEqual(mm['Relative Pressure'], 'ptin')
+        self.assertEqual(flow.monitorpoints,
+            {'Mon1': {'Expression Value': 'Myflow', 'Option': 'Expression'}})
+        self.assertEqual(parser.boundary_location_dictionary,
+                         {'inlet': 'INFLOW', 'Blade': 'BLADE'})
+        self.assertEqual(parser.units, set(['mm']))
+        # equal paths share one tuple, and only so many are remembered
+        a = cfxunitsinfo.PossibleInput(['FLOW: F', 'DOMAIN: D'], 'p', 1.0, '')
+        b = cfxunitsinfo.PossibleInput(['FLOW: F', 'DOMAIN: D'], 'q', 1.0, '')
+        self.assertTrue(a.path is b.path)
+        for n in range(5000):
+            cfxunitsinfo.intern_path(['FLOW: F', 'DOMAIN: ' + str(n)])
+        self.assertEqual(len(cfxunitsinfo._interned_path.cache), 4096)
+
+    def test_parse_lazy(self):
+        eager = cclparser.CCLParser(self.cclfile)
+        eager.parse()
+        lazy = cclparser.CCLParser(self.cclfile)
+        lazy.parse(lazy=True)
+        flow = lazy.flows[0]
+        self.assertEqual(flow.units, eager.flows[0].units)
+        self.assertEqual(flow._domains, None)
+        self.assertEqual(flow._monitorpoints, None)
+        self.assertEqual(lazy.expressions, eager.expressions)
+        self.assertEqual(flow.monitorpoints, eager.flows[0].monitorpoints)
+        self.assertEqual(flow._domains, None)
+        self.assertEqual([b.attributes for b in flow.domains[0].inlets],
+                         [b.attributes for b in eager.flows[0].domains[0].inlets])
+
+    def test_mapped_file(self):
+        listed = cclparser.StringArrayParser([], self.cclfile)
+        mapped = cclparser.MappedCCLFile(self.cclfile)
+        try:
+            self.assertEqual(list(mapped), listed.data)
+            self.assertEqual(mapped[-1], 'END')
+            self.assertEqual(mapped[1:3], listed.data[1:3])
+            self.assertTrue('          Relative Pressure = ptin' in mapped)
+        finally:
+            mapped.close()
+
+    def test_parse_many(self):
+        other = os.path.join(self.tempdir, 'other.ccl')
+        shutil.copy(self.cclfile, other)
+        parsers = list(cclparser.parse_many([self.cclfile, other], workers=2,
+                                            do_length_units=True))
+        self.assertEqual(sorted([p.filename for p in parsers]),
+                         sorted([self.cclfile, other]))
+        for p in parsers:
+            self.assertEqual(p.units, set(['mm']))
+            self.assertEqual([b.name for b in p.flows[0].domains[0].walls],
+                             ['Blade'])
+
+    def test_reparse(self):
+        parser = cclparser.CCLParser(self.cclfile, incremental=True)
+        parser.parse()
+        domain = parser.flows[0].domains[0]
+        inlet = domain.inlets[0]
+        blade = domain.walls[0]
+        f = open(self.cclfile, 'w')
+        f.write(SAMPLE_CCL.replace('Location = BLADE', 'Location = BLADE2'))
+        f.close()
+        changes = parser.reparse()
+        path = ('FLOW: Flow Analysis 1', 'DOMAIN: R1')
+        self.assertEqual(changes.added, [])
+        self.assertEqual(changes.removed, [])
+        self.assertEqual(changes.changed, [path[:1], path,
+                                           path + ('BOUNDARY: Blade',)])
+        domain = parser.flows[0].domains[0]
+        self.assertTrue(domain.inlets[0] is inlet)
+        self.assertFalse(domain.walls[0] is blade)
+        self.assertEqual(domain.walls[0].attributes['Location'], 'BLADE2')
+        self.assertFalse(parser.reparse())
+
+        # the kept sections of a lazy parse are read from the old text
+        lazy = cclparser.CCLParser(self.cclfile, incremental=True)
+        lazy.parse(lazy=True)
+        f = open(self.cclfile, 'w')
+        f.write(SAMPLE_CCL.replace('Location = BLADE', 'Location = BLADE2')
+                .replace('      ptin = 3 [atm]\n',
+                         '      ptin = 3 [atm]\n      t0 = 1 [s]\n'))
+        f.close()
+        changes = lazy.reparse()
+        self.assertEqual(changes.changed, [('LIBRARY:',)])
+        flow = lazy.flows[0]
+        self.assertEqual(flow.monitorpoints,
+            {'Mon1': {'Expression Value': 'Myflow', 'Option': 'Expression'}})
+        self.assertEqual([b.name for b in flow.domains[0].inlets], ['inlet'])
+        self.assertEqual(lazy.expressions['t0'], '1 [s]')
+
+    def test_parse_cache(self):
+        cachedir = os.path.join(self.tempdir, 'cache')
+        first = cclparser.CCLParser(self.cclfile, cachedir=cachedir)
+        first.parse()
+        self.assertFalse(first.from_cache)
+        second = cclparser.CCLParser(self.cclfile, cachedir=cachedir)
+        second.parse()
+        self.assertTrue(second.from_cache)
+        self.assertEqual(second.expressions, first.expressions)
+        self.assertEqual(second.flows[0].monitorpoints,
+                         first.flows[0].monitorpoints)
+        self.assertEqual(second.boundary_location_dictionary,
+                         {'inlet': 'INFLOW', 'Blade': 'BLADE'})
+
+        # a changed file must not pick up the old entry
+        f = open(self.cclfile, 'a')
+        f.write('FLOW: Flow Analysis 2\nEND\n')
+        f.close()
+        third = cclparser.CCLParser(self.cclfile, cachedir=cachedir)
+        third.parse()
+        self.assertFalse(third.from_cache)
+        self.assertEqual([fl.name for fl in third.flows],
+                         ['Flow Analysis 1', 'Flow Analysis 2'])
+
+    @unittest.skipIf(sys.platform == 'win32', 'stand-in solver is a script')
+    def test_unit_probes(self):
+        bindir = make_fake_cfx(self.tempdir, FAKE_PROBE)
+        parser = cclparser.CCLParser(self.cclfile)
+        parser.parse()
+        os.environ['CFXWRAPPER_TEST_ROOT'] = self.tempdir
+        gen = cfxwrappergenerator.GenerateCFXWrapper(self.cclfile,
+            os.path.join(self.tempdir, 'sample.def'), self.tempdir, 'sample',
+            ansyspathstring='CFXWRAPPER_TEST_ROOT', parser=parser,
+            static_units=False)
+        gen.collect()
+        self.assertEqual([o.units for o in gen.outputs], ['kg/s'])
+        flow = parser.flows[0]
+        probes = [('Flow', 'Myflow'), ('Area', 'area()@inlet'),
+                  ('Ratio', '2 * 3')]
+        tester = cfxwrappergenerator.TestCFX(gen_runner(gen, flow), flow,
+                                             'Area', '', probes=probes)
+        tester.execute()
+        expected = {'Flow': 'kg/s', 'Area': 'mm**2', 'Ratio': ''}
+        self.assertEqual(tester.dims, expected)
+        self.assertEqual(tester.dim, 'mm**2')
+        self.assertEqual(tester.runs, 1)
+        # a solver that stops at the first error, and one that stops it
+        # reporting any
+        open(os.path.join(bindir, 'firstonly'), 'w').close()
+        tester = cfxwrappergenerator.TestCFX(gen_runner(gen, flow), flow,
+            '', '', probes=probes + [('Bad', 'bad()')])
+        tester.execute()
+        expected['Bad'] = ''
+        self.assertEqual(tester.dims, expected)
+        self.assertEqual(tester.runs, 6)
+        # each run in a directory of its own, removed once read, but for
+        # the one that reported nothing
+        runs = open(os.path.join(bindir, 'probes.txt')).read().split()
+        self.assertEqual(len(runs), 8)
+        self.assertEqual(len(set(runs)), 8)
+        kept = [r for r in runs if os.path.exists(r)]
+        self.assertEqual(len(kept), 3)
+        for r in kept:
+            ccl = open(os.path.join(r, 'TEST_sample.ccl')).read()
+            self.assertTrue('bad()' in ccl)
+        # the same in parallel
+        tester = cfxwrappergenerator.TestCFX(gen_runner(gen, flow, 3), flow,
+            '', '', probes=probes + [('Bad', 'bad()')])
+        tester.execute()
+        self.assertEqual(tester.dims, expected)
+        self.assertEqual(tester.runs, 6)
+
+    def test_units_cache(self):
+        bindir = make_fake_cfx(self.tempdir, FAKE_PROBE)
+        deffile = os.path.join(self.tempdir, 'sample.def')
+        open(deffile, 'w').write('definitions')
+        os.environ['CFXWRAPPER_TEST_ROOT'] = self.tempdir
+        unitsfile = os.path.join(self.tempdir, 'shared', 'units.db')
+
+        def collect(name):
+            parser = cclparser.CCLParser(self.cclfile)
+            parser.parse()
+            gen = cfxwrappergenerator.GenerateCFXWrapper(self.cclfile,
+                deffile, self.tempdir, name,
+                ansyspathstring='CFXWRAPPER_TEST_ROOT', parser=parser,
+                unitsfile=unitsfile, static_units=False)
+            gen.collect()
+            runs = open(os.path.join(bindir, 'probes.txt')).read().split()
+            return [o.units for o in gen.outputs], len(runs)
+
+        self.assertEqual(collect('sample'), (['kg/s'], 1))
+        # again, and for another model sharing the store
+        self.assertEqual(collect('sample'), (['kg/s'], 1))
+        self.assertEqual(collect('sibling'), (['kg/s'], 1))
+        self.assertEqual(len(cfxcache.UnitStore(unitsfile)), 1)
+        # other solution units or definitions are probed again
+        f = open(self.cclfile, 'w')
+        f.write(SAMPLE_CCL.replace('Mass Units = [kg]', 'Mass Units = [g]'))
+        f.close()
+        self.assertEqual(collect('sample'), (['g/s'], 2))
+        open(deffile, 'w').write('other definitions')
+        self.assertEqual(collect('sample'), (['g/s'], 3))
+
+    def test_translate_units(self):
+        translate = cfxunitsinfo.translate
+        for cfx, expected in (('kg m^-3', 'kg * m**-3'),
+                              ('mile hr^-1', 'mi * h**-1'),
+                              ('K', 'degK'), ('kilog', 'kg'),
+                              # whole units only: no lbmf, galUKUSliquid
+                              # or un
+                              ('lbf', 'lbf'), ('gallonUSliquid', 'galUS'),
+                              ('micron', 'um'),
+                              ('centipoise', '(0.01 * g * cm**-1 / s)'),
+                              ('poise^2', '(g * cm**-1 / s)**2'),
+                              # a prefix of no known unit is kept
+                              ('millifurlong', 'millifurlong'),
+                              ('kilo', 'kilo')):
+            self.assertEqual(translate(cfx), expected)
+        self.assertTrue(('mile hr^-1',) in translate.cache)
+        self.assertEqual(cfxunitsinfo.unit_exponents('s^-1 m^2 kg m^-1'),
+                         (('kg', 1.0), ('m', 1.0), ('s', -1.0)))
+        self.assertEqual(cfxunitsinfo.unit_exponents('m m^-1'), ())
+        self.assertRaises(ValueError, cfxunitsinfo.unit_tokens, 'm^x')
+        runner = cfxwrappergenerator.TestRunner('', self.tempdir, 'sample',
+                                                self.tempdir)
+        self.assertEqual(runner.translate('m^2 m^-1 s^-1'), 'm/s')
+        runner.flow_dict = {'m': 'mm'}
+        self.assertEqual(runner.translate('m^2 m^-1 s^-1'), 'mm/s')
+        self.assertEqual(runner.translate('m^x'), '')
+        self.assertEqual(runner.translate('furlong'), '')
+
+    def test_update_units(self):
+        os.environ['CFXWRAPPER_TEST_ROOT'] = self.tempdir
+
+        def generator():
+            return cfxwrappergenerator.GenerateCFXWrapper(self.cclfile,
+                os.path.join(self.tempdir, 'sample.def'), self.tempdir,
+                'sample', ansyspathstring='CFXWRAPPER_TEST_ROOT',
+                unitsfile='')
+
+        def edit(old, new):
+            text = open(self.cclfile).read()
+            f = open(self.cclfile, 'w')
+            f.write(text.replace(old, new))
+            f.close()
+
+        gen = generator()
+        gen.generate()
+        self.assertEqual(gen.parser.block_digests, None)
+        self.assertEqual([o.units for o in gen.outputs], ['kg/s'])
+        # the solution units of the flow change
+        edit('Mass Units = [kg]', 'Mass Units = [g]')
+        self.assertTrue(gen.update())
+        self.assertNotEqual(gen.parser.block_digests, None)
+        fresh = generator()
+        fresh.generate()
+        self.assertNotEqual(fresh.outputs[0].units, 'kg/s')
+        self.assertEqual([o.units for o in gen.outputs],
+                         [fresh.outputs[0].units])
+        # the library expression the monitor point uses changes
+        edit('Myflow = massFlow()@inlet', 'Myflow = area()@inlet')
+        self.assertTrue(gen.update())
+        self.assertEqual([o.units for o in gen.outputs], ['mm**2'])
+        self.assertFalse(gen.update())
+
+    def test_cel_units(self):
+        analyser = celunits.DimensionAnalyser({
+            'ptin': '3 [atm]', 'Myflow': 'massFlow()@inlet',
+            'Twice': '2 * Myflow ^ 2 / (1 [m] * ptin)',
+            'Loop': 'Loop + 1', 'Bad': 'Myflow + 1'})
+        for expr, expected in (
+                ('massFlow()@inlet', 'kg s^-1'),
+                ('Myflow', 'kg s^-1'),
+                ('Twice', 'kg'),
+                ('areaAve(Total Pressure in Stn Frame)@REGION:outlet - ptin',
+                 'm^-1 kg s^-2'),
+                ('force_z()@Blade * 0.5 [mm]', 'm^2 kg s^-2'),
+                ('sqrt(area()@inlet) / 2', 'm'),
+                ('massFlowAve(Water.Velocity u)@out', 'm s^-1'),
+                ('-2 * pi * (3 + 4) ^ 0.5', '<dimensionless>'),
+                ('[kPa] * x ^ -2', 'm^-3 kg s^-2'),
+                ('if(t > 1 [s], 1 [W], 2 [J s^-1])', 'm^2 kg s^-3'),
+                # constants that cannot be folded are still dimensionless
+                ('(-8)^(1/3)', '<dimensionless>'),
+                ('10^400 * 1 [m]', 'm')):
+            self.assertEqual(analyser.dimension_string(expr), expected)
+        for expr in ('Loop', 'Bad', 'userFunction(1)', 'Twice ^ ptin',
+                     'massFlow()@inlet + 1', '3 [furlong]', '(1 + 2',
+                     'x ^ (10^400)', 'x ^ (1/0)'):
+            self.assertRaises(celunits.Unresolved, analyser.dimensions, expr)
+        # the generator probes only what it cannot analyse
+        bindir = make_fake_cfx(self.tempdir, FAKE_PROBE)
+        parser = cclparser.CCLParser(self.cclfile)
+        parser.parse()
+        parser.flows[0].monitorpoints['Mon2'] = {
+            'Expression Value': 'torque_z()@Blade', 'Option': 'Expression'}
+        parser.flows[0].monitorpoints['Mon3'] = {
+            'Expression Value': 'userFunction(1)', 'Option': 'Expression'}
+        os.environ['CFXWRAPPER_TEST_ROOT'] = self.tempdir
+        gen = cfxwrappergenerator.GenerateCFXWrapper(self.cclfile,
+            os.path.join(self.tempdir, 'sample.def'), self.tempdir, 'sample',
+            ansyspathstring='CFXWRAPPER_TEST_ROOT', parser=parser)
+        gen.collect()
+        units = dict([(o.name, o.units) for o in gen.outputs])
+        # the stand-in CFX would have said torque is dimensionless
+        torque = gen_runner(gen, parser.flows[0]).translate('m^2 kg s^-2')
+        self.assertEqual(units, {'Mon1': 'kg/s', 'Mon2': torque,
+                                 'Mon3': ''})
+        self.assertTrue('mm**2' in torque)
+        runs = open(os.path.join(bindir, 'probes.txt')).read().split()
+        self.assertEqual(len(runs), 1)
+
+    def test_execute_batch(self):
+        bindir = make_fake_cfx(self.tempdir)
+        # results of the user's own runs next to the CCL file are kept
+        for name in ('sample.res', 'sample_001.res', 'sample.out'):
+            open(os.path.join(self.tempdir, name), 'w').close()
+        wrapper = SampleWrapper(self.tempdir)
+        wrapper.cache[(5.0,)] = (-1.0,)
+        results = wrapper.execute_batch([[1.0], [2.0], [5.0 + 1e-15], [1.0],
+                                         [3.0]], max_parallel=3)
+        self.assertEqual(results, [(2.0,), (4.0,), (-1.0,), (2.0,), (6.0,)])
+        solves = open(os.path.join(bindir, 'solves.txt')).read().split()
+        self.assertEqual(sorted(solves), ['1.0', '2.0', '3.0'])
+        self.assertEqual(wrapper.cache[(2.0,)], (4.0,))
+        for name in ('sample.res', 'sample_001.res', 'sample.out'):
+            self.assertTrue(os.path.exists(os.path.join(self.tempdir, name)))
+        wrapper.cache.close()
+        store = cfxcache.ResultStore(SampleWrapper.storefile(wrapper.cachefile))
+        self.assertEqual(store[(1.0,)], (2.0,))
+        store.close()
+
+        # the same through two solver slots
+        wrapper = SampleWrapper(self.tempdir)
+        wrapper.session_slots = 2
+        results = wrapper.execute_batch([[7.0], [1.0], [8.0]])
+        self.assertEqual(results, [(14.0,), (2.0,), (16.0,)])
+        self.assertEqual(len(wrapper.sessions.sessions), 2)
+        wrapper.close_sessions()
+
+    def test_session_pool(self):
+        pool = cfxsession.SessionPool(
+            lambda n: FakeSolver(lambda x: (2 * x[0],), startup=0.2,
+                                 duration=0.05),
+            2)
+        points = [(1.0,), (100.0,), (1.1,), (100.1,), (1.2,), (100.2,)]
+        jobs = [pool.submit(p) for p in points]
+        self.assertEqual([j.result(30) for j in jobs],
+                         [(2 * p[0],) for p in points])
+        for session in pool.sessions:
+            # started once, and kept to the points near its first one
+            self.assertEqual(session.starts, 1)
+            self.assertEqual(len(session.solved), 3)
+            self.assertEqual(len(set([p[0] > 50 for p in session.solved])), 1)
+        busy = [pool.submit((2.0,)), pool.submit((3.0,))]
+        waiting = pool.submit((5.0,))
+        waiting.cancel()
+        self.assertRaises(cfxprocess.SolveCancelled, waiting.result, 30)
+        self.assertEqual([j.result(30) for j in busy], [(4.0,), (6.0,)])
+        pool.close()
+        self.assertFalse(pool.sessions[0].started)
+
+    def test_result_store(self):
+        picklefile = os.path.join(self.tempdir, 'oldCache.txt')
+        f = open(picklefile, 'w')
+        pickle.dump({(1.0, 2.0): (3.0,), (4.0, 5.0): (6.0,)}, f)
+        f.close()
+        filename = os.path.join(self.tempdir, 'old.db')
+        store = cfxcache.ResultStore(filename)
+        self.assertEqual(store.import_pickle(picklefile), 2)
+        self.assertEqual(store.import_pickle(picklefile), 0)
+        store[(1, 2)] = (7.0,)
+        other = cfxcache.ResultStore(filename)
+        other[(8.0, 9.0)] = (10.0,)
+        self.assertEqual(store[(1.0, 2.0)], (7.0,))
+        self.assertEqual(store.get((8.0, 9.0)), (10.0,))
+        self.assertFalse((2.0, 1.0) in store)
+        self.assertRaises(KeyError, store.__getitem__, (2.0, 1.0))
+        self.assertEqual(len(store), 3)
+        self.assertEqual(dict(store.items()), {(1.0, 2.0): (7.0,),
+                                               (4.0, 5.0): (6.0,),
+                                               (8.0, 9.0): (10.0,)})
+        store.close()
+        other.close()
+
+    @unittest.skipIf(sys.platform == 'win32', 'stand-in solver is a script')
+    def test_surrogate(self):
+        bindir = make_fake_cfx(self.tempdir)
+        wrapper = SampleWrapper(self.tempdir)
+        wrapper.surrogate_tol = 0.05
+        wrapper.surrogate_min_points = 5
+        for p in (1.0, 2.0, 3.0, 4.0):
+            wrapper.cache[(p,)] = (2.0 * p,)
+        wrapper.inputvals = [2.5]
+        wrapper.execute()
+        self.assertTrue(wrapper.surrogate is None) # too few points
+        self.assertEqual(wrapper.outputvals, [5.0])
+        wrapper.cache[(5.0,)] = (10.0,)
+        wrapper.inputvals = [3.5]
+        wrapper.execute()
+        self.assertEqual(len(wrapper.surrogate), 6)
+        self.assertAlmostEqual(wrapper.outputvals[0], 7.0, 1)
+        wrapper.inputvals = [50.0]
+        wrapper.execute()
+        self.assertEqual(wrapper.outputvals, [100.0])
+        solves = open(os.path.join(bindir, 'solves.txt')).read().split()
+        self.assertEqual(solves, ['2.5', '50.0'])
+        # a point solved again replaces its earlier result in the fit
+        wrapper.cache[(4.0,)] = (8.5,)
+        wrapper.surrogate_estimate([3.5])
+        self.assertEqual(len(wrapper.surrogate), 7)
+        self.assertAlmostEqual(wrapper.surrogate.predict([4.0])[0], 8.5, 5)
+        # repeated inputs cannot be interpolated
+        self.assertRaises(cfxsurrogate.SingularFit,
+                          cfxsurrogate.RBFSurrogate().fit,
+                          [(1.0,), (2.0,), (1.0,)], [(1.0,), (2.0,), (3.0,)])
+
+    @unittest.skipIf(sys.platform == 'win32', 'stand-in solver is a script')
+    def test_warmstart(self):
+        bindir = make_fake_cfx(self.tempdir)
+        wrapper = SampleWrapper(self.tempdir)
+        for p in (1.0, 10.0, 1.5):
+            wrapper.inputvals = [p]
+            wrapper.execute()
+        # 1.5 started from the result of 1.0
+        initial = open(os.path.join(bindir, 'initial.txt')).read().split()
+        self.assertEqual(initial, ['2.0', '2.0'])
+        kept = [n for n in os.listdir(wrapper.resfiles.directory)
+                if n.endswith('.res')]
+        self.assertEqual(len(kept), 3)
+        # the result of 10.0, least recently used, is deleted first
+        wrapper.resfiles.trim(2 * os.path.getsize(os.path.join(
+            wrapper.resfiles.directory, kept[0])))
+        self.assertEqual(open(wrapper.resfiles.nearest([11.0])).read(),
+                         '3.0\n')
+        wrapper.resfiles.close()
+
+    @unittest.skipIf(sys.platform == 'win32', 'stand-in solver is a script')
+    def test_execute_async(self):
+        make_fake_cfx(self.tempdir)
+        wrapper = SampleWrapper(self.tempdir)
+        lines = []
+        job = wrapper.execute_async([4.0],
+                                    output=lambda s, l: lines.append((s, l)))
+        slow = wrapper.execute_async([130.0])
+        stuck = wrapper.execute_async([140.0], timeout=0.5)
+        self.assertEqual(job.result(30), (8.0,))
+        self.assertTrue(('stdout', 'solving 4.0\n') in lines)
+        self.assertFalse(slow.done())
+        slow.cancel()
+        self.assertRaises(cfxprocess.SolveCancelled, slow.result, 30)
+        self.assertTrue(slow.cancelled())
+        self.assertRaises(cfxprocess.SolveTimeout, stuck.result, 30)
+        self.assertEqual(wrapper.cache[(4.0,)], (8.0,))
+        self.assertTrue(wrapper.execute_async([4.0]).done())
+
+    def test_executor(self):
+        bindir = make_fake_cfx(self.tempdir)
+        queuedir = os.path.join(self.tempdir, 'queue')
+        wrapper = SampleWrapper(self.tempdir)
+        wrapper.executor = cfxexecutor.QueueExecutor(queuedir)
+        wrapper.executor.poll_interval = 0.05
+        # nothing takes the task until there are workers
+        waiting = wrapper.execute_async([9.0])
+        self.assertEqual(len(os.listdir(os.path.join(queuedir, 'pending'))),
+                         1)
+        waiting.cancel()
+        self.assertRaises(cfxprocess.SolveCancelled, waiting.result, 30)
+        self.assertEqual(os.listdir(os.path.join(queuedir, 'pending')), [])
+        workers = cfxexecutor.WorkerProcesses(queuedir, 2, poll_interval=0.05)
+        try:
+            results = wrapper.execute_batch([[1.0], [2.0], [3.0]],
+                                            max_parallel=3)
+            self.assertEqual(results, [(2.0,), (4.0,), (6.0,)])
+            wrapper.inputvals = [4.0]
+            wrapper.execute()
+            self.assertEqual(wrapper.outputvals, [8.0])
+        finally:
+            workers.close()
+        solves = open(os.path.join(bindir, 'solves.txt')).read().split()
+        self.assertEqual(sorted(solves), ['1.0', '2.0', '3.0', '4.0'])
+        self.assertEqual(wrapper.cache[(3.0,)], (6.0,))
+        # 4.0 started from the result of 3.0, kept from the worker's run
+        initial = open(os.path.join(bindir, 'initial.txt')).read().split()
+        self.assertEqual(initial[-1], '6.0')
+        # the same tasks run here
+        wrapper.executor = cfxexecutor.LocalExecutor(wrapper.scratch)
+        self.assertEqual(wrapper.execute_async([5.0]).result(30), (10.0,))
+
+    @unittest.skipIf(sys.platform == 'win32', 'stand-in solver is a script')
+    def test_convergence_monitor(self):
+        make_fake_cfx(self.tempdir)
+        wrapper = SampleWrapper(self.tempdir)
+        wrapper.monitor_interval = 0.2
+        samples = []
+        job = wrapper.execute_async([104.0],
+            criteria=[cfxmonitor.Window('Mon1', 3, atol=0.1)],
+            sampled=lambda monitor: samples.append(monitor.history('Mon1')))
+        value = job.result(30)[0]
+        self.assertTrue(job.monitor.converged)
+        self.assertTrue(208.0 < value < 208.1)
+        # stopped well before the 40 iterations
+        self.assertTrue(len(samples[-1]) < 30)
+        self.assertEqual(samples[-1][:2], [218.0, 213.0])
+        # the same for a blocking execute
+        wrapper.convergence = [cfxmonitor.Window('Mon1', 3, atol=0.1)]
+        wrapper.inputvals = [105.0]
+        wrapper.execute()
+        self.assertTrue(210.0 < wrapper.outputvals[0] < 210.1)
+
+    def test_scratch_space(self):
+        scratch = cfxscratch.ScratchSpace(os.path.join(self.tempdir, 'runs'),
+                                          10000)
+        runs = [scratch.new_run('sample') for n in range(3)]
+        for rundir in runs:
+            f = open(os.path.join(rundir, 'sample.out'), 'w')
+            f.write('x' * 4000)
+            f.close()
+        for n, rundir in enumerate(runs[:2]):
+            scratch.finish(rundir)
+            os.utime(rundir, (1000.0 * n, 1000.0 * n)) # oldest first
+        # compressing the oldest is enough
+        self.assertEqual(scratch.collect(), (1, 0))
+        self.assertTrue(os.path.exists(os.path.join(runs[0], 'sample.out.gz')))
+        self.assertTrue(os.path.exists(os.path.join(runs[1], 'sample.out')))
+        self.assertEqual(scratch.collect(1000), (1, 2))
+        self.assertEqual(os.listdir(scratch.root),
+                         [os.path.basename(runs[2])]) # still active
+
+        # files and directories new_run() did not make are never touched
+        for name in ('sample.res', 'sample_001.res', 'sample_002.out'):
+            open(os.path.join(scratch.root, name), 'w').close()
+        os.mkdir(os.path.join(scratch.root, 'sample_user'))
+        scratch.finish(runs[2])
+        more = [scratch.new_run('sample') for n in range(2)]
+        for rundir in more:
+            scratch.finish(rundir)
+        self.assertEqual(scratch.sweep(keep=[more[0]]), 2)
+        self.assertEqual(sorted(os.listdir(scratch.root)),
+                         sorted(['sample.res', 'sample_001.res',
+                                 'sample_002.out', 'sample_user',
+                                 os.path.basename(more[0])]))
+
+    def test_tolerant_lookup(self):
+        store = cfxcache.ResultStore(os.path.join(self.tempdir, 'tol.db'))
+        store[(1.0, 100.0)] = (1.0,)
+        store[(2.0, 100.0)] = (2.0,)
+        self.assertRaises(KeyError, store.lookup, (1.0 + 1e-15, 100.0))
+        store.set_tolerances([0.0, 0.5], [1e-12, 0.0])
+        self.assertEqual(store.lookup((1.0 + 1e-15, 100.4)),
+                         ((1.0, 100.0), (1.0,)))
+        self.assertEqual(store.lookup((2.0, 100.0)), ((2.0, 100.0), (2.0,)))
+        self.assertRaises(KeyError, store.lookup, (1.0 + 1e-9, 100.0))
+        self.assertRaises(KeyError, store.lookup, (1.0, 100.6))
+        # rows written after the index was built are found too
+        store[(3.0, -100.0)] = (3.0,)
+        self.assertEqual(store.lookup((3.0, -99.9))[1], (3.0,))
+        # accepted relative to the stored value, not only the query's
+        store.set_tolerances([0.0, 0.0], [0.1, 0.0])
+        store[(1.105, 7.0)] = (4.0,)
+        self.assertEqual(store.lookup((1.0, 7.0)), ((1.105, 7.0), (4.0,)))
+        self.assertRaises(KeyError, store.lookup, (0.99, 7.0))
+        store.close()
+        # many inputs with wide tolerances
+        index = cfxcache.SortedIndex([0.5] * 20, [0.0] * 20)
+        for n in range(50):
+            index.add(tuple([float(n)] * 20), n)
+        self.assertEqual(index.find(tuple([10.3] * 20)),
+                         (tuple([10.0] * 20), 10))
+        self.assertEqual(index.find(tuple([10.3] * 19 + [12.0])), None)
         
 if __name__ == "__main__":
     unittest.main()
-    
\ No newline at end of file